@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+
+"""Benchmark the scraper's strategies against a local stand-in for the DCU papers web page and Google Drive (see 'standin')
+Each strategy lists a module's papers and downloads them into a fresh directory and catalog, measuring the time to list them,
+the papers downloaded per second, the time from start to end, and the time and round trips to the browser of each phase.
+The stand-in's downloads can be made slow ('--latency') and narrow ('--bandwidth') like the real ones.
+Results are written as JSON, and can be compared against an earlier run to catch regressions.
+All the strategies but 'cached' need Firefox and geckodriver ('--driver'), the ones that cannot start a browser are skipped"""
+
+
+import sys
+import os
+import os.path
+import io
+import time
+import json
+import platform
+import argparse
+import tempfile
+import shutil
+import datetime
+import contextlib
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import webscraper
+import downloader
+import catalog
+import standin
+import webtrace
+
+from selenium.common.exceptions import WebDriverException
+
+
+## strategies, how the papers are listed and how they are downloaded
+
+strategies = {
+    # the table read a page at a time, the papers downloaded over HTTP
+    'harvest': {'listing': 'harvest', 'download': 'http'},
+    # the table read paper by paper, the papers downloaded over HTTP
+    'per-row': {'listing': 'per-row', 'download': 'http'},
+    # the listing kept in the catalog from an earlier run (no browser), the papers downloaded over HTTP
+    'cached': {'listing': 'cached', 'download': 'http'},
+    # the papers downloaded by a pool of headless browsers
+    'pool': {'listing': 'harvest', 'download': 'pool'},
+    # the papers downloaded one at a time by the browser that listed them
+    'browser': {'listing': 'harvest', 'download': 'browser'},
+}
+
+
+def run_strategy(strategy, server, module, directory, opts):
+    """List and download the papers of 'module' from 'server' with 'strategy' into 'directory', returning the measurements"""
+    settings = strategies[strategy]
+    papers = catalog.Catalog(os.path.join(directory, '.papers.db'))
+    if settings['listing'] == 'cached':
+        papers.cache_listing(module, server.listing(module))
+    direct = None
+    if settings['download'] == 'http':
+        direct = downloader.Downloader(directory, concurrency=opts.concurrency, url_template=server.url(standin.DOWNLOAD_PATH),
+            loud=False)
+    tracer = webtrace.Tracer()
+    pool = webscraper.BrowserPool(opts.browsers, directory, loud=False, tracer=tracer) if settings['download'] == 'pool' else None
+    scraper = webscraper.DCU_Webscraper(module=module, papers=papers, downloader=direct, harvest=settings['listing'] != 'per-row',
+        pool=pool, make_browser=lambda: webscraper.headless_browser(directory), listing_ttl=3600, tracer=tracer)
+    try:
+        start = time.perf_counter()
+        links = scraper.list_papers(refresh=settings['listing'] != 'cached')
+        listed = time.perf_counter()
+        scraper.download(links)
+        end = time.perf_counter()
+        downloaded = papers.located(links)
+    finally:
+        scraper.close()
+        if direct is not None:
+            direct.close()
+        papers.close()
+    download_s = end - listed
+    return {
+        'list_s': listed - start,
+        'download_s': download_s,
+        'end_to_end_s': end - start,
+        'papers': len(links),
+        'downloaded': len(downloaded),
+        'papers_per_s': len(downloaded) / download_s if download_s else None,
+        'bytes': sum(os.path.getsize(path) for path in downloaded.values()),
+        # time and round trips to the browser of each phase (see 'webtrace')
+        'phases': {phase: {'seconds': total['seconds'], 'round_trips': total['round_trips']} for (phase, total) in tracer.totals().items()},
+    }
+
+
+def measure(strategy, server, module, tmp, opts):
+    """Run a strategy 'opts.repeat' times, each in a fresh directory, returning the results of the fastest run"""
+    runs = []
+    for i in range(opts.repeat):
+        directory = os.path.join(tmp, '{}-{}'.format(strategy, i))
+        os.makedirs(directory)
+        out = sys.stdout if opts.loud else io.StringIO()
+        with contextlib.redirect_stdout(out):
+            runs.append(run_strategy(strategy, server, module, directory, opts))
+        shutil.rmtree(directory)
+    best = min(runs, key=lambda run: run['end_to_end_s'])
+    best.update({
+        'strategy': strategy,
+        'end_to_end_s_all': [run['end_to_end_s'] for run in runs],
+    })
+    return best
+
+
+def run_all(opts, server, tmp):
+    results = []
+    webscraper.urls['main'] = server.url()
+    webscraper.paths['driver'] = opts.driver
+    for strategy in opts.strategies:
+        try:
+            result = measure(strategy, server, opts.module, tmp, opts)
+        except WebDriverException as exc:
+            print('{:>10} skipped, no browser ({})'.format(strategy, str(exc).strip().splitlines()[0]))
+            continue
+        # no rate without any time spent downloading
+        rate = '-' if result['papers_per_s'] is None else '{:.1f}'.format(result['papers_per_s'])
+        print('{strategy:>10} list {list_s:7.3f}s  download {download_s:7.3f}s  {rate:>8} papers/s  '
+            'end to end {end_to_end_s:7.3f}s  ({downloaded}/{papers} papers)'.format(rate=rate, **result))
+        results.append(result)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of what got worse by more than 'tolerance' (a fraction) since the 'baseline' results"""
+    regressions = []
+    before = {result['strategy']: result for result in baseline['results']}
+    for result in results:
+        old = before.get(result['strategy'])
+        if old is None:
+            continue
+        for key in ('list_s', 'end_to_end_s'):
+            if result[key] is not None and old[key] and result[key] > old[key]*(1+tolerance):
+                regressions.append('{} {}: {:.3f} -> {:.3f} (+{:.0%})'.format(result['strategy'], key,
+                    old[key], result[key], result[key]/old[key]-1))
+        if old['papers_per_s'] and result['papers_per_s'] is not None and result['papers_per_s'] < old['papers_per_s']*(1-tolerance):
+            regressions.append('{} papers_per_s: {:.1f} -> {:.1f} ({:.0%})'.format(result['strategy'],
+                old['papers_per_s'], result['papers_per_s'], result['papers_per_s']/old['papers_per_s']-1))
+    return regressions
+
+
+def list_arg(convert):
+    return lambda text: [convert(item) for item in text.split(',')]
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--module', default='CA117', help='module whose papers are scraped (default: CA117)')
+    parser.add_argument('--papers', type=int, default=40, help='papers of the module (default: 40)')
+    parser.add_argument('--others', type=int, default=2000, help='papers of other modules in the table (default: 2000)')
+    parser.add_argument('--recorded', metavar='FILE', help='use the papers of a saved papers web page instead of made up ones')
+    parser.add_argument('--latency', type=float, default=0.2, metavar='SECONDS',
+        help='time each download takes to start (default: 0.2)')
+    parser.add_argument('--bandwidth', type=float, default=2*1024*1024, metavar='BYTES',
+        help='bytes a second each download is sent at, 0 for no limit (default: 2 MiB)')
+    parser.add_argument('--size', type=int, default=256*1024, metavar='BYTES', help='size of each paper (default: 256 KiB)')
+    parser.add_argument('--draw-time', type=float, default=0.05, metavar='SECONDS',
+        help='time the table takes to draw itself again (default: 0.05)')
+    parser.add_argument('--strategies', type=list_arg(str), default=list(strategies),
+        help='comma separated, out of {} (default: all)'.format(', '.join(strategies)))
+    parser.add_argument('--concurrency', type=int, default=8, help='papers downloaded at the same time over HTTP (default: 8)')
+    parser.add_argument('--browsers', type=int, default=4, help='browsers in the pool (default: 4)')
+    parser.add_argument('--driver', default=webscraper.paths['driver'], help='path to geckodriver (default: {})'.format(webscraper.paths['driver']))
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each, the fastest is kept (default: 3)')
+    parser.add_argument('--loud', action='store_true', help='show what the scraper prints')
+    parser.add_argument('--out', metavar='FILE', help='write the results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='compare against the results of an earlier run, failing on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='fraction by which a measurement may get worse before it counts as a regression (default: 0.2)')
+    return parser
+
+
+def main():
+    parser = cli_parser()
+    opts = parser.parse_args()
+    for strategy in opts.strategies:
+        if strategy not in strategies:
+            parser.error('unknown strategy {}'.format(strategy))
+
+    if opts.recorded:
+        with open(opts.recorded, 'r', encoding='utf-8') as f:
+            records = standin.recorded_records(f.read())
+    else:
+        records = standin.generate_records(opts.module, opts.papers, opts.others)
+    server = standin.StandinServer(records, latency=opts.latency, bandwidth=opts.bandwidth or None, draw_time=opts.draw_time,
+        size=opts.size).start()
+    tmp = tempfile.mkdtemp()
+    try:
+        print('Serving {} papers at {}'.format(len(records), server.url()))
+        results = run_all(opts, server, tmp)
+    finally:
+        server.close()
+        shutil.rmtree(tmp)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'site': {
+                'papers': len(records),
+                'module': opts.module,
+                'recorded': opts.recorded,
+                'latency': opts.latency,
+                'bandwidth': opts.bandwidth,
+                'size': opts.size,
+                'draw_time': opts.draw_time,
+            },
+            'concurrency': opts.concurrency,
+            'browsers': opts.browsers,
+        },
+        'results': results,
+    }
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if opts.compare:
+        with open(opts.compare, 'r') as f:
+            regressions = compare(results, json.load(f), opts.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
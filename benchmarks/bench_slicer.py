@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+
+"""Benchmark the slicer's merge strategies against a synthetic corpus of exam papers
+Each strategy and number of workers is run in a fresh process, measuring wall time, pages per second,
+peak memory (RSS) and output size. Results are written as JSON, and can be compared against an earlier run to catch regressions"""
+
+
+import sys
+import os
+import os.path
+import time
+import json
+import platform
+import argparse
+import tempfile
+import shutil
+import subprocess
+import datetime
+
+try:
+    import resource
+except ImportError: # not available on Windows
+    resource = None
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+import slicer
+import corpus
+
+import PyPDF2 as pypdf
+
+
+## strategies, each slicing 'pdf_paths' at 'pg' into 'pathout' and returning the paths written
+
+def run_merge(pdf_paths, pg, pathout, workers):
+    merger = slicer.merge(pdf_paths, pg, loud=False)
+    slicer.save(merger, pathout, loud=False)
+    slicer.close(merger, loud=False)
+    return [pathout]
+
+
+def run_parallel(pdf_paths, pg, pathout, workers):
+    merger = slicer.merge_parallel(pdf_paths, pg, workers=workers, loud=False)
+    slicer.save(merger, pathout, loud=False)
+    slicer.close(merger, loud=False)
+    return [pathout]
+
+
+def run_stream(pdf_paths, pg, pathout, workers):
+    return slicer.merge_stream(pdf_paths, pg, pathout, workers=workers, loud=False)
+
+
+def run_stream_mmap(pdf_paths, pg, pathout, workers):
+    return slicer.merge_stream(slicer.map_paths(pdf_paths), pg, pathout, workers=workers, loud=False)
+
+
+def run_stream_compress(pdf_paths, pg, pathout, workers):
+    return slicer.merge_stream(pdf_paths, pg, pathout, workers=workers, loud=False, compress=True)
+
+
+strategies = {
+    'merge': run_merge,
+    'parallel': run_parallel,
+    'stream': run_stream,
+    'stream-mmap': run_stream_mmap,
+    'stream-compress': run_stream_compress,
+}
+
+# strategies that do not use worker processes, only run once
+serial_strategies = {'merge'}
+
+
+def peak_rss_kb(who):
+    """Peak resident set size in KiB of this process (who='self') or of its largest finished child ('children')"""
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF if who == 'self' else resource.RUSAGE_CHILDREN).ru_maxrss
+    if sys.platform == 'darwin':
+        rss //= 1024 # bytes on macOS
+    return rss
+
+
+def run_one(strategy, workers, directory, pages, pathout):
+    """Run a single strategy in this process and print its measurements as JSON"""
+    pdf_paths = slicer.sort_cyear(slicer.load_paths(directory, loud=False))
+    start = time.perf_counter()
+    outputs = strategies[strategy](pdf_paths, slicer.page_repr(pages), pathout, workers)
+    wall = time.perf_counter() - start
+    print(json.dumps({
+        'wall_s': wall,
+        'peak_rss_kb': peak_rss_kb('self'),
+        'workers_peak_rss_kb': peak_rss_kb('children'),
+        'outputs': outputs,
+    }))
+
+
+def measure(strategy, workers, directory, pages, outdir):
+    """Run a strategy in a fresh process, returning its results"""
+    pathout = os.path.join(outdir, '{}-{}.pdf'.format(strategy, workers))
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), '--run', strategy, str(workers), directory, pages, pathout],
+        stdout=subprocess.PIPE, check=True)
+    result = json.loads(proc.stdout.decode().splitlines()[-1])
+    outputs = result.pop('outputs')
+    pages_out = 0
+    for path in outputs:
+        with open(path, 'rb') as f:
+            pages_out += pypdf.PdfFileReader(f).getNumPages()
+    result['pages_out'] = pages_out
+    result['pages_per_s'] = pages_out / result['wall_s'] if result['wall_s'] else None
+    result['output_bytes'] = sum(os.path.getsize(path) for path in outputs)
+    return result
+
+
+def run_all(opts, directory, outdir):
+    results = []
+    for strategy in opts.strategies:
+        for workers in ([1] if strategy in serial_strategies else opts.workers):
+            runs = [measure(strategy, workers, directory, opts.slice, outdir) for _ in range(opts.repeat)]
+            best = min(runs, key=lambda run: run['wall_s'])
+            best.update({
+                'strategy': strategy,
+                'workers': workers,
+                'wall_s_all': [run['wall_s'] for run in runs],
+            })
+            print('{strategy:>15} x{workers:<3} {wall_s:8.3f}s {pages_per_s:10.1f} pages/s {peak_rss_kb:>9} KiB {output_bytes:>11} bytes'.format(**best))
+            results.append(best)
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Return a list of what got worse by more than 'tolerance' (a fraction) since the 'baseline' results"""
+    regressions = []
+    before = {(result['strategy'], result['workers']): result for result in baseline['results']}
+    for result in results:
+        old = before.get((result['strategy'], result['workers']))
+        if old is None:
+            continue
+        for key in ('wall_s', 'peak_rss_kb', 'output_bytes'):
+            if result[key] is not None and old[key] and result[key] > old[key]*(1+tolerance):
+                regressions.append('{} x{} {}: {} -> {} (+{:.0%})'.format(result['strategy'], result['workers'], key,
+                    old[key], result[key], result[key]/old[key]-1))
+    return regressions
+
+
+def size_arg(text):
+    """'WIDTHxHEIGHT' -> (width, height), or 'none' -> None"""
+    if text.lower() == 'none':
+        return None
+    width, height = text.lower().split('x')
+    return (int(width), int(height))
+
+
+def list_arg(convert):
+    return lambda text: [convert(item) for item in text.split(',')]
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--corpus', metavar='DIR', help='benchmark on the PDF\'s in DIR instead of generating a corpus')
+    parser.add_argument('--files', type=int, default=50, help='number of papers to generate (default: 50)')
+    parser.add_argument('--pages', type=int, default=4, help='pages per generated paper (default: 4)')
+    parser.add_argument('--page-size', type=size_arg, default=(595, 842), metavar='WxH', help='in points (default: 595x842, A4)')
+    parser.add_argument('--font-detail', type=int, default=8,
+        help='rectangles per glyph of the embedded font, 0 for no embedded font (default: 8)')
+    parser.add_argument('--image-size', type=size_arg, default=(256, 64), metavar='WxH',
+        help='pixels of the header image embedded in every paper, or none (default: 256x64)')
+    parser.add_argument('--slice', default='1', metavar='PAGES', help='pages to slice at (default: 1)')
+    parser.add_argument('--strategies', type=list_arg(str), default=list(strategies),
+        help='comma separated, out of {} (default: all)'.format(', '.join(strategies)))
+    parser.add_argument('--workers', type=list_arg(int), default=[1, 2, 4],
+        help='comma separated numbers of workers to try each strategy with (default: 1,2,4)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs of each, the fastest is kept (default: 3)')
+    parser.add_argument('--out', metavar='FILE', help='write the results as JSON to FILE')
+    parser.add_argument('--compare', metavar='FILE', help='compare against the results of an earlier run, failing on regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+        help='fraction by which a measurement may get worse before it counts as a regression (default: 0.2)')
+    parser.add_argument('--run', nargs=5, metavar=('STRATEGY', 'WORKERS', 'DIR', 'PAGES', 'PATHOUT'), help=argparse.SUPPRESS)
+    return parser
+
+
+def main():
+    parser = cli_parser()
+    opts = parser.parse_args()
+    if opts.run:
+        strategy, workers, directory, pages, pathout = opts.run
+        run_one(strategy, int(workers), directory, pages, pathout)
+        return
+    for strategy in opts.strategies:
+        if strategy not in strategies:
+            parser.error('unknown strategy {}'.format(strategy))
+
+    tmp = tempfile.mkdtemp()
+    try:
+        directory = opts.corpus
+        if directory is None:
+            directory = os.path.join(tmp, 'corpus')
+            print('Generating {} papers...'.format(opts.files))
+            corpus.generate(directory, files=opts.files, pages=opts.pages, page_size=opts.page_size,
+                font_detail=opts.font_detail, image_size=opts.image_size)
+        outdir = os.path.join(tmp, 'output')
+        os.makedirs(outdir)
+        results = run_all(opts, directory, outdir)
+    finally:
+        shutil.rmtree(tmp)
+
+    report = {
+        'meta': {
+            'date': datetime.datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'pypdf2': pypdf.__version__,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'corpus': opts.corpus or {
+                'files': opts.files,
+                'pages': opts.pages,
+                'page_size': opts.page_size,
+                'font_detail': opts.font_detail,
+                'image_size': opts.image_size,
+            },
+            'slice': opts.slice,
+        },
+        'results': results,
+    }
+    if opts.out:
+        with open(opts.out, 'w') as f:
+            json.dump(report, f, indent=2)
+    if opts.compare:
+        with open(opts.compare, 'r') as f:
+            regressions = compare(results, json.load(f), opts.tolerance)
+        for regression in regressions:
+            print('Regression: {}'.format(regression))
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+
+"""Run many slicing jobs in one go, from a manifest of (input directory, pages, output path) jobs
+All the jobs share a single pool of worker processes, and the jobs on the same input directory (with the same output options)
+are run together, so that each PDF is only read and parsed once for all of them (see 'slicer.merge_slices').
+The run ends with a report of how each job went"""
+
+
+import sys
+import os
+import os.path
+import time
+import json
+import shlex
+import argparse
+import collections
+import concurrent.futures
+
+import PyPDF2 as pypdf
+
+import slicer
+import pdfindex
+import triage
+import textindex
+import instrumentation
+
+
+Job = collections.namedtuple('Job', ['input', 'pages', 'output', 'chunk', 'compress', 'append'], defaults=(None, False, False))
+
+
+def read_manifest(path):
+    """Return the list of 'Job's in the manifest at 'path'. A manifest is either
+    JSON (a '.json' file), a list of objects with 'input', 'pages' and 'output', and optionally 'chunk', 'compress' and 'append',
+    or text, a job per line with the input directory, pages and output path separated by spaces (quoted if need be),
+    eg: ca117/ "text:binary search tree" out/ca117-bst.pdf. Empty lines and lines starting with # are left out.
+    Relative paths are taken to be relative to the manifest"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, 'r') as f:
+        if os.path.splitext(path)[1] == '.json':
+            jobs = [Job(**{key: value for (key, value) in job.items() if key in Job._fields}) for job in json.load(f)]
+        else:
+            jobs = []
+            for (n, line) in enumerate(f):
+                if not line.strip() or line.lstrip().startswith('#'):
+                    continue
+                fields = shlex.split(line)
+                if len(fields) != 3:
+                    raise ValueError('{} line {}: expected <input_directory> <pages> <output_path>, got {!r}'.format(path, n+1, line.strip()))
+                jobs.append(Job(*fields))
+    return [job._replace(input=os.path.join(base, job.input), output=os.path.join(base, job.output), pages=str(job.pages))
+        for job in jobs]
+
+
+def group_jobs(jobs):
+    """Group the jobs that can be run together, with a single read of their input directory, keeping the order they came in"""
+    groups = collections.OrderedDict()
+    for job in jobs:
+        key = (os.path.abspath(job.input), job.chunk, job.compress, job.append)
+        groups.setdefault(key, []).append(job)
+    return groups
+
+
+def page_count(path):
+    with open(path, 'rb') as f:
+        return pypdf.PdfFileReader(f).getNumPages()
+
+
+def run_group(jobs, metrics, executor=None, workers=1, quarantine=None, index=None, text=None, loud=True):
+    """Run jobs on the same input directory with the same options (see 'group_jobs'), returning a report of each
+    What happened to each PDF is taken from the 'instrumentation.Metrics' of the run"""
+    reports = []
+    slices = []
+    for job in jobs:
+        try:
+            slices.append((slicer.slice_repr(job.pages), job.output))
+        except Exception as exc:
+            reports.append(report(job, 'failed', error=exc))
+            continue
+        reports.append(None) # filled in once run
+    start = time.perf_counter()
+    try:
+        if not slices:
+            return reports
+        if loud:
+            print('Slicing {} at {}...'.format(jobs[0].input, ', '.join(str(pg) for (pg, pathout) in slices)))
+        pdf_paths = slicer.sort_cyear(slicer.load_paths(jobs[0].input, loud=False, metrics=metrics))
+        pdf_paths = slicer.filter_paths(pdf_paths, slices, quarantine=quarantine, index=index, metrics=metrics)
+        if any(isinstance(pg, str) for (pg, pathout) in slices):
+            slices, pdf_paths = slicer.search_pages(slices, pdf_paths, text or textindex.TextIndex(), metrics=metrics)
+        first = len(metrics.files)
+        paths = slicer.merge_slices(pdf_paths, slices, chunk_pages=jobs[0].chunk, workers=workers, loud=False, index=index,
+            append=jobs[0].append, compress=jobs[0].compress, metrics=metrics, executor=executor)
+    except Exception as exc:
+        seconds = time.perf_counter() - start
+        return [reports[i] or report(job, 'failed', seconds=seconds, error=exc) for (i, job) in enumerate(jobs)]
+    seconds = time.perf_counter() - start
+    failed = set(record['path'] for record in metrics.files[first:] if record['error'] is not None)
+    outputs = iter(zip(slices, paths))
+    for (i, job) in enumerate(jobs):
+        if reports[i] is None:
+            ((pg, pathout), job_paths) = next(outputs)
+            job_pdfs = usable_paths(pdf_paths, pg, index)
+            reports[i] = report(job, 'ok', seconds=seconds, pdfs=len(job_pdfs), skipped=sum(1 for path in job_pdfs if path in failed),
+                pages=sum(page_count(path) for path in job_paths), paths=job_paths)
+    return reports
+
+
+def usable_paths(pdf_paths, pg, index=None):
+    """The 'pdf_paths' that a slice at 'pg' could take pages from, as far as is known without opening them:
+    all but the ones without any of the pages found by a search, or known by a 'pdfindex.PdfIndex' to be too short"""
+    if isinstance(pg, textindex.PageSelection):
+        return [path for path in pdf_paths if pg.pages(path)]
+    if index is None:
+        return pdf_paths
+    usable = []
+    for path in pdf_paths:
+        entry = index.lookup(path)
+        if entry is not None and entry['ok'] and not range(*pg.indices(entry['page_count'])):
+            continue
+        usable.append(path)
+    return usable
+
+
+def report(job, status, seconds=None, pdfs=None, skipped=None, pages=None, paths=None, error=None):
+    """The report of a job, 'seconds' being the time taken by all the jobs run together with it"""
+    return {
+        'input': job.input,
+        'pages': job.pages,
+        'output': job.output,
+        'status': status,
+        'seconds': seconds,
+        'pdfs': pdfs,
+        'skipped': skipped,
+        'pages_out': pages,
+        'paths': paths,
+        'error': None if error is None else '{}: {}'.format(type(error).__name__, error),
+    }
+
+
+def run(jobs, workers=0, quarantine=None, index=None, text=None, loud=True, metrics=None):
+    """Run all the 'jobs' with a single pool of 'workers' processes (0 for one per CPU, 1 for none),
+    returning a report for each job, in the order of 'jobs'"""
+    metrics = metrics or instrumentation.Metrics()
+    reports = {}
+    executor = None
+    if workers != 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=workers or None)
+    try:
+        for (key, group) in group_jobs(jobs).items():
+            for (job, job_report) in zip(group, run_group(group, metrics, executor, workers or None, quarantine, index, text, loud)):
+                reports[id(job)] = job_report
+                if loud:
+                    print_report(job_report)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return [reports[id(job)] for job in jobs]
+
+
+def print_report(job_report):
+    if job_report['status'] == 'ok':
+        print('ok      {output} ({pages_out} pages from {pdfs} PDF\'s, {skipped} skipped, {seconds:.2f}s)'.format(**job_report))
+    else:
+        print('failed  {output} ({error})'.format(**job_report))
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('manifest', help='JSON or text file listing the jobs, see \'batch.read_manifest\'')
+    parser.add_argument('-j', '--workers', type=int, default=0,
+        help='number of processes to slice with, shared by all the jobs, 0 for one per CPU (default: 0)')
+    parser.add_argument('--report', metavar='FILE', help='write the report of each job to FILE as JSON')
+    parser.add_argument('--index', metavar='FILE', help='index of parsed PDF\'s to use and update, see slicer.py')
+    parser.add_argument('--quarantine', metavar='FILE', help='check each PDF before slicing, see slicer.py')
+    parser.add_argument('--text-index', metavar='FILE', help='for jobs slicing by text, keep the text of the pages in FILE')
+    parser.add_argument('--metrics', metavar='FILE', help='append measurements of the run to FILE as lines of JSON, see slicer.py')
+    return parser
+
+
+def main():
+    opts = cli_parser().parse_args()
+    jobs = read_manifest(opts.manifest)
+    quarantine = triage.Quarantine(opts.quarantine) if opts.quarantine else None
+    index = pdfindex.PdfIndex(opts.index) if opts.index else None
+    text = textindex.TextIndex(opts.text_index) if opts.text_index else None
+    metrics = instrumentation.Metrics(opts.metrics)
+    reports = run(jobs, opts.workers, quarantine, index, text, metrics=metrics)
+    summary = metrics.close()
+    for state in (quarantine, index, text):
+        if state is not None:
+            state.save()
+    failed = sum(1 for job_report in reports if job_report['status'] != 'ok')
+    print('{} jobs, {} failed, {:.2f}s'.format(len(reports), failed, summary['seconds']))
+    if opts.report:
+        with open(opts.report, 'w') as f:
+            json.dump(reports, f, indent=2)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+
+"""A catalog of the exam papers known about, in a SQLite database shared by the scraper and the slicer
+The scraper adds each paper it lists (module, year, link) and each PDF it downloads (where it is, its hash and page count),
+and the slicer picks PDF's by module, year and page count from it, eg: the CA117 papers from 2012 to 2018 with at least 3 pages,
+without listing directories or parsing the PDF's again.
+It is also the scraper's record of what has been downloaded, so that a run only downloads the papers that are new,
+or that an earlier run did not get to. A paper listed under more than one module is only kept once"""
+
+
+import sys
+import os
+import os.path
+import re
+import json
+import time
+import datetime
+import hashlib
+import collections
+import sqlite3
+
+import PyPDF2 as pypdf
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS papers (
+    id INTEGER PRIMARY KEY,
+    module TEXT,
+    year INTEGER,
+    link TEXT UNIQUE,
+    file_id TEXT,
+    path TEXT UNIQUE,
+    directory TEXT,
+    sha256 TEXT,
+    page_count INTEGER,
+    size INTEGER,
+    downloaded REAL,
+    same_as INTEGER
+);
+CREATE INDEX IF NOT EXISTS papers_module_year ON papers (module, year);
+CREATE INDEX IF NOT EXISTS papers_directory_year ON papers (directory, year);
+CREATE INDEX IF NOT EXISTS papers_sha256 ON papers (sha256);
+CREATE TABLE IF NOT EXISTS listings (
+    filter TEXT PRIMARY KEY,
+    fetched REAL,
+    papers TEXT
+);
+'''
+
+file_id_re = re.compile(r'/file/d/([\w-]+)|[?&]id=([\w-]+)')
+year_re = re.compile(r'(?:19|20)\d\d')
+
+
+def file_id(link):
+    """The Google Drive file id in a link to a paper, eg: https://drive.google.com/file/d/<id>/view, or None"""
+    match = file_id_re.search(link or '')
+    return (match.group(1) or match.group(2)) if match else None
+
+
+def parse_year(text):
+    """The year of a paper as listed, eg: 2018 for '2018' or '2018/2019', or None"""
+    match = year_re.search(str(text))
+    return int(match.group()) if match else None
+
+
+def filename_year(path):
+    """The year of a paper from the two digit year its filename starts with (see 'slicer.parse_cyear'), or None"""
+    digits = os.path.basename(path)[:2]
+    if not digits.isdigit():
+        return None
+    year = int(digits)
+    this_year = datetime.datetime.now().year
+    return year + (1900 if this_year % 100 < year else 2000)
+
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024*1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def count_pages(path):
+    """The page count of the PDF at 'path', or None if it does not parse"""
+    try:
+        with open(path, 'rb') as f:
+            return pypdf.PdfFileReader(f).getNumPages()
+    except Exception:
+        return None
+
+
+class Catalog():
+    """The catalog in the SQLite database at 'path' (created if need be, ':memory:' for one that is not kept)
+    Changes are committed as they are made. Use as a context manager, or call 'close' when done"""
+
+    def __init__(self, path=':memory:'):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.row_factory = sqlite3.Row
+        self.db.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM papers').fetchone()[0]
+
+    def close(self):
+        self.db.close()
+
+    def add_listing(self, module, year, link):
+        """Add a paper as listed on the papers web page, eg: from 'webscraper.DCU_Website.dcu_paper_data'"""
+        with self.db:
+            if self.db.execute('UPDATE papers SET module = ?, year = ? WHERE link = ?', (module.upper(), parse_year(year), link)).rowcount:
+                return
+            self.db.execute('INSERT INTO papers (module, year, link, file_id) VALUES (?, ?, ?, ?)',
+                (module.upper(), parse_year(year), link, file_id(link)))
+
+    def add_file(self, path, module=None, year=None, link=None, downloaded=None):
+        """Add the PDF at 'path', hashing it and counting its pages. Return where the PDF is kept.
+        With 'link' it is filled in to the listing of that link, and if it is the same as a paper already downloaded
+        (eg: listed under another module), the listing points to the paper already there, which is returned instead.
+        The file at 'path' is then no longer in the catalog, but is left for the caller to remove.
+        Otherwise 'module' and 'year' (taken from the filename if None) are what is known about it.
+        'downloaded' is when it was downloaded (seconds since the epoch), its modification time if None"""
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        values = {
+            'path': path,
+            'directory': os.path.dirname(path),
+            'sha256': hash_file(path),
+            'page_count': count_pages(path),
+            'size': stat.st_size,
+            'downloaded': downloaded if downloaded is not None else stat.st_mtime,
+            'same_as': None,
+        }
+        with self.db:
+            if link is not None and self.db.execute('SELECT 1 FROM papers WHERE link = ?', (link,)).fetchone():
+                original = self.db.execute('SELECT id, path FROM papers WHERE sha256 = ? AND path IS NOT NULL AND link IS NOT ? '
+                    'AND NOT (path = ? AND link IS NULL) ORDER BY id', (values['sha256'], link, path)).fetchone()
+                if original is not None and (original['path'] == path or os.path.isfile(original['path'])):
+                    values.update({'path': None, 'directory': os.path.dirname(original['path']), 'same_as': original['id']})
+                else:
+                    # the listing it was downloaded from, in place of what was known from the file alone
+                    self.db.execute('DELETE FROM papers WHERE path = ? AND link IS NULL', (path,))
+                self.db.execute('UPDATE papers SET path = :path, directory = :directory, sha256 = :sha256, page_count = :page_count, '
+                    'size = :size, downloaded = :downloaded, same_as = :same_as WHERE link = :link', dict(values, link=link))
+                return original['path'] if values['same_as'] is not None else path
+            values.update({
+                'module': module.upper() if module else None,
+                'year': parse_year(year) if year is not None else filename_year(path),
+                'link': link,
+                'file_id': file_id(link),
+            })
+            if self.db.execute('UPDATE papers SET module = COALESCE(:module, module), year = COALESCE(:year, year), '
+                    'link = COALESCE(:link, link), file_id = COALESCE(:file_id, file_id), sha256 = :sha256, page_count = :page_count, '
+                    'size = :size, downloaded = :downloaded WHERE path = :path', values).rowcount:
+                return path
+            self.db.execute('INSERT INTO papers (module, year, link, file_id, path, directory, sha256, page_count, size, downloaded) '
+                'VALUES (:module, :year, :link, :file_id, :path, :directory, :sha256, :page_count, :size, :downloaded)', values)
+        return path
+
+    def cache_listing(self, module_filter, records, fetched=None):
+        """Keep the (module, year, link) 'records' that the papers web page listed for 'module_filter' (what was typed into its
+        search box, eg: 'ca117'), as of 'fetched' (seconds since the epoch, now if None)"""
+        with self.db:
+            self.db.execute('INSERT OR REPLACE INTO listings (filter, fetched, papers) VALUES (?, ?, ?)',
+                (module_filter.lower(), fetched if fetched is not None else time.time(), json.dumps([list(record) for record in records])))
+
+    def listing_age(self, module_filter):
+        """Seconds since the listing for 'module_filter' was kept, None if there is none"""
+        row = self.db.execute('SELECT fetched FROM listings WHERE filter = ?', (module_filter.lower(),)).fetchone()
+        return time.time() - row['fetched'] if row is not None else None
+
+    def cached_listing(self, module_filter, ttl):
+        """The (module, year, link) records listed for 'module_filter' if they were kept less than 'ttl' seconds ago, otherwise None"""
+        row = self.db.execute('SELECT fetched, papers FROM listings WHERE filter = ?', (module_filter.lower(),)).fetchone()
+        if row is None or time.time() - row['fetched'] >= ttl:
+            return None
+        return [tuple(record) for record in json.loads(row['papers'])]
+
+    def located(self, links):
+        """Where the papers at 'links' that have been downloaded are, by link, leaving out the ones whose file
+        has gone or is not the size it was when downloaded (eg: cut short)"""
+        located = collections.OrderedDict()
+        for link in links:
+            row = self.db.execute('SELECT COALESCE(p.path, o.path) AS path, COALESCE(o.size, p.size) AS size FROM papers p '
+                'LEFT JOIN papers o ON o.id = p.same_as WHERE p.link = ?', (link,)).fetchone()
+            if row is not None and row['path'] is not None and os.path.isfile(row['path']) and os.path.getsize(row['path']) == row['size']:
+                located[link] = row['path']
+        return located
+
+    def pending(self, links):
+        """The 'links' of the papers that are to be downloaded: the ones not 'located'"""
+        located = self.located(links)
+        return [link for link in links if link not in located]
+
+    def add_directory(self, directory, module=None, loud=True):
+        """Add the PDF's in 'directory' that are not in the catalog, or have changed size since. Return how many were"""
+        directory = os.path.abspath(directory)
+        known = {row['path']: row['size'] for row in self.db.execute('SELECT path, size FROM papers WHERE directory = ?', (directory,))}
+        added = 0
+        for filename in sorted(os.listdir(directory)):
+            path = os.path.join(directory, filename)
+            if os.path.splitext(filename)[1] != '.pdf' or known.get(path) == os.path.getsize(path):
+                continue
+            if loud:
+                print('Cataloging {}...'.format(filename))
+            self.add_file(path, module=module)
+            added += 1
+        return added
+
+    def query(self, module=None, years=None, min_pages=None, directory=None):
+        """Return the rows of the downloaded papers, newest first, of 'module' (eg: 'ca117'), from 'years' (first, last) inclusive
+        (either can be None), with at least 'min_pages' pages, in 'directory'.
+        The path of a paper kept once for more than one listing is the path of the one kept"""
+        where = ['(p.path IS NOT NULL OR o.path IS NOT NULL)']
+        args = []
+        if module is not None:
+            where.append('p.module = ?')
+            args.append(module.upper())
+        if directory is not None:
+            where.append('p.directory = ?')
+            args.append(os.path.abspath(directory))
+        (first, last) = years or (None, None)
+        if first is not None:
+            where.append('p.year >= ?')
+            args.append(first)
+        if last is not None:
+            where.append('p.year <= ?')
+            args.append(last)
+        if min_pages is not None:
+            where.append('p.page_count >= ?')
+            args.append(min_pages)
+        sql = ('SELECT p.id, p.module, p.year, p.link, p.file_id, COALESCE(p.path, o.path) AS path, p.directory, p.sha256, '
+            'p.page_count, p.size, p.downloaded, p.same_as FROM papers p LEFT JOIN papers o ON o.id = p.same_as '
+            'WHERE {} ORDER BY p.year DESC, path DESC').format(' AND '.join(where))
+        return self.db.execute(sql, args).fetchall()
+
+    def paths(self, module=None, years=None, min_pages=None, directory=None):
+        """The paths of the PDF's of 'query', newest first, each once"""
+        paths = []
+        seen = set()
+        for row in self.query(module, years, min_pages, directory):
+            if row['path'] not in seen:
+                seen.add(row['path'])
+                paths.append(row['path'])
+        return paths
+
+
+def parse_years(text):
+    """(first, last) years from eg: '2012:2018', '2012:', ':2018' or '2015'"""
+    (first, sep, last) = text.partition(':')
+    if not sep:
+        last = first
+    return (int(first) if first else None, int(last) if last else None)
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2 or args[1] not in ('add', 'list') or (args[1] == 'add' and len(args) not in (3, 4)):
+        print('usage: catalog.py <catalog_file> add <directory> [<module>]')
+        print('       catalog.py <catalog_file> list [<module>] [<first_year>:<last_year>] [<min_pages>]')
+        sys.exit(2)
+    with Catalog(args[0]) as catalog:
+        if args[1] == 'add':
+            print('{} PDF\'s added'.format(catalog.add_directory(args[2], args[3] if len(args) == 4 else None)))
+            return
+        module = args[2] if len(args) > 2 and args[2] else None
+        years = parse_years(args[3]) if len(args) > 3 else None
+        min_pages = int(args[4]) if len(args) > 4 else None
+        for row in catalog.query(module, years, min_pages):
+            print('{} {} {} pages {}'.format(row['module'], row['year'], row['page_count'], row['path']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+
+"""Generate synthetic exam paper PDF's, for testing and benchmarking the slicer without any real papers
+Papers are named with a two digit year first, like the real ones (see 'slicer.sort_cyear'),
+and can embed the same font and header image on every page of every paper, like papers from the same institution do"""
+
+
+import sys
+import os
+import os.path
+import zlib
+import random
+import datetime
+import functools
+
+
+WORDS = ('algorithm', 'binary', 'search', 'tree', 'list', 'stack', 'queue', 'graph', 'sort', 'hash', 'table',
+    'function', 'class', 'object', 'method', 'recursion', 'complexity', 'pointer', 'array', 'string', 'loop',
+    'explain', 'describe', 'implement', 'write', 'show', 'compare', 'marks', 'python', 'program', 'output')
+
+
+def glyph_proc(code, detail):
+    """Content stream drawing the glyph for character 'code' of the Type 3 font, out of 'detail' rectangles"""
+    rng = random.Random(code)
+    ops = ['600 0 0 0 600 700 d1']
+    for _ in range(detail):
+        x, y = rng.randrange(0, 500), rng.randrange(0, 600)
+        ops.append('{} {} {} {} re'.format(x, y, rng.randrange(40, 100), rng.randrange(40, 100)))
+    ops.append('f')
+    return '\n'.join(ops).encode()
+
+
+@functools.lru_cache(maxsize=4)
+def header_image(width, height):
+    """Raw RGB pixels of the 'institution logo' image, the same for every paper"""
+    rng = random.Random(width*height)
+    rows = []
+    for y in range(height):
+        row = bytearray()
+        for x in range(width):
+            shade = (x*255//max(width-1, 1) + rng.randrange(0, 32)) % 256
+            row += bytes((shade, (shade+y) % 256, 255-shade))
+        rows.append(bytes(row))
+    return b''.join(rows)
+
+
+class PaperWriter():
+    """Builds up the objects of a single PDF, then writes them all out in 'write'"""
+
+    def __init__(self):
+        self.objects = []
+
+    def add(self, data):
+        """Add an object (bytes of its body), returning its object number"""
+        self.objects.append(data)
+        return len(self.objects)
+
+    def reserve(self):
+        return self.add(None)
+
+    def set(self, idnum, data):
+        self.objects[idnum-1] = data
+
+    def add_stream(self, data, entries=b'', compress=True):
+        if compress:
+            data = zlib.compress(data)
+            entries += b' /Filter /FlateDecode'
+        return self.add(b'<< /Length %d' % len(data) + entries + b' >>\nstream\n' + data + b'\nendstream')
+
+    def write(self, path, root):
+        out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+        offsets = []
+        for (i, data) in enumerate(self.objects):
+            offsets.append(len(out))
+            out += b'%d 0 obj\n' % (i+1) + data + b'\nendobj\n'
+        xref = len(out)
+        out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(self.objects)+1)
+        for offset in offsets:
+            out += b'%010d 00000 n \n' % offset
+        out += b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(self.objects)+1, root, xref)
+        with open(path, 'wb') as f:
+            f.write(out)
+        return len(out)
+
+
+def add_type3_font(pdf, detail):
+    """Add a Type 3 font (glyphs drawn by content streams, so embedded in the PDF itself) for the printable ASCII characters"""
+    first, last = 32, 126
+    procs = {code: pdf.add_stream(glyph_proc(code, detail)) for code in range(first, last+1)}
+    char_procs = b' '.join(b'/g%d %d 0 R' % (code, idnum) for (code, idnum) in procs.items())
+    differences = b' '.join(b'/g%d' % code for code in procs)
+    widths = b' '.join(b'600' for code in procs)
+    return pdf.add(b'<< /Type /Font /Subtype /Type3 /FontBBox [0 0 600 700] /FontMatrix [0.001 0 0 0.001 0 0]'
+        b' /CharProcs << ' + char_procs + b' >> /Encoding << /Type /Encoding /Differences [%d ' % first + differences + b'] >>'
+        b' /FirstChar %d /LastChar %d /Widths [' % (first, last) + widths + b'] /Resources << >> >>')
+
+
+def pdf_string(text):
+    """'text' as a PDF literal string"""
+    return '(' + text.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)') + ')'
+
+
+def write_paper(path, title, pages, page_size=(595, 842), font_detail=8, image_size=(256, 64), lines=30, seed=0):
+    """Write a single paper of 'pages' pages to 'path', returning its size in bytes
+    'font_detail' is the number of rectangles per glyph of the embedded font (0 for the standard, not embedded Helvetica),
+    'image_size' is the (width, height) in pixels of the header image on each page (None for no image)"""
+    rng = random.Random(seed)
+    width, height = page_size
+    pdf = PaperWriter()
+    root = pdf.reserve()
+    pages_id = pdf.reserve()
+    if font_detail:
+        font = add_type3_font(pdf, font_detail)
+    else:
+        font = pdf.add(b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+    resources = b'/Font << /F1 %d 0 R >>' % font
+    if image_size:
+        image = pdf.add_stream(header_image(*image_size),
+            b' /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB /BitsPerComponent 8' % image_size)
+        resources += b' /XObject << /Im1 %d 0 R >>' % image
+    kids = []
+    for page in range(pages):
+        ops = []
+        if image_size:
+            ops.append('q {} 0 0 {} 36 {} cm /Im1 Do Q'.format(image_size[0], image_size[1], height-36-image_size[1]))
+        ops.append('BT /F1 14 Tf 36 {} Td {} Tj ET'.format(height-140, pdf_string(title)))
+        ops.append('BT /F1 12 Tf 36 {} Td {} Tj ET'.format(height-160, pdf_string('Page {} of {}'.format(page+1, pages))))
+        for line in range(lines):
+            words = ' '.join(rng.choice(WORDS) for _ in range(rng.randrange(6, 12)))
+            ops.append('BT /F1 10 Tf 36 {} Td {} Tj ET'.format(height-190-line*14, pdf_string(words)))
+        contents = pdf.add_stream('\n'.join(ops).encode('latin-1'))
+        kids.append(pdf.add(b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Resources << ' % (pages_id, width, height)
+            + resources + b' >> /Contents %d 0 R >>' % contents))
+    pdf.set(pages_id, b'<< /Type /Pages /Kids [' + b' '.join(b'%d 0 R' % kid for kid in kids) + b'] /Count %d >>' % len(kids))
+    pdf.set(root, b'<< /Type /Catalog /Pages %d 0 R >>' % pages_id)
+    return pdf.write(path, root)
+
+
+def generate(directory, files=10, pages=4, module='CA117', page_size=(595, 842), font_detail=8, image_size=(256, 64), lines=30):
+    """Write 'files' papers into 'directory', one per year going back from this one, and return their paths
+    'pages' is the number of pages of every paper, or a list with the number of pages of each paper in turn.
+    See 'write_paper' for the rest"""
+    os.makedirs(directory, exist_ok=True)
+    if isinstance(pages, int):
+        pages = [pages] * files
+    this_year = datetime.datetime.now().year
+    paths = []
+    for (i, page_count) in enumerate(pages[:files]):
+        year = this_year - i
+        path = os.path.join(directory, '{:02d}-{}-{}.pdf'.format(year % 100, module.lower(), i))
+        title = '{} Examination {}'.format(module, year)
+        write_paper(path, title, page_count, page_size, font_detail, image_size, lines, seed=i)
+        paths.append(path)
+    return paths
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) not in (2, 3):
+        print('usage: corpus.py <directory> <number_of_papers> [<pages_per_paper>]')
+        sys.exit(2)
+    directory, files = args[0], int(args[1])
+    pages = int(args[2]) if len(args) == 3 else 4
+    paths = generate(directory, files, pages)
+    print('Generated {} papers in {}'.format(len(paths), directory))
+
+
+if __name__ == '__main__':
+    main()
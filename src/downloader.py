@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+"""Download papers straight from Google Drive over HTTP, many at a time, instead of through the browser
+The links harvested from the papers web page (https://drive.google.com/file/d/<id>/view) are turned into direct download URLs,
+fetched through a pool of kept-alive connections with up to so many downloads going at once, retried with backoff,
+and streamed to disk (into a .part file first, so that a file in the directory is always a whole one)"""
+
+
+import sys
+import os
+import os.path
+import re
+import time
+import random
+import asyncio
+import threading
+import itertools
+import collections
+import concurrent.futures
+
+import urllib3
+
+import catalog
+
+
+DRIVE_URL = 'https://drive.google.com/uc?export=download&id={}'
+
+filename_re = re.compile(r'filename\*?=(?:UTF-8\'\')?"?([^";]+)"?', re.IGNORECASE)
+confirm_re = re.compile(rb'confirm=([\w-]+)')
+
+CHUNK_SIZE = 64*1024
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+Download = collections.namedtuple('Download', ['link', 'path', 'status', 'error', 'attempts', 'bytes', 'seconds'])
+Download.__doc__ = """What became of downloading a paper: 'status' 'ok' (saved at 'path') or 'failed' (because of 'error')"""
+
+
+class DownloadError(Exception):
+    """A download that failed, 'retry' if it is worth trying again"""
+
+    def __init__(self, message, retry=False):
+        super().__init__(message)
+        self.retry = retry
+
+
+def safe_filename(name):
+    """'name' with anything that would take it out of the download directory replaced"""
+    name = os.path.basename(name.replace('\\', '/')).strip()
+    return re.sub(r'[^\w .()-]', '_', name) or 'paper.pdf'
+
+
+def unique_path(directory, filename, file_id, taken):
+    """The path in 'directory' to save the paper 'file_id' at as 'filename', without clashing with a file already there
+    or with the paths in 'taken' (being downloaded): 'filename', else with the file id added, else a number after that"""
+    (stem, ext) = os.path.splitext(filename)
+    if file_id and stem != file_id:
+        stem = '{}-{}'.format(stem, file_id)
+    names = itertools.chain([filename, stem + ext], ('{}-{}{}'.format(stem, i, ext) for i in itertools.count(1)))
+    for name in names:
+        path = os.path.join(directory, name)
+        if path not in taken and not os.path.exists(path):
+            return path
+
+
+class Downloader():
+    """Downloads papers into 'directory', 'concurrency' at a time, trying each up to 'retries' more times after the first
+    (waiting 'backoff' seconds, then twice that, and so on). 'url_template' makes the download URL from a paper's file id"""
+
+    def __init__(self, directory, concurrency=8, retries=3, backoff=0.5, timeout=30, url_template=DRIVE_URL, loud=True):
+        self.directory = os.path.abspath(directory)
+        self.concurrency = concurrency
+        self.retries = retries
+        self.backoff = backoff
+        self.url_template = url_template
+        self.loud = loud
+        self.downloading = set() # paths being downloaded to
+        self.downloading_lock = threading.Lock()
+        self.http = urllib3.PoolManager(maxsize=concurrency, block=True, retries=False,
+            timeout=urllib3.Timeout(connect=timeout, read=timeout))
+
+    def url(self, link):
+        """The direct download URL of the paper at 'link', None if it is not a link to a file on Google Drive"""
+        file_id = catalog.file_id(link)
+        return self.url_template.format(file_id) if file_id else None
+
+    def claim(self, filename, file_id):
+        """Return the path to download the paper 'file_id' named 'filename' to (see 'unique_path'),
+        taken until the download is over, so that papers of the same name do not get written to the same file"""
+        with self.downloading_lock:
+            path = unique_path(self.directory, filename, file_id, self.downloading)
+            self.downloading.add(path)
+        return path
+
+    def fetch(self, link):
+        """Download the paper at 'link' (blocking), returning (path, bytes) or raising 'DownloadError'"""
+        url = self.url(link)
+        if url is None:
+            raise DownloadError('not a link to a file: {}'.format(link))
+        try:
+            response = self.http.request('GET', url, preload_content=False)
+            try:
+                if response.status in RETRY_STATUSES:
+                    raise DownloadError('HTTP {}'.format(response.status), retry=True)
+                if response.status != 200:
+                    raise DownloadError('HTTP {}'.format(response.status))
+                if response.headers.get('Content-Type', '').startswith('text/html'):
+                    # a page asking to confirm the download (files too big to be scanned for viruses), or an error page
+                    match = confirm_re.search(response.read())
+                    if match is None:
+                        raise DownloadError('got a web page instead of the paper')
+                    response.release_conn()
+                    response = self.http.request('GET', '{}&confirm={}'.format(url, match.group(1).decode()), preload_content=False)
+                    if response.status != 200:
+                        raise DownloadError('HTTP {} confirming the download'.format(response.status), retry=response.status in RETRY_STATUSES)
+                match = filename_re.search(response.headers.get('Content-Disposition', ''))
+                filename = safe_filename(match.group(1)) if match else '{}.pdf'.format(catalog.file_id(link))
+                path = self.claim(filename, catalog.file_id(link))
+                part = path + '.part'
+                try:
+                    size = 0
+                    with open(part, 'wb') as f:
+                        for chunk in response.stream(CHUNK_SIZE):
+                            f.write(chunk)
+                            size += len(chunk)
+                    # Content-Length counts the bytes sent, before any Content-Encoding is undone
+                    length = response.headers.get('Content-Length')
+                    if length is not None and int(length) != response.tell():
+                        raise DownloadError('got {} of {} bytes'.format(response.tell(), length), retry=True)
+                    os.replace(part, path)
+                except BaseException:
+                    if os.path.exists(part):
+                        os.remove(part) # so that a file in the directory is always a whole one
+                    raise
+                finally:
+                    with self.downloading_lock:
+                        self.downloading.discard(path)
+                return (path, size)
+            finally:
+                response.release_conn()
+        except urllib3.exceptions.HTTPError as exc:
+            raise DownloadError('{}: {}'.format(type(exc).__name__, exc), retry=True)
+
+    async def download(self, link, slots, executor, on_download=None):
+        """Download the paper at 'link' once one of the 'slots' is free, retrying with backoff. Return a 'Download'
+        'on_download(download)' is called with it once downloaded, in the thread running the downloads"""
+        start = time.perf_counter()
+        attempts = 0
+        async with slots:
+            while True:
+                attempts += 1
+                try:
+                    (path, size) = await asyncio.get_event_loop().run_in_executor(executor, self.fetch, link)
+                except DownloadError as exc:
+                    if not exc.retry or attempts > self.retries:
+                        if self.loud:
+                            print('Failed {} ({})'.format(link, exc))
+                        return Download(link, None, 'failed', str(exc), attempts, 0, time.perf_counter() - start)
+                    await asyncio.sleep(self.backoff * 2**(attempts-1) * random.uniform(0.5, 1.5))
+                    continue
+                except Exception as exc:
+                    # not worth retrying, but no reason to give up on the other papers
+                    if self.loud:
+                        print('Failed {} ({}: {})'.format(link, type(exc).__name__, exc))
+                    return Download(link, None, 'failed', '{}: {}'.format(type(exc).__name__, exc), attempts, 0,
+                        time.perf_counter() - start)
+                if self.loud:
+                    print('Downloaded {}'.format(os.path.basename(path)))
+                download = Download(link, path, 'ok', None, attempts, size, time.perf_counter() - start)
+                if on_download is not None:
+                    on_download(download)
+                return download
+
+    async def download_all(self, links, on_download=None):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        slots = asyncio.Semaphore(self.concurrency)
+        with concurrent.futures.ThreadPoolExecutor(self.concurrency) as executor:
+            return await asyncio.gather(*(self.download(link, slots, executor, on_download) for link in links))
+
+    def run(self, links, on_download=None):
+        """Download the papers at 'links', returning a 'Download' for each, in order
+        'on_download(download)' is called with each paper as soon as it has been downloaded, if given"""
+        return asyncio.run(self.download_all(links, on_download))
+
+    def close(self):
+        self.http.clear()
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) < 2:
+        print('usage: downloader.py <directory> <link> [<link> ...]')
+        sys.exit(2)
+    downloader = Downloader(args[0])
+    downloads = downloader.run(args[1:])
+    downloader.close()
+    failed = [download for download in downloads if download.status != 'ok']
+    print('{} downloaded, {} failed'.format(len(downloads) - len(failed), len(failed)))
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+
+"""Know when the browser has finished downloading papers, instead of sleeping and hoping it has
+The download directory is watched (with inotify on Linux, by polling elsewhere) for the files the browser saves into it:
+each new file is put down to the paper whose download was started last, and is finished once its partial file
+(eg: <name>.part for Firefox) is gone"""
+
+
+import sys
+import os
+import os.path
+import time
+import select
+import ctypes
+import ctypes.util
+import collections
+
+
+# suffixes of the files browsers download into before renaming them to the file's name
+PARTIAL_SUFFIXES = ('.part', '.crdownload', '.download')
+
+# inotify(7) event masks
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+Completion = collections.namedtuple('Completion', ['done', 'timed_out'])
+Completion.__doc__ = """The downloads that finished ('done', paths by paper URL) and the URLs of the ones that did not in time ('timed_out')"""
+
+
+class Inotify():
+    """Waits for something to change in 'directory', with Linux's inotify (through ctypes)"""
+
+    def __init__(self, directory):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        mask = IN_CREATE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE | IN_CLOSE_WRITE | IN_MODIFY
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, 'inotify_add_watch failed for {}'.format(directory))
+
+    def wait(self, timeout):
+        """Block until something changes or 'timeout' seconds pass. Return if something changed"""
+        (ready, _, _) = select.select([self.fd], [], [], max(timeout, 0))
+        if not ready:
+            return False
+        try:
+            while os.read(self.fd, 64*1024):
+                pass # the events themselves are not needed, the directory is looked at again
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller():
+    """Waits for something to change by waiting 'interval' seconds, for when inotify is not there"""
+
+    def __init__(self, interval=0.25):
+        self.interval = interval
+
+    def wait(self, timeout):
+        time.sleep(max(min(timeout, self.interval), 0))
+        return True
+
+    def close(self):
+        pass
+
+
+def watcher(directory, poll_interval=0.25):
+    """An 'Inotify' for 'directory' if it can be had, a 'Poller' otherwise"""
+    if sys.platform.startswith('linux'):
+        try:
+            return Inotify(directory)
+        except (OSError, AttributeError):
+            pass
+    return Poller(poll_interval)
+
+
+def final_name(filename):
+    """The name the file being downloaded into 'filename' will have, eg: 12_ca117.pdf for 12_ca117.pdf.part"""
+    for suffix in PARTIAL_SUFFIXES:
+        if filename.endswith(suffix):
+            return filename[:-len(suffix)]
+    return filename
+
+
+class DownloadTracker():
+    """Tracks the downloads into 'directory' started after it is made. Call 'started' right after starting each download,
+    then 'wait' for them all to finish. Use as a context manager, or call 'close' when done"""
+
+    def __init__(self, directory, poll_interval=0.25):
+        self.directory = os.path.abspath(directory)
+        self.watcher = watcher(self.directory, poll_interval)
+        self.known = set(final_name(filename) for filename in os.listdir(self.directory))
+        self.names = collections.OrderedDict() # paper URL -> name of its file, None if its download never started
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self.watcher.close()
+
+    def wait_until(self, done, timeout):
+        """Wait until 'done()' or 'timeout' seconds pass, looking again each time the directory changes. Return 'done()'"""
+        deadline = time.monotonic() + timeout
+        while not done():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return done()
+            self.watcher.wait(remaining)
+        return True
+
+    def new_names(self):
+        filenames = os.listdir(self.directory)
+        names = set(final_name(filename) for filename in filenames) - self.known
+        # the earliest first, if more than one download started
+        return sorted(names, key=lambda name: min(self.mtime(name + suffix) for suffix in ('',) + PARTIAL_SUFFIXES))
+
+    def mtime(self, filename):
+        try:
+            return os.stat(os.path.join(self.directory, filename)).st_mtime_ns
+        except OSError:
+            return float('inf')
+
+    def started(self, url, timeout=10):
+        """Put the next new file in the directory down to the download of 'url', waiting up to 'timeout' seconds for it to show up"""
+        found = []
+        def appeared():
+            found[:] = self.new_names()
+            return bool(found)
+        if self.wait_until(appeared, timeout):
+            self.known.add(found[0])
+            self.names[url] = found[0]
+        else:
+            self.names[url] = None
+
+    def finished(self, name):
+        """If the file 'name' has been downloaded, there being no partial file for it"""
+        filenames = set(os.listdir(self.directory))
+        return name in filenames and not any(name + suffix in filenames for suffix in PARTIAL_SUFFIXES)
+
+    def wait(self, timeout=60):
+        """Wait for the downloads started to finish, up to 'timeout' seconds. Return a 'Completion'"""
+        pending = [name for name in self.names.values() if name is not None]
+        def all_finished():
+            pending[:] = [name for name in pending if not self.finished(name)]
+            return not pending
+        self.wait_until(all_finished, timeout)
+        done = collections.OrderedDict()
+        timed_out = []
+        for (url, name) in self.names.items():
+            if name is not None and name not in pending:
+                done[url] = os.path.join(self.directory, name)
+            else:
+                timed_out.append(url)
+        return Completion(done, timed_out)
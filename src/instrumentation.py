@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+
+"""Measurements of a slicing run: how long each phase took, and for each PDF how long it took, how many pages came out of it
+and how big it is on disk. Each measurement is handed to the callbacks and written out as a line of JSON as it is made,
+so that a run over a big batch can be followed, and added up in 'summary' at the end"""
+
+
+import sys
+import os.path
+import time
+import json
+import collections
+import contextlib
+
+
+class Metrics():
+    """Collects the measurements of a run. Each measurement is a dict with an 'event' of 'phase', 'file', 'written' or 'summary',
+    written as a line of JSON to the file at path 'jsonl' (or to stderr for '-', apart from the progress messages)
+    and handed to each of the 'callbacks'"""
+
+    def __init__(self, jsonl=None, callbacks=()):
+        self.callbacks = list(callbacks)
+        self.out = None
+        if jsonl == '-':
+            self.out = sys.stderr
+        elif jsonl is not None:
+            self.out = open(jsonl, 'a')
+        self.started = time.perf_counter()
+        self.phases = collections.OrderedDict() # name -> seconds, added up if the phase happens more than once
+        self.files = [] # the 'file' measurements
+        self.exceptions = collections.Counter() # exception type name -> number of PDF's
+        self.pages = 0
+        self.file_size = 0 # on disk, of the PDF's recorded
+        self.bytes_written = 0
+
+    def emit(self, record):
+        for callback in self.callbacks:
+            callback(record)
+        if self.out is not None:
+            self.out.write(json.dumps(record) + '\n')
+            self.out.flush()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Time what is done in the with block as the phase 'name', eg: with metrics.phase('load'): ..."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.phases[name] = self.phases.get(name, 0) + seconds
+            self.emit({'event': 'phase', 'phase': name, 'seconds': seconds})
+
+    def file(self, pdf, seconds, pages, exc=None):
+        """Record that 'pages' pages were taken out of the PDF 'pdf' (a path, or None if not a file) in 'seconds'
+        (parsing it included), or that it was skipped because of 'exc'.
+        Its 'file_size' is its size on disk, not what was read of it: PDF's that are memory-mapped or opened through
+        a 'pdfindex.PdfIndex' are read only in part, and skipped ones maybe not at all. None if it is not a file, or is gone"""
+        file_size = None
+        if pdf is not None:
+            try:
+                file_size = os.path.getsize(pdf)
+            except OSError:
+                pass # moved or deleted since
+        record = {
+            'event': 'file',
+            'path': pdf,
+            'seconds': seconds,
+            'pages': pages,
+            'file_size': file_size,
+            'error': None if exc is None else type(exc).__name__,
+            'message': None if exc is None else str(exc),
+        }
+        self.files.append(record)
+        self.pages += pages
+        self.file_size += file_size or 0
+        if exc is not None:
+            self.exceptions[type(exc).__name__] += 1
+        self.emit(record)
+
+    def written(self, path):
+        """Record that the output file at 'path' was written"""
+        size = os.path.getsize(path)
+        self.bytes_written += size
+        self.emit({'event': 'written', 'path': path, 'bytes': size})
+
+    def slowest(self, count=10):
+        """The 'file' measurements of the 'count' PDF's that took the longest"""
+        return sorted(self.files, key=lambda record: record['seconds'], reverse=True)[:count]
+
+    def summary(self):
+        return {
+            'event': 'summary',
+            'seconds': time.perf_counter() - self.started,
+            'phases': dict(self.phases),
+            'files': len(self.files),
+            'pages': self.pages,
+            'file_size': self.file_size,
+            'bytes_written': self.bytes_written,
+            'exceptions': dict(self.exceptions),
+            'slowest': [{'path': record['path'], 'seconds': record['seconds']} for record in self.slowest(5)],
+        }
+
+    def close(self):
+        """Hand out the 'summary', and close the JSON lines file. Return the summary"""
+        summary = self.summary()
+        self.emit(summary)
+        if self.out is not None and self.out is not sys.stderr:
+            self.out.close()
+        self.out = None
+        return summary
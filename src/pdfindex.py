@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+
+"""An on-disk index of what parsing each PDF found out: its page count, where its objects and pages are, and if it parsed at all
+Entries are keyed by the PDF's path, and only trusted while the file's size and modification time stay the same"""
+
+
+import os
+import os.path
+import json
+import time
+
+import PyPDF2 as pypdf
+from PyPDF2.pdf import PageObject
+from PyPDF2.generic import NameObject, DictionaryObject, IndirectObject
+
+
+INHERITABLE_PAGE_ATTRIBUTES = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+
+def file_key(path):
+    """Return (absolute path, size, modification time) of a file, what an index entry is valid for"""
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    return (path, stat.st_size, stat.st_mtime_ns)
+
+
+def describe(reader):
+    """Return the index entry data for a PdfFileReader that has been read without errors
+    'xref' and 'pages' are left out (None) if the PDF can not be reopened from them, eg: encrypted PDF's"""
+    entry = {
+        'ok': True,
+        'error': None,
+        'page_count': reader.getNumPages(),
+        'xref': None,
+        'objstm': None,
+        'root': None,
+        'pages': None,
+    }
+    if reader.isEncrypted:
+        return entry
+    refs = [page.indirectRef for page in reader.flattenedPages]
+    if None in refs:
+        return entry
+    entry['xref'] = {str(gen): {str(num): offset for (num, offset) in offsets.items()} for (gen, offsets) in reader.xref.items()}
+    entry['objstm'] = {str(num): list(location) for (num, location) in reader.xref_objStm.items()}
+    root = reader.trailer.raw_get('/Root')
+    entry['root'] = [root.idnum, root.generation]
+    entry['pages'] = [[ref.idnum, ref.generation] for ref in refs]
+    return entry
+
+
+def describe_error(exc):
+    """Return the index entry data for a PDF that could not be parsed because of 'exc'"""
+    return {
+        'ok': False,
+        'error': '{}: {}'.format(type(exc).__name__, exc),
+        'page_count': None,
+        'xref': None,
+        'objstm': None,
+        'root': None,
+        'pages': None,
+    }
+
+
+class IndexedPdfFileReader(pypdf.PdfFileReader):
+    """A PdfFileReader that takes the cross-reference table and the page list from an index entry,
+    instead of parsing them out of the file. Pages are only read in when asked for"""
+
+    def __init__(self, stream, entry, strict=True):
+        self.entry = entry
+        self.page_cache = {}
+        super().__init__(stream, strict=strict)
+
+    def read(self, stream):
+        self.xref = {int(gen): {int(num): offset for (num, offset) in offsets.items()} for (gen, offsets) in self.entry['xref'].items()}
+        self.xref_objStm = {int(num): tuple(location) for (num, location) in self.entry['objstm'].items()}
+        self.trailer = DictionaryObject({NameObject('/Root'): IndirectObject(*self.entry['root'], self)})
+
+    def getNumPages(self):
+        return len(self.entry['pages'])
+
+    def getPage(self, pageNumber):
+        if self.flattenedPages is not None:
+            return self.flattenedPages[pageNumber]
+        idnum, generation = self.entry['pages'][pageNumber]
+        if (idnum, generation) not in self.page_cache:
+            self.page_cache[(idnum, generation)] = self._indexed_page(IndirectObject(idnum, generation, self))
+        return self.page_cache[(idnum, generation)]
+
+    def _flatten(self, pages=None, inherit=None, indirectRef=None):
+        self.flattenedPages = [self.getPage(i) for i in range(self.getNumPages())]
+
+    def _indexed_page(self, ref):
+        """Read a page straight from its object, picking up the attributes it inherits from its parents in the page tree
+        (like '_flatten' does when walking down the tree)"""
+        page = ref.getObject()
+        node = page
+        while '/Parent' in node:
+            node = node['/Parent'].getObject()
+            for attr in INHERITABLE_PAGE_ATTRIBUTES:
+                if attr in node and attr not in page:
+                    page[NameObject(attr)] = node[attr]
+        page_obj = PageObject(self, ref)
+        page_obj.update(page)
+        return page_obj
+
+
+class PdfIndex():
+    """The index, stored as JSON at 'path'. Changes are kept in memory until 'save' is called
+    Only the 'max_entries' most recently used entries are kept when saving"""
+
+    def __init__(self, path, max_entries=2000):
+        self.path = path
+        self.max_entries = max_entries
+        self.entries = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except ValueError:
+                self.entries = {} # corrupt index, start again
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, pdf):
+        """Return the entry for the file at 'pdf', or None if there is none or the file has changed since"""
+        path, size, mtime = file_key(pdf)
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        if (entry['size'], entry['mtime']) != (size, mtime):
+            del self.entries[path]
+            return None
+        entry['used'] = time.time()
+        return entry
+
+    def record(self, pdf, data):
+        """Store the entry data (from 'describe' or 'describe_error') for the file at 'pdf'"""
+        path, size, mtime = file_key(pdf)
+        entry = dict(data, size=size, mtime=mtime, used=time.time())
+        self.entries[path] = entry
+        return entry
+
+    def invalidate(self, pdfs=None):
+        """Forget the entries for 'pdfs', or everything if None"""
+        if pdfs is None:
+            self.entries.clear()
+            return
+        for pdf in pdfs:
+            self.entries.pop(os.path.abspath(pdf), None)
+
+    def prefilter(self, pdfs, page_nrs):
+        """Return 'pdfs' without the ones that are known to be broken, or to have none of the pages 'page_nrs'"""
+        kept = []
+        for pdf in pdfs:
+            entry = self.lookup(pdf) if isinstance(pdf, str) else None
+            if entry is not None:
+                if not entry['ok']:
+                    continue
+                start, stop, step = page_nrs.indices(entry['page_count'])
+                if not range(start, stop, step):
+                    continue
+            kept.append(pdf)
+        return kept
+
+    def open(self, pdf, stream):
+        """Return a PdfFileReader for the PDF at path 'pdf', open as 'stream'
+        The reader skips parsing by using the index if it can, otherwise the PDF is parsed and recorded.
+        Failures to parse are recorded too, then raised again"""
+        entry = self.lookup(pdf)
+        if entry is not None and entry['ok'] and entry['pages'] is not None:
+            return IndexedPdfFileReader(stream, entry)
+        try:
+            reader = pypdf.PdfFileReader(stream)
+            data = describe(reader)
+        except Exception as exc:
+            self.record(pdf, describe_error(exc))
+            raise
+        self.record(pdf, data)
+        return reader
+
+    def save(self):
+        """Write the index out, evicting the least recently used entries above 'max_entries'"""
+        if len(self.entries) > self.max_entries:
+            recent = sorted(self.entries.items(), key=lambda item: item[1]['used'], reverse=True)
+            self.entries = dict(recent[:self.max_entries])
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(tmp, self.path)
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+
+"""Memory-mapped, read-only PDF inputs
+A 'MappedPdf' behaves like a file opened with 'rb', but is read straight out of the OS page cache through a memory map,
+that is only made when the file is first read from. A 'MapPool' caps how many maps (and so file handles) are open at once"""
+
+
+import os.path
+import mmap
+import collections
+
+
+class MapPool():
+    """Keeps at most 'max_open' of the 'MappedPdf's that use it mapped at a time, unmapping the ones mapped the longest ago
+    An unmapped 'MappedPdf' maps itself again the next time it is read from, where it left off"""
+
+    def __init__(self, max_open=64):
+        self.max_open = max_open
+        self.mapped = collections.OrderedDict()
+
+    def opened(self, pdf):
+        self.mapped[id(pdf)] = pdf
+        while len(self.mapped) > self.max_open:
+            (key, oldest) = self.mapped.popitem(last=False)
+            oldest.unmap()
+
+    def closed(self, pdf):
+        self.mapped.pop(id(pdf), None)
+
+    def close(self):
+        for pdf in list(self.mapped.values()):
+            pdf.unmap()
+        self.mapped.clear()
+
+
+class MappedPdf():
+    """A file-like object for reading the file at 'path', backed by a memory map
+    While mapped, 'read', 'seek' and 'tell' are those of the map itself, so reading is as fast as from an open file.
+    Each 'read' still copies the bytes asked for out of the map, but the file as a whole is never read into memory,
+    only the pages of it that are read from are brought in. Pickles as just its path, so it can be sent to worker processes,
+    which map the same file (sharing the page cache) instead of copying it over"""
+
+    mode = 'rb'
+
+    def __init__(self, path, pool=None):
+        self.name = path
+        self.pool = pool
+        self.map = None
+        self.pos = 0
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(type(self).__name__, self.name)
+
+    def __getstate__(self):
+        return {'name': self.name, 'pool': None, 'map': None, 'pos': 0}
+
+    def _map(self):
+        with open(self.name, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.map.seek(self.pos)
+        # instance attributes take over from the methods below until unmapped
+        self.read, self.seek, self.tell = self.map.read, self.map.seek, self.map.tell
+        if self.pool is not None:
+            self.pool.opened(self)
+
+    def unmap(self):
+        """Let go of the map and its file handle, remembering the position"""
+        if self.map is None:
+            return
+        self.pos = self.map.tell()
+        del self.read, self.seek, self.tell
+        self.map.close()
+        self.map = None
+
+    def read(self, size=-1):
+        self._map()
+        return self.read(size)
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._map()
+        return self.seek(offset, whence)
+
+    def tell(self):
+        return self.pos
+
+    def close(self):
+        self.unmap()
+        self.pos = 0
+        if self.pool is not None:
+            self.pool.closed(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
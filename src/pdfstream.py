@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+
+"""Write PDF's straight to a stream, copying pages over from one source document at a time
+Unlike PyPDF2's PdfFileWriter/PdfFileMerger, nothing from a source is held on to once its pages are written,
+so memory use does not grow with the number of sources. Streams (fonts, images, ...) that are the same in different
+sources are only written once, and the other objects can be packed into compressed object streams.
+Pages can also be added to a PDF written earlier, as an incremental update that leaves what is already there untouched"""
+
+
+import os
+import io
+import zlib
+import struct
+import codecs
+import hashlib
+import collections
+
+from PyPDF2.generic import (NameObject, NumberObject, ArrayObject, DictionaryObject, StreamObject,
+    IndirectObject, createStringObject)
+
+
+def has_refs(value):
+    """Whether a direct object has indirect references in it"""
+    if isinstance(value, IndirectObject):
+        return True
+    if isinstance(value, dict):
+        return any(has_refs(item) for item in value.values())
+    if isinstance(value, list):
+        return any(has_refs(item) for item in value)
+    return False
+
+
+def stream_key(obj):
+    """Hash of a stream object's entries and (still encoded) data, or None if its entries refer to other objects,
+    in which case streams can not be told apart by their content alone"""
+    entries = io.BytesIO()
+    for (key, value) in sorted(obj.items()):
+        if key == '/Length':
+            continue
+        if has_refs(value):
+            return None
+        key.writeToStream(entries, None)
+        value.writeToStream(entries, None)
+    return hashlib.blake2b(entries.getvalue() + b'\0' + obj._data, digest_size=16).digest()
+
+
+class PdfStreamWriter():
+    """A PDF being written to 'stream' (a binary file object, opened for writing)
+    Call 'add_pages' once per source document, then 'close' to write the page tree and the cross-reference table.
+    With 'compress' the objects other than streams are written into compressed object streams (PDF 1.5),
+    'objects_per_stream' at a time, with a cross-reference stream instead of a table.
+    With 'previous' (the 'state' of a writer that wrote the PDF in 'stream' before, opened for reading and writing)
+    the new objects are appended to it as an incremental update instead, the page tree being written again over
+    the old one. 'kids' can be reordered before closing, to put the new pages in between the old ones"""
+
+    def __init__(self, stream, previous=None, compress=False, objects_per_stream=100):
+        self.stream = stream
+        self.previous = previous
+        self.compress = compress if previous is None else previous.get('compress', False)
+        self.objects_per_stream = objects_per_stream
+        # 'stream_key' -> object number of the streams written, to only write each once
+        self.streams = {} if previous is None else {bytes.fromhex(key): idnum for (key, idnum) in previous.get('streams', {}).items()}
+        self.batch = [] # (object number, data) of the objects waiting to go into the next object stream
+        if previous is None:
+            self.base = stream.tell()
+            # where each object is, by object number - 1: its byte offset, (object stream number, index in it) if compressed,
+            # or None for ones not written (yet)
+            self.offsets = []
+            self.kids = [] # object numbers of the pages, in order
+            self.stream.write(b'%PDF-1.5\n' if self.compress else b'%PDF-1.3\n')
+            self.pages_id = self._reserve() # the page tree root, written by 'close'
+        else:
+            self.base = 0
+            self.stream.seek(0, os.SEEK_END)
+            self.offsets = [None] * previous['objects']
+            self.kids = list(previous['kids'])
+            self.pages_id = previous['pages_id']
+
+    @property
+    def page_count(self):
+        return len(self.kids)
+
+    def _reserve(self):
+        """Return a new object number, with the object to be written later"""
+        self.offsets.append(None)
+        return len(self.offsets)
+
+    def _write_object(self, idnum, obj, refs, pending):
+        if self.compress:
+            out = io.BytesIO()
+            self._write_value(obj, refs, pending, out)
+            self.batch.append((idnum, out.getvalue()))
+            if len(self.batch) >= self.objects_per_stream:
+                self._flush_objects()
+            return
+        self.offsets[idnum-1] = self.stream.tell() - self.base
+        self.stream.write('{} 0 obj\n'.format(idnum).encode())
+        self._write_value(obj, refs, pending, self.stream)
+        self.stream.write(b'\nendobj\n')
+
+    def _flush_objects(self):
+        """Write the objects waiting in 'batch' out as a single object stream"""
+        if not self.batch:
+            return
+        stream_id = self._reserve()
+        header = []
+        body = io.BytesIO()
+        for (i, (idnum, data)) in enumerate(self.batch):
+            header.append('{} {}'.format(idnum, body.tell()))
+            body.write(data)
+            body.write(b'\n')
+            self.offsets[idnum-1] = (stream_id, i)
+        header = ' '.join(header).encode() + b'\n'
+        data = zlib.compress(header + body.getvalue())
+        self.offsets[stream_id-1] = self.stream.tell() - self.base
+        self.stream.write('{} 0 obj\n<<\n/Type /ObjStm\n/N {}\n/First {}\n/Filter /FlateDecode\n/Length {}\n>>\nstream\n'.format(
+            stream_id, len(self.batch), len(header), len(data)).encode())
+        self.stream.write(data)
+        self.stream.write(b'\nendstream\nendobj\n')
+        self.batch = []
+
+    def _write_value(self, value, refs, pending, out):
+        """Write a direct object to 'out', renumbering the indirect references in it to objects of this PDF
+        Referenced objects that have not been seen yet are queued up in 'pending'"""
+        if isinstance(value, IndirectObject):
+            if value.pdf is self:
+                idnum = value.idnum
+            else:
+                idnum = self._ref(value, refs, pending)
+            if idnum is None:
+                out.write(b'null')
+            else:
+                out.write('{} 0 R'.format(idnum).encode())
+        elif isinstance(value, StreamObject):
+            # streams can only be indirect objects
+            out.write('{} 0 R'.format(self._stream_ref(value, pending)).encode())
+        elif isinstance(value, DictionaryObject):
+            out.write(b'<<\n')
+            for (key, item) in value.items():
+                key.writeToStream(out, None)
+                out.write(b' ')
+                self._write_value(item, refs, pending, out)
+                out.write(b'\n')
+            out.write(b'>>')
+        elif isinstance(value, ArrayObject):
+            out.write(b'[')
+            for item in value:
+                out.write(b' ')
+                self._write_value(item, refs, pending, out)
+            out.write(b' ]')
+        else:
+            value.writeToStream(out, None)
+
+    def _write_stream(self, idnum, obj, refs, pending):
+        self.offsets[idnum-1] = self.stream.tell() - self.base
+        self.stream.write('{} 0 obj\n'.format(idnum).encode())
+        entries = DictionaryObject(obj)
+        entries[NameObject('/Length')] = NumberObject(len(obj._data))
+        self._write_value(entries, refs, pending, self.stream)
+        self.stream.write(b'\nstream\n')
+        self.stream.write(obj._data)
+        self.stream.write(b'\nendstream\nendobj\n')
+
+    def _stream_ref(self, obj, pending):
+        """Object number in this PDF for a stream object, the one already written if there is the same stream"""
+        key = stream_key(obj)
+        if key is not None and key in self.streams:
+            return self.streams[key]
+        idnum = self._reserve()
+        if key is not None:
+            self.streams[key] = idnum
+        pending.append((idnum, obj))
+        return idnum
+
+    def _ref(self, ref, refs, pending):
+        """Object number in this PDF for a reference into the source, or None if it should become null"""
+        key = (ref.idnum, ref.generation)
+        if key in refs:
+            return refs[key]
+        try:
+            obj = ref.getObject()
+        except ValueError:
+            # unresolvable, same as PdfFileWriter
+            return None
+        if isinstance(obj, DictionaryObject) and obj.get('/Type') in ('/Page', '/Pages'):
+            # a page that is not being copied (eg: the target of a link), do not drag in the whole source document
+            return None
+        if isinstance(obj, StreamObject):
+            idnum = self._stream_ref(obj, pending)
+        else:
+            idnum = self._reserve()
+            pending.append((idnum, obj))
+        refs[key] = idnum
+        return idnum
+
+    def add_pages(self, reader, page_nrs):
+        """Copy the pages with indices 'page_nrs' from a PdfFileReader, along with everything they use
+        If the source turns out to be broken half-way, the output is rolled back to how it was before the call
+        and the exception is raised again. Return the number of pages added"""
+        pages = [reader.getPage(i) for i in page_nrs]
+        self._flush_objects() # so that a roll back does not take objects of earlier sources with it
+        mark = (self.stream.tell(), len(self.offsets), len(self.kids))
+        refs = {}
+        pending = collections.deque()
+        try:
+            page_ids = []
+            for page in pages:
+                idnum = self._reserve()
+                page_ids.append(idnum)
+                if page.indirectRef is not None:
+                    refs[(page.indirectRef.idnum, page.indirectRef.generation)] = idnum
+            for (idnum, page) in zip(page_ids, pages):
+                entries = DictionaryObject((key, value) for (key, value) in page.items() if key != '/Parent')
+                entries[NameObject('/Parent')] = IndirectObject(self.pages_id, 0, self)
+                self._write_object(idnum, entries, refs, pending)
+                while pending:
+                    (pending_id, obj) = pending.popleft()
+                    if isinstance(obj, StreamObject):
+                        self._write_stream(pending_id, obj, refs, pending)
+                    else:
+                        self._write_object(pending_id, obj, refs, pending)
+        except Exception:
+            pos, objects, kids = mark
+            self.stream.seek(pos)
+            self.stream.truncate()
+            del self.offsets[objects:]
+            del self.kids[kids:]
+            self.batch = []
+            self.streams = {key: idnum for (key, idnum) in self.streams.items() if idnum <= objects}
+            raise
+        self.kids += page_ids
+        return len(page_ids)
+
+    def state(self):
+        """What another writer needs to know to append to this PDF once it is closed, JSON serializable"""
+        return {
+            'objects': len(self.offsets),
+            'kids': self.kids,
+            'pages_id': self.pages_id,
+            'root': self.root_id,
+            'info': self.info_id,
+            'startxref': self.startxref,
+            'compress': self.compress,
+            'streams': {key.hex(): idnum for (key, idnum) in self.streams.items()},
+        }
+
+    def _xref_sections(self):
+        """Yield (first object number, entries) for each run of objects written, entry None being the free list head"""
+        first, entries = (0, [None]) if self.previous is None else (None, [])
+        for (i, entry) in enumerate(self.offsets):
+            if entry is not None and first is not None and first + len(entries) == i+1:
+                entries.append(entry)
+                continue
+            if entries:
+                yield (first, entries)
+            first, entries = (i+1, [entry]) if entry is not None else (None, [])
+        if entries:
+            yield (first, entries)
+
+    def _write_xref_table(self, trailer):
+        self.stream.write(b'xref\n')
+        for (first, offsets) in self._xref_sections():
+            self.stream.write('{} {}\n'.format(first, len(offsets)).encode())
+            for offset in offsets:
+                if offset is None:
+                    self.stream.write(b'0000000000 65535 f \n')
+                else:
+                    self.stream.write('{:010d} 00000 n \n'.format(offset).encode())
+        self.stream.write(b'trailer\n<<\n' + trailer + b'>>\n')
+
+    def _write_xref_stream(self, trailer):
+        """Write the cross-reference stream, which takes the place of both the table and the trailer"""
+        xref_id = self._reserve()
+        self.offsets[xref_id-1] = self.startxref
+        width = max(4, (self.startxref.bit_length()+7) // 8)
+        index = []
+        rows = io.BytesIO()
+        for (first, entries) in self._xref_sections():
+            index.append('{} {}'.format(first, len(entries)))
+            for entry in entries:
+                if entry is None:
+                    kind, field2, field3 = (0, 0, 65535)
+                elif isinstance(entry, tuple):
+                    kind, (field2, field3) = (2, entry)
+                else:
+                    kind, field2, field3 = (1, entry, 0)
+                rows.write(struct.pack('>B', kind) + field2.to_bytes(width, 'big') + struct.pack('>H', field3))
+        data = zlib.compress(rows.getvalue())
+        self.stream.write('{} 0 obj\n<<\n/Type /XRef\n/Size {}\n/W [ 1 {} 2 ]\n/Index [ {} ]\n'.format(
+            xref_id, len(self.offsets)+1, width, ' '.join(index)).encode())
+        self.stream.write(trailer + '/Filter /FlateDecode\n/Length {}\n>>\nstream\n'.format(len(data)).encode())
+        self.stream.write(data)
+        self.stream.write(b'\nendstream\nendobj\n')
+
+    def close(self):
+        """Write the page tree, document catalog, and cross-reference table (or stream), finishing the PDF
+        When appending, the catalog of the earlier PDF is kept, and only the objects written since go in the table.
+        The stream itself is left open"""
+        refs = {}
+        pending = collections.deque()
+        pages = DictionaryObject({
+            NameObject('/Type'): NameObject('/Pages'),
+            NameObject('/Count'): NumberObject(len(self.kids)),
+            NameObject('/Kids'): ArrayObject(IndirectObject(idnum, 0, self) for idnum in self.kids),
+        })
+        self._write_object(self.pages_id, pages, refs, pending)
+        if self.previous is None:
+            self.info_id = self._reserve()
+            info = DictionaryObject({
+                NameObject('/Producer'): createStringObject(codecs.BOM_UTF16_BE + 'PyPDF2'.encode('utf-16be')),
+            })
+            self._write_object(self.info_id, info, refs, pending)
+            self.root_id = self._reserve()
+            root = DictionaryObject({
+                NameObject('/Type'): NameObject('/Catalog'),
+                NameObject('/Pages'): IndirectObject(self.pages_id, 0, self),
+            })
+            self._write_object(self.root_id, root, refs, pending)
+        else:
+            self.info_id, self.root_id = self.previous['info'], self.previous['root']
+        self._flush_objects()
+
+        self.startxref = self.stream.tell() - self.base
+        trailer = '/Root {} 0 R\n/Info {} 0 R\n'.format(self.root_id, self.info_id)
+        if self.previous is not None:
+            trailer += '/Prev {}\n'.format(self.previous['startxref'])
+        if self.compress:
+            self._write_xref_stream(trailer.encode())
+        else:
+            self._write_xref_table('/Size {}\n'.format(len(self.offsets)+1).encode() + trailer.encode())
+        self.stream.write('startxref\n{}\n%%EOF\n'.format(self.startxref).encode())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+
+"""Download a module's papers and slice them in one go, each paper being sliced as soon as it has been downloaded
+instead of once all of them have been, so that the whole takes about as long as the longer of downloading and slicing.
+Downloaded papers are handed to the slicing through a queue of so many papers at most (downloads wait when it is full),
+the slices of each paper are written to temporary files, and put together in the order of 'slicer.sort_cyear' once all the papers are in"""
+
+
+import os
+import os.path
+import queue
+import shutil
+import tempfile
+import argparse
+import threading
+import collections
+import concurrent.futures
+
+import PyPDF2 as pypdf
+
+import slicer
+import catalog
+import downloader
+import instrumentation
+import webscraper
+
+
+class SliceStage():
+    """Slices the PDF's handed to it with 'put' at each of the page ranges 'slices', in a thread of its own,
+    with a pool of 'workers' processes (0 for one per CPU, 1 for none). 'put' waits while there are 'queue_size' PDF's waiting.
+    Each slice is written to a file in a directory of the stage's own as soon as it is done, until 'close'.
+    If the slicing fails, 'put' and 'finish' raise what it raised instead of waiting for it"""
+
+    def __init__(self, slices, workers=0, queue_size=8):
+        self.slices = slices
+        self.workers = workers
+        self.queue = queue.Queue(queue_size)
+        self.directory = tempfile.mkdtemp(prefix='slices-')
+        self.results = collections.OrderedDict() # path -> what 'slicer.extract_slices' returned for it, with paths for the data
+        self.seen = set()
+        self.error = None # what the slicing raised, if it failed
+        self.thread = threading.Thread(target=self.run)
+        self.thread.start()
+
+    def _handover(self, item):
+        while True:
+            if not self.thread.is_alive():
+                raise self.error or RuntimeError('the slicing stopped')
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def put(self, path):
+        """Hand the PDF at 'path' over to be sliced, once (a paper listed more than once is only sliced once)"""
+        if path not in self.seen:
+            self.seen.add(path)
+            self._handover(path)
+
+    def keep(self, path, result):
+        """Write the slices of the PDF at 'path' to files, keeping their paths instead of the data"""
+        (datas, exc, entry, seconds) = result
+        paths = None
+        if datas is not None:
+            paths = []
+            for (i, data) in enumerate(datas):
+                paths.append(os.path.join(self.directory, '{}-{}.pdf'.format(len(self.results), i)))
+                with open(paths[-1], 'wb') as f:
+                    f.write(data)
+        self.results[path] = (paths, exc, entry, seconds)
+
+    def run(self):
+        try:
+            self.slice_all()
+        except BaseException as exc:
+            self.error = exc
+
+    def slice_all(self):
+        if self.workers == 1:
+            for path in iter(self.queue.get, None):
+                self.keep(path, slicer.extract_slices(path, self.slices))
+            return
+        window = 2 * (self.workers or os.cpu_count() or 1)
+        futures = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers or None) as executor:
+            for path in iter(self.queue.get, None):
+                futures.append((path, executor.submit(slicer.extract_slices, path, self.slices)))
+                while len(futures) > window or (futures and futures[0][1].done()):
+                    (done, future) = futures.popleft()
+                    self.keep(done, future.result())
+            for (path, future) in futures:
+                self.keep(path, future.result())
+
+    def finish(self):
+        """Wait for the PDF's handed over to be sliced. Return what 'slicer.extract_slices' returned for each, by path,
+        with the paths of the files the slices were written to instead of their data"""
+        self._handover(None)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+    def close(self):
+        """Remove the files the slices were written to"""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def order_papers(paths):
+    """'paths' most recent first (see 'slicer.sort_cyear'), or sorted by name if their filenames do not start with a year,
+    so that the slices come out in the same order whichever paper downloaded first"""
+    try:
+        return slicer.sort_cyear(paths)
+    except ValueError:
+        return sorted(paths)
+
+
+def scrape_slice(scraper, links, slices, workers=0, queue_size=8, compress=False, loud=True, metrics=None):
+    """Download the papers at 'links' with 'scraper' (a 'webscraper.DCU_Webscraper') and slice them as they come in,
+    'slices' being a list of (page range, output path) pairs. Papers the scraper's catalog has downloaded already
+    are sliced first, while the rest download. Return the list of paths written for each slice"""
+    metrics = metrics or instrumentation.Metrics()
+    page_ranges = [page_nrs for (page_nrs, pathout) in slices]
+    stage = SliceStage(page_ranges, workers, queue_size)
+    outputs = [slicer.StreamOutput(pathout, compress=compress) for (page_nrs, pathout) in slices]
+    try:
+        try:
+            with metrics.phase('download'):
+                if scraper.papers is not None:
+                    for path in scraper.papers.located(links).values():
+                        stage.put(path)
+                scraper.download(links, on_download=lambda link, path: stage.put(path))
+        finally:
+            with metrics.phase('slice'):
+                results = stage.finish()
+
+        with metrics.phase('merge'):
+            for (i, path) in enumerate(order_papers(results)):
+                (sliced, exc, entry, seconds) = results[path]
+                if loud:
+                    print('Processing {}: {}...'.format(i+1, path))
+                page_count = 0
+                for (output, sliced_path) in zip(outputs, sliced or []):
+                    with open(sliced_path, 'rb') as f:
+                        reader = pypdf.PdfFileReader(f)
+                        page_count += output.add_pages(reader, range(reader.getNumPages()), path)
+                metrics.file(path, seconds, page_count, exc)
+                if exc is not None and loud:
+                    print('Exception: {}'.format(exc))
+                    print('skipping...')
+        with metrics.phase('save'):
+            paths = [output.finish() for output in outputs]
+        for path in sum(paths, []):
+            metrics.written(path)
+        return paths
+    finally:
+        for output in outputs:
+            output.close()
+        stage.close()
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('module', help='module code of the papers, eg: ca117')
+    parser.add_argument('directory', help='directory to save the papers in')
+    parser.add_argument('pages', help='page to slice at (zero-based), or a range of pages, eg: 2, 1:3')
+    parser.add_argument('pathout', help='directory and file where to save the sliced PDF')
+    parser.add_argument('--slice', nargs=2, action='append', default=[], metavar=('PAGES', 'PATHOUT'),
+        help='(can be repeated) another page to slice at and file to save it in, as for slicer.py')
+    parser.add_argument('-j', '--workers', type=int, default=0,
+        help='number of processes to slice with, 0 for one per CPU, 1 for none (default: 0)')
+    parser.add_argument('--queue', type=int, default=8, metavar='PAPERS',
+        help='papers that can be waiting to be sliced before downloads wait for the slicing (default: 8)')
+    parser.add_argument('--concurrency', type=int, default=8, help='papers to download at the same time (default: 8)')
+    parser.add_argument('--catalog', metavar='FILE', help='catalog of the papers, see webscraper.py (default: .papers.db in the directory)')
+    parser.add_argument('--listing-ttl', type=float, default=24, metavar='HOURS', help='as for webscraper.py (default: 24)')
+    parser.add_argument('--compress', action='store_true', help='as for slicer.py')
+    parser.add_argument('--metrics', metavar='FILE', help='as for slicer.py')
+    return parser
+
+
+def main():
+    parser = cli_parser()
+    opts = parser.parse_args()
+    for (pages, pathout) in [(opts.pages, opts.pathout)] + opts.slice:
+        if slicer.page_query(pages) is not None:
+            parser.error('pages can only be given by number, not searched for: {}'.format(pages))
+    slices = [(slicer.page_repr(pages), pathout) for (pages, pathout) in [(opts.pages, opts.pathout)] + opts.slice]
+    directory = os.path.abspath(opts.directory)
+    os.makedirs(directory, exist_ok=True)
+    webscraper.paths['save_dir'] = directory
+    metrics = instrumentation.Metrics(opts.metrics)
+    papers = catalog.Catalog(opts.catalog or os.path.join(directory, '.papers.db'))
+    direct = downloader.Downloader(directory, concurrency=opts.concurrency)
+    make_browser = lambda: webscraper.DCU_Website(firefox_profile=webscraper.DCU_Website.dcu_autosave_profile(),
+        executable_path=webscraper.paths['driver'])
+    scraper = webscraper.DCU_Webscraper(module=opts.module, papers=papers, downloader=direct, pool=webscraper.BrowserPool(),
+        make_browser=make_browser, listing_ttl=opts.listing_ttl * 3600)
+    try:
+        with metrics.phase('list'):
+            links = scraper.list_papers()
+        scrape_slice(scraper, links, slices, opts.workers, opts.queue, opts.compress, metrics=metrics)
+    finally:
+        scraper.close()
+        direct.close()
+        papers.close()
+    summary = metrics.close()
+    print('Done in {:.2f}s'.format(summary['seconds']))
+
+
+if __name__ == '__main__':
+    main()
@@ -6,35 +6,57 @@ Examples of operations include taking a certain page from each PDF, etc"""
 
 import sys
 import os.path
+import re
+import io
+import json
+import time
+import argparse
 import datetime
-import tempfile
+import collections
+import concurrent.futures
 
 import PyPDF2 as pypdf
 
+import pdfstream
+import pdfindex
+import pdfmap
+import triage
+import textindex
+import instrumentation
+import catalog
 
-def load_files(directory, loud=True):
+
+def load_files(directory, loud=True, metrics=None):
     """Return a list of open file objects"""
     if loud:
         print('Loading...')
-    orig = os.getcwd()
-    os.chdir(directory)
+    metrics = metrics or instrumentation.Metrics()
     pdfs = []
-    for filename in os.listdir(directory):
-        if os.path.splitext(filename)[1] != '.pdf':
-            print('{} from its extension appears not to be a PDF file... skipping'.format(filename))
-            continue
-        else:
-            pdfs.append(open(filename, 'rb'))
-    os.chdir(orig)
+    with metrics.phase('load'):
+        for filename in os.listdir(directory):
+            if os.path.splitext(filename)[1] != '.pdf':
+                if loud:
+                    print('{} from its extension appears not to be a PDF file... skipping'.format(filename))
+                continue
+            else:
+                pdfs.append(open(os.path.join(directory, filename), 'rb'))
     return pdfs
 
 
-def load_paths(directory, loud=True):
+def load_paths(directory, loud=True, metrics=None):
     """Return a list of absolute paths to files"""
     if loud:
         print('Loading...')
-    directory = os.path.abspath(directory)
-    return [os.path.join(directory, filename) for filename in os.listdir(directory) if os.path.splitext(filename)[1] == '.pdf']
+    metrics = metrics or instrumentation.Metrics()
+    with metrics.phase('load'):
+        directory = os.path.abspath(directory)
+        return [os.path.join(directory, filename) for filename in os.listdir(directory) if os.path.splitext(filename)[1] == '.pdf']
+
+
+def map_paths(paths, pool=None):
+    """Return a list of memory-mapped file objects ('pdfmap.MappedPdf') for a list of paths
+    Files are only opened once read from, and with a 'pdfmap.MapPool' only so many are open at a time"""
+    return [pdfmap.MappedPdf(path, pool) for path in paths]
 
 
 def parse_cyear(path):
@@ -51,10 +73,8 @@ def sort_cyear(paths, most_recent=True):
     last_century = set([path for path in paths if this_year < parse_cyear(path)]) # eg: 18 < 99
     this_century = paths_set - last_century # set difference
     if most_recent:
-        print('here1')
         return sorted(list(this_century), reverse=True) + sorted(list(last_century), reverse=True)
     else:
-        print('here2')
         return sorted(list(last_century)) + sorted(list(this_century))
 
 
@@ -62,95 +82,443 @@ def page_repr(pages):
     return pypdf.PageRange(pages)
 
 
-def merge(pdfs, page_nrs, loud=True):
+def page_query(pages):
+    """Return (query, regex) for pages given as a search of their text, 'text:<words>' or 're:<regular expression>',
+    eg: 'text:binary search tree', or None for pages given by number"""
+    for (prefix, regex) in (('text:', False), ('re:', True)):
+        if pages.startswith(prefix):
+            return (pages[len(prefix):], regex)
+    return None
+
+
+def slice_repr(pages):
+    """Pages to slice at, as a page range, or as they are if they are to be searched for (see 'page_query' and 'search_pages')
+    Raises 're.error' for a regular expression that does not compile"""
+    query = page_query(pages)
+    if query is None:
+        return page_repr(pages)
+    if query[1]:
+        re.compile(query[0])
+    return pages
+
+
+def filter_paths(pdf_paths, slices, quarantine=None, index=None, metrics=None):
+    """Return the 'pdf_paths' that are of use to any of the 'slices' ((pages, output path) pairs),
+    without the ones that a 'triage.Quarantine' finds broken, or that a 'pdfindex.PdfIndex' knows to be broken,
+    or to be too short for all the slices"""
+    metrics = metrics or instrumentation.Metrics()
+    page_ranges = [pypdf.PageRange(':') if isinstance(pg, str) else pg for (pg, pathout) in slices]
+    if quarantine is not None:
+        with metrics.phase('triage'):
+            pdf_paths = quarantine.triage(pdf_paths)
+            kept = set()
+            for pg in page_ranges:
+                kept.update(quarantine.triage(pdf_paths, pg, loud=False))
+            pdf_paths = [path for path in pdf_paths if path in kept]
+    if index is not None:
+        with metrics.phase('index'):
+            kept = set()
+            for pg in page_ranges:
+                kept.update(index.prefilter(pdf_paths, pg))
+            pdf_paths = [path for path in pdf_paths if path in kept]
+    return pdf_paths
+
+
+def search_pages(slices, pdf_paths, text, metrics=None):
+    """Search a 'textindex.TextIndex' for the pages of the 'slices' ((pages, output path) pairs) that are given as searches,
+    adding the PDF's at 'pdf_paths' to it first. Return the slices with 'textindex.PageSelection's for pages,
+    and the paths of the PDF's that have any pages to slice at"""
+    metrics = metrics or instrumentation.Metrics()
+    with metrics.phase('text-index'):
+        text.update(pdf_paths)
+    with metrics.phase('search'):
+        slices = [(text.search(*page_query(pg), pdfs=pdf_paths) if isinstance(pg, str) else pg, pathout) for (pg, pathout) in slices]
+    if all(isinstance(pg, textindex.PageSelection) for (pg, pathout) in slices):
+        # no need to open the PDF's without any of the pages
+        pdf_paths = [path for path in pdf_paths if any(pg.pages(path) for (pg, pathout) in slices)]
+    return (slices, pdf_paths)
+
+
+def page_indices(page_nrs, pdf, page_count):
+    """The indices of the pages of 'pdf' (with 'page_count' pages) to slice at,
+    'page_nrs' being a page range or a 'textindex.PageSelection'"""
+    if isinstance(page_nrs, textindex.PageSelection):
+        return [i for i in page_nrs.pages(pdf_path(pdf)) if i < page_count]
+    return range(*page_nrs.indices(page_count))
+
+
+def page_runs(page_nrs, pdf):
+    """The pages of 'pdf' to slice at as a list of what 'PdfFileMerger.append' takes: just the page range,
+    or (start, stop) pairs of consecutive pages for a 'textindex.PageSelection'"""
+    if isinstance(page_nrs, textindex.PageSelection):
+        return page_nrs.runs(pdf_path(pdf))
+    return [page_nrs]
+
+
+def merge(pdfs, page_nrs, loud=True, index=None, metrics=None):
+    """Slice the PDF's at 'page_nrs' into a PdfFileMerger, held in memory until it is saved
+    How long each PDF took and how many pages came out of it is recorded in 'metrics' ('instrumentation.Metrics')"""
     if loud:
         print('Processing...')
+    metrics = metrics or instrumentation.Metrics()
     merger = pypdf.PdfFileMerger()
-    for (i, pdf) in enumerate(pdfs):
-        if loud:
-            print('Processing {}: {}...'.format(i+1, pdf))
-        try:
-            merger.append(pdf, pages=page_nrs)
-        except Exception as exc:
+    with metrics.phase('merge'):
+        for (i, pdf) in enumerate(pdfs):
             if loud:
-                print('Exception: {}'.format(exc))
-                print('skipping...')
-    return merger
-    
-
-##  Alternate solutions down below
-
-
-def get_batch(a, n):
-    """Split a list into multiple sub-lists"""
-    return [a[i:i+n] for i in range(0, len(a), n)]
-
-
-def merge_tmp(pdfs, page_nrs, batch_size=10):
-    print('Processing...')
-    """Merge with temporary stops in-between"""
-    # traverse indices in steps of batch_size, chunking the list of pdfs
-    pdf_batches = get_batch(pdfs, batch_size)
-    # print([[os.path.basename(pdf) for pdf in batch] for batch in pdf_batches])
-    # 1st batch
-    merger = merge(pdf_batches[0], page_nrs)
-    tmp = tempfile.TemporaryFile()
-    merger.write(tmp)
-    for batch in pdf_batches[1:]:
-        tmp.seek(0)
-        batch.insert(0, tmp)
-        merger = merge(batch, page_nrs)
-        tmp.truncate()
-        merger.write(tmp) # on last iteration this step is not needed
-    tmp.close()
+                print('Processing {}: {}...'.format(i+1, pdf))
+            start = time.perf_counter()
+            page_count = len(merger.pages)
+            runs = page_runs(page_nrs, pdf)
+            try:
+                for pages in runs:
+                    merger.append(pdf, pages=pages)
+            except Exception as exc:
+                index_record(index, pdf, pdfindex.describe_error(exc))
+                metrics.file(pdf_path(pdf), time.perf_counter() - start, len(merger.pages) - page_count, exc)
+                if loud:
+                    print('Exception: {}'.format(exc))
+                    print('skipping...')
+            else:
+                if runs:
+                    index_record(index, pdf, pdfindex.describe(merger.inputs[-1][1]))
+                metrics.file(pdf_path(pdf), time.perf_counter() - start, len(merger.pages) - page_count)
     return merger
 
 
-def merge_multi(pdfs, page_nrs, batch_size=10):
-    print('Processing...')
-    pdf_batches = get_batch(pdfs, batch_size)
-    mergers = []
-    merger = merge(pdf_batches[0], page_nrs)
-    mergers.append(merger)
-    for batch in pdf_batches[1:]:
-        merger = merge(batch, page_nrs)
-        mergers.append(merger)
-    return mergers
-
-
-def merge_save(pdfs, page_nrs, pathout, batch_size=10):
-    print('Processing...')
-    pdf_batches = get_batch(pdfs, batch_size)
-    merger = merge(pdf_batches[0], page_nrs)
-    i = 0
-    save(merger, pathname_append(pathout, '-'+str(i)))
-    close(merger)
-    for batch in pdf_batches[1:]:
-        merger = merge(batch, page_nrs)
-        i += 1
-        save(merger, pathname_append(pathout, '-'+str(i)))
-        close(merger)
+def index_record(index, pdf, data):
+    """Record what was found out about a PDF in a 'pdfindex.PdfIndex', if there is one and the PDF is a file"""
+    path = pdf_path(pdf)
+    if index is not None and data is not None and path is not None:
+        index.record(path, data)
+
 
+def pdf_path(pdf):
+    """Return the path of a PDF given either as a path or as an object for a file, or None if there is no file"""
+    if isinstance(pdf, str):
+        return pdf
+    name = getattr(pdf, 'name', None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return name
+    return None
 
-def save(merger, path, loud=True):
+
+def extract_pages(pdf, page_nrs):
+    """Slice a single PDF, returning a (data, exception, index entry data, seconds) tuple
+    'data' is the bytes of a new PDF holding only the 'page_nrs' pages, or None if the PDF was skipped.
+    Module level so that it can be sent to worker processes"""
+    start = time.perf_counter()
+    merger = pypdf.PdfFileMerger()
+    try:
+        entry = None
+        for pages in page_runs(page_nrs, pdf):
+            merger.append(pdf, pages=pages)
+            entry = pdfindex.describe(merger.inputs[-1][1])
+        out = io.BytesIO()
+        merger.write(out)
+    except Exception as exc:
+        return (None, exc, pdfindex.describe_error(exc), time.perf_counter() - start)
+    finally:
+        merger.close()
+    return (out.getvalue(), None, entry, time.perf_counter() - start)
+
+
+def merge_parallel(pdfs, page_nrs, workers=None, loud=True, index=None, metrics=None):
+    """Same as 'merge', but with the PDF's parsed and sliced by a pool of 'workers' processes
+    (one per CPU if None). 'pdfs' must be paths. The slices are put together in the order of 'pdfs'.
+    The time recorded for each PDF is the time the worker spent on it"""
     if loud:
-        print('Saving...')
-    directory = os.path.dirname(path)
-    if not os.path.isdir(directory):
-        os.makedirs(directory)
-    with open(path, 'wb') as f_out:
-        merger.write(path)
+        print('Processing...')
+    metrics = metrics or instrumentation.Metrics()
+    merger = pypdf.PdfFileMerger()
+    with metrics.phase('merge'):
+        for (i, (pdf, (data, exc, entry, seconds))) in enumerate(zip(pdfs, parallel_map(extract_pages, pdfs, page_nrs, workers))):
+            if loud:
+                print('Processing {}: {}...'.format(i+1, pdf))
+            index_record(index, pdf, entry)
+            if exc is not None:
+                metrics.file(pdf_path(pdf), seconds, 0, exc)
+                if loud:
+                    print('Exception: {}'.format(exc))
+                    print('skipping...')
+                continue
+            page_count = len(merger.pages)
+            merger.append(io.BytesIO(data))
+            metrics.file(pdf_path(pdf), seconds, len(merger.pages) - page_count)
+    return merger
 
 
-def save_multiple(mergers, path):
-    print('Saving...')
+def parallel_map(func, pdfs, page_nrs, workers=None, executor=None):
+    """Yield what 'func(pdf, page_nrs)' returns for each of 'pdfs', in order, using a pool of 'workers' processes,
+    or the 'executor' given (of 'workers' processes, eg: shared by many runs, see 'batch'), which is left running.
+    Only a few PDF's are handed out ahead of the one being yielded, so that finished slices do not pile up in memory"""
+    if executor is None:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+            yield from parallel_map(func, pdfs, page_nrs, workers, executor)
+        return
+    window = 2 * (workers or os.cpu_count() or 1)
+    futures = collections.deque()
+    for pdf in pdfs:
+        futures.append(executor.submit(func, pdf, page_nrs))
+        if len(futures) >= window:
+            yield futures.popleft().result()
+    while futures:
+        yield futures.popleft().result()
+
+
+##  Streaming
+
+
+class StreamOutput():
+    """Output PDF at 'pathout' that pages are written straight into, with a 'pdfstream.PdfStreamWriter'
+    With 'chunk_pages' the output is split into files of at most that many pages each, named like 'pathout'
+    with '-0', '-1', etc appended. The files are only created once there are pages for them.
+    With 'append' (not for chunked outputs) which PDF's went into the output is kept next to it (see 'sources_path'),
+    and 'resume' picks up from there, so that only the pages of new PDF's have to be added.
+    With 'compress' the files are written with compressed object streams"""
+
+    def __init__(self, pathout, chunk_pages=None, append=False, compress=False):
+        self.pathout = pathout
+        self.chunk_pages = chunk_pages
+        self.append = append and chunk_pages is None
+        self.compress = compress
+        self.paths = []
+        self.writer = None
+        self.order = None # paths of the PDF's in the order their pages go in
+        self.page_nrs = None
+        self.wanted = None # paths of the PDF's still to be added, None for all of them
+        self.sources = {} # path -> what went into the output from that PDF
+
+    def _next_file(self):
+        if self.writer is not None:
+            self.writer.close()
+            self.writer.stream.close()
+        path = self.pathout if self.chunk_pages is None else pathname_append(self.pathout, '-'+str(len(self.paths)))
+        make_parent_dir(path)
+        self.paths.append(path)
+        self.writer = pdfstream.PdfStreamWriter(open(path, 'wb'), compress=self.compress)
+
+    def resume(self, pdfs, page_nrs):
+        """Pick up from the output written by an earlier run, if it was sliced at the same pages and none of the PDF's
+        that went into it have changed or gone since. Return the paths of the 'pdfs' that still have to be sliced into it,
+        only the new ones if picking up and all of them otherwise"""
+        self.order = [pdf_path(pdf) for pdf in pdfs]
+        self.page_nrs = str(page_nrs)
+        self.wanted = set(self.order)
+        previous = read_sources(self.pathout)
+        if not self.append or previous is None or previous['page_nrs'] != self.page_nrs:
+            return self.wanted
+        for source in previous['sources']:
+            if source['path'] not in self.wanted or list(pdfindex.file_key(source['path'])[1:]) != [source['size'], source['mtime']]:
+                return self.wanted
+        self.wanted -= set(source['path'] for source in previous['sources'])
+        self.sources = {source['path']: source for source in previous['sources']}
+        if self.wanted:
+            self.writer = pdfstream.PdfStreamWriter(open(self.pathout, 'r+b'), previous['writer'])
+        self.paths.append(self.pathout)
+        return self.wanted
+
+    def add_pages(self, reader, indices, pdf=None):
+        """Add the pages with 'indices' of 'reader', a PDF read from 'pdf' (unless it is already in the output)
+        Return the number of pages added"""
+        path = pdf_path(pdf)
+        if self.wanted is not None and path not in self.wanted:
+            return 0
+        indices = list(indices)
+        kids = []
+        while indices:
+            if self.writer is None or (self.chunk_pages and self.writer.page_count >= self.chunk_pages):
+                self._next_file()
+            room = self.chunk_pages - self.writer.page_count if self.chunk_pages else len(indices)
+            count = self.writer.page_count
+            self.writer.add_pages(reader, indices[:room])
+            kids += self.writer.kids[count:]
+            del indices[:room]
+        # PDF's that gave no pages are not recorded, so that leaving them out later (eg: with an index) is not taken as a change
+        if self.append and path is not None and kids:
+            path, size, mtime = pdfindex.file_key(path)
+            self.sources[path] = {'path': path, 'size': size, 'mtime': mtime, 'kids': kids}
+        return len(kids)
+
+    def finish(self):
+        """Finish off the last file and return the paths of all the files written"""
+        if self.paths and self.writer is None:
+            return self.paths # picked up, with nothing new to add
+        if self.writer is None:
+            self._next_file() # nothing was sliced, still leave an (empty) PDF
+        if self.order is not None and self.writer.previous is not None:
+            # the old and the new pages, in the order of the PDF's they came from
+            self.writer.kids = [kid for path in self.order if path in self.sources for kid in self.sources[path]['kids']]
+        self.writer.close()
+        self.writer.stream.close()
+        if self.append:
+            order = self.order or list(self.sources)
+            write_sources(self.pathout, {
+                'page_nrs': self.page_nrs,
+                'writer': self.writer.state(),
+                'sources': [self.sources[path] for path in order if path in self.sources],
+            })
+        return self.paths
+
+    def close(self):
+        """Close the file being written to, finished or not"""
+        if self.writer is not None:
+            self.writer.stream.close()
+
+
+def sources_path(pathout):
+    """Path of the file that records which PDF's went into the output at 'pathout', for picking up from later"""
+    return pathout + '.sources.json'
+
+
+def read_sources(pathout):
+    """Return the record of which PDF's went into the output at 'pathout' (see 'StreamOutput'),
+    or None if there is none, or if the output has changed since"""
+    try:
+        with open(sources_path(pathout), 'r') as f:
+            record = json.load(f)
+        path, size, mtime = pdfindex.file_key(pathout)
+    except (OSError, ValueError):
+        return None
+    if [size, mtime] != record['output']:
+        return None
+    return record
+
+
+def write_sources(pathout, record):
+    path, size, mtime = pdfindex.file_key(pathout)
+    record['output'] = [size, mtime]
+    with open(sources_path(pathout), 'w') as f:
+        json.dump(record, f)
+
+
+def extract_slices(pdf, slices):
+    """Slice a single PDF at each of the page ranges 'slices', returning a (list of data, exception, index entry data, seconds) tuple
+    Each data is the bytes of a new PDF with the pages of one slice, the list is None if the PDF was skipped.
+    The PDF is only parsed once for all the slices. Module level so that it can be sent to worker processes"""
+    start = time.perf_counter()
+    try:
+        reader = pypdf.PdfFileReader(pdf)
+        entry = pdfindex.describe(reader)
+        datas = []
+        for page_nrs in slices:
+            out = io.BytesIO()
+            writer = pdfstream.PdfStreamWriter(out)
+            writer.add_pages(reader, page_indices(page_nrs, pdf, reader.getNumPages()))
+            writer.close()
+            datas.append(out.getvalue())
+    except Exception as exc:
+        return (None, exc, pdfindex.describe_error(exc), time.perf_counter() - start)
+    return (datas, None, entry, time.perf_counter() - start)
+
+
+def slice_sources(pdfs, slices, workers=1, index=None, executor=None):
+    """Yield a (list of (reader, page indices) for each slice, exception, seconds) tuple for each of 'pdfs', in order,
+    opening one PDF at a time. The list is None if the PDF is to be skipped because of 'exception'.
+    With 'workers' other than 1 the PDF's are sliced by a pool of worker processes first (0 for one per CPU),
+    or by the 'executor' given, and 'seconds' is the time a worker spent on the PDF, otherwise it is None.
+    With a 'pdfindex.PdfIndex', PDF's are opened through the index, skipping parsing where they can"""
+    if workers != 1 or executor is not None:
+        for (pdf, (datas, exc, entry, seconds)) in zip(pdfs, parallel_map(extract_slices, pdfs, slices, workers or None, executor)):
+            index_record(index, pdf, entry)
+            if exc is not None:
+                yield (None, exc, seconds)
+            else:
+                readers = [pypdf.PdfFileReader(io.BytesIO(data)) for data in datas]
+                yield ([(reader, range(reader.getNumPages())) for reader in readers], None, seconds)
+        return
+    for pdf in pdfs:
+        f = open(pdf, 'rb') if isinstance(pdf, str) else pdf
+        try:
+            if index is not None and pdf_path(pdf) is not None:
+                reader = index.open(pdf_path(pdf), f)
+            else:
+                reader = pypdf.PdfFileReader(f)
+            parts = [(reader, page_indices(page_nrs, pdf, reader.getNumPages())) for page_nrs in slices]
+        except Exception as exc:
+            yield (None, exc, None)
+        else:
+            yield (parts, None, None)
+        finally:
+            if f is not pdf:
+                f.close()
+
+
+def merge_slices(pdfs, slices, chunk_pages=None, workers=1, loud=True, index=None, append=False, compress=False, metrics=None,
+        executor=None):
+    """Slice the PDF's at several page ranges in one go, 'slices' being a list of (page range, output path) pairs.
+    Each PDF is read in once, with its pages written straight into all of the outputs (see 'StreamOutput'),
+    and let go of before the next PDF is read. Return the list of paths written for each slice.
+    With 'append', outputs written by an earlier run with 'append' only get the pages of the PDF's that are new since
+    added to them, in the order of 'pdfs', and PDF's that none of the outputs need are not read at all.
+    Fonts, images and other streams that are the same in several PDF's are only written once to each output,
+    and with 'compress' the rest of the objects are packed into compressed object streams.
+    How long each PDF took (to parse and write out) and how many pages came out of it is recorded in 'metrics'.
+    A running process pool 'executor' can be given to slice with instead of starting one (see 'slice_sources')"""
+    if loud:
+        print('Processing...')
+    metrics = metrics or instrumentation.Metrics()
+    outputs = [StreamOutput(pathout, chunk_pages, append, compress) for (page_nrs, pathout) in slices]
+    page_ranges = [page_nrs for (page_nrs, pathout) in slices]
+    if append:
+        wanted = set()
+        for (output, page_nrs) in zip(outputs, page_ranges):
+            wanted.update(output.resume(pdfs, page_nrs))
+        pdfs = [pdf for pdf in pdfs if pdf_path(pdf) in wanted]
+        if loud:
+            print('{} new or changed PDF\'s to add...'.format(len(pdfs)))
+    try:
+        with metrics.phase('merge'):
+            last = time.perf_counter()
+            for (i, (pdf, (parts, exc, seconds))) in enumerate(zip(pdfs, slice_sources(pdfs, page_ranges, workers, index, executor))):
+                if loud:
+                    print('Processing {}: {}...'.format(i+1, pdf))
+                page_count = 0
+                for (output, (reader, indices)) in zip(outputs, parts or []):
+                    try:
+                        page_count += output.add_pages(reader, indices, pdf)
+                    except Exception as e:
+                        exc = e
+                        index_record(index, pdf, pdfindex.describe_error(exc))
+                now = time.perf_counter()
+                metrics.file(pdf_path(pdf), seconds if seconds is not None else now - last, page_count, exc)
+                last = now
+                if exc is not None and loud:
+                    print('Exception: {}'.format(exc))
+                    print('skipping...')
+        with metrics.phase('save'):
+            paths = [output.finish() for output in outputs]
+        for path in sum(paths, []):
+            metrics.written(path)
+        return paths
+    finally:
+        for output in outputs:
+            output.close()
+
+
+def merge_stream(pdfs, page_nrs, pathout, chunk_pages=None, workers=1, loud=True, index=None, append=False, compress=False,
+        metrics=None):
+    """Slice the PDF's straight into the file at 'pathout', letting go of each PDF as soon as its pages are written,
+    so that memory use stays flat however many PDF's there are. See 'merge_slices'. Return the list of paths written"""
+    return merge_slices(pdfs, [(page_nrs, pathout)], chunk_pages=chunk_pages, workers=workers, loud=loud, index=index,
+        append=append, compress=compress, metrics=metrics)[0]
+
+
+def make_parent_dir(path):
+    """Create the directory that the file at 'path' goes in, if it does not exist yet"""
     directory = os.path.dirname(path)
-    if not os.path.isdir(directory):
+    if directory and not os.path.isdir(directory):
         os.makedirs(directory)
-    for (i, merger) in enumerate(mergers):
-        fpath = pathname_append(path, '-'+str(i))
-        with open(fpath, 'wb') as f_out:
-            merger.write(path)
+
+
+def save(merger, path, loud=True, metrics=None):
+    if loud:
+        print('Saving...')
+    metrics = metrics or instrumentation.Metrics()
+    with metrics.phase('save'):
+        make_parent_dir(path)
+        with open(path, 'wb') as f_out:
+            merger.write(f_out)
+    metrics.written(path)
 
 
 def pathname_append(path, s):
@@ -170,34 +538,122 @@ def close(merger, files=None, loud=True):
             file.close()
 
 
-def close_multiple(mergers):
-    for merger in mergers:
-        merger.close()
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('pdfpath', help='directory from which to take the PDFs')
+    parser.add_argument('pages', nargs='?',
+        help='page to slice at (zero-based), or a range of pages, eg: 2, 1:3, or the pages that mention some words, '
+        'eg: "text:binary search tree", or that match a regular expression, eg: "re:question \\d+"')
+    parser.add_argument('pathout', nargs='?', help='directory and file where to save the sliced PDF')
+    parser.add_argument('--slice', nargs=2, action='append', default=[], metavar=('PAGES', 'PATHOUT'),
+        help='(can be repeated) another page to slice at and file to save it in, '
+        'eg: --slice 0 q1.pdf --slice 1 q2.pdf. The PDF\'s are only read once for all the slices (implies --stream)')
+    parser.add_argument('-j', '--workers', type=int, default=1,
+        help='number of processes to slice with, 0 for one per CPU (default: 1, no worker processes)')
+    parser.add_argument('--stream', action='store_true',
+        help='write the pages out as each PDF is sliced instead of at the end, keeping memory use flat')
+    parser.add_argument('--chunk', type=int, metavar='PAGES',
+        help='split the output into files of at most PAGES pages each, eg: out-0.pdf, out-1.pdf (implies --stream)')
+    parser.add_argument('--index', metavar='FILE',
+        help='index of parsed PDF\'s to use and update, so that PDF\'s known to be broken or too short are skipped, '
+        'and (with --stream) the rest open without being parsed again')
+    parser.add_argument('--mmap', action='store_true',
+        help='read the PDF\'s through memory maps instead of copying them into memory or reading them through file buffers')
+    parser.add_argument('--max-open', type=int, default=64, metavar='FILES',
+        help='with --mmap, how many PDF\'s to keep mapped (and open) at a time (default: 64)')
+    parser.add_argument('--reindex', action='store_true', help='forget what the --index knows about the PDF\'s first')
+    parser.add_argument('--compress', action='store_true',
+        help='pack the objects of the output into compressed object streams, for a smaller file that needs a PDF 1.5 reader '
+        '(implies --stream)')
+    parser.add_argument('--append', action='store_true',
+        help='keep track of which PDF\'s went into the output, and on later runs only add the pages of new PDF\'s to it, '
+        'in order, as an incremental update (implies --stream, not with --chunk)')
+    parser.add_argument('--text-index', metavar='FILE',
+        help='keep the text of the PDF\'s pages in FILE, so that slicing by text only has to extract the text of new PDF\'s')
+    parser.add_argument('--metrics', metavar='FILE',
+        help='append measurements of the run to FILE as lines of JSON (- for the standard error): how long each phase '
+        'and each PDF took, pages, sizes of the PDF\'s on disk and bytes written, and a summary at the end')
+    parser.add_argument('--quarantine', metavar='FILE',
+        help='quickly check each PDF before slicing, skipping the broken ones, and keep the verdicts in FILE '
+        'so that unchanged PDF\'s are not checked again (see triage.py)')
+    parser.add_argument('--catalog', metavar='FILE',
+        help='take the PDF\'s in pdfpath from the catalog in FILE (see catalog.py) instead of listing the directory, '
+        'newest first, filtered by --module, --years and --min-pages')
+    parser.add_argument('--module', help='with --catalog, only the papers of this module, eg: ca117')
+    parser.add_argument('--years', type=catalog.parse_years, metavar='FIRST:LAST',
+        help='with --catalog, only the papers from these years, eg: 2012:2018, 2015:, 2018')
+    parser.add_argument('--min-pages', type=int, metavar='PAGES', help='with --catalog, only the papers with at least PAGES pages')
+    return parser
 
 
 def cli_engine(args):
-    pdfpath, pages, pathout = args
-    pdf_paths = load_paths(pdfpath)
-    pdf_paths = sort_cyear(pdf_paths) # sort to get the most recent papers first
-    pg = page_repr(pages)
-
-    # single output file
-    merger = merge(pdf_paths, pg)
-    save(merger, pathout)
-    close(merger)
-
-    # with temporary files (incremental)
-    # merger = merge_tmp(pdf_paths, pg, 10)
-    # save(merger, pathout)
-    # close(merger)
-
-    # batched
-    # mergers = merge_mult(pdf_paths, pg, 10)
-    # save_multiple(mergers, pathout)
-    # close_multiple(mergers)
-
-    # merge-save (batches)
-    # merge_save(pdf_paths, pg, pathout)
+    parser = cli_parser()
+    opts = parser.parse_args([str(arg) for arg in args])
+    if (opts.pages is None) != (opts.pathout is None):
+        parser.error('a page to slice at needs a file to save it in')
+    try:
+        slices = [(slice_repr(pages), pathout) for (pages, pathout) in [(opts.pages, opts.pathout)] + opts.slice if pages is not None]
+    except re.error as exc:
+        parser.error('invalid regular expression: {}'.format(exc))
+    if not slices:
+        parser.error('nothing to slice, give a page and a file to save it in')
+    if opts.append and opts.chunk:
+        parser.error('--append can not be used with --chunk')
+    if (opts.module or opts.years or opts.min_pages is not None) and not opts.catalog:
+        parser.error('--module, --years and --min-pages need a --catalog')
+    metrics = instrumentation.Metrics(opts.metrics)
+    if opts.catalog:
+        with metrics.phase('catalog'), catalog.Catalog(opts.catalog) as papers:
+            pdf_paths = papers.paths(opts.module, opts.years, opts.min_pages, directory=opts.pdfpath) # most recent first
+    else:
+        pdf_paths = load_paths(opts.pdfpath, metrics=metrics)
+        with metrics.phase('sort'):
+            pdf_paths = sort_cyear(pdf_paths) # sort to get the most recent papers first
+
+    quarantine = triage.Quarantine(opts.quarantine) if opts.quarantine else None
+    index = pdfindex.PdfIndex(opts.index) if opts.index else None
+    if index is not None and opts.reindex:
+        index.invalidate(pdf_paths)
+    pdf_paths = filter_paths(pdf_paths, slices, quarantine=quarantine, index=index, metrics=metrics)
+    if quarantine is not None:
+        quarantine.save()
+
+    if any(isinstance(pg, str) for (pg, pathout) in slices):
+        text = textindex.TextIndex(opts.text_index)
+        slices, pdf_paths = search_pages(slices, pdf_paths, text, metrics=metrics)
+        if opts.text_index:
+            text.save()
+
+    pool = None
+    pdfs = pdf_paths
+    if opts.mmap:
+        pool = pdfmap.MapPool(opts.max_open)
+        pdfs = map_paths(pdf_paths, pool)
+
+    if len(slices) > 1:
+        # many outputs from a single read of each PDF
+        merge_slices(pdfs, slices, chunk_pages=opts.chunk, workers=opts.workers, index=index, append=opts.append,
+            compress=opts.compress, metrics=metrics)
+    elif opts.stream or opts.chunk or opts.append or opts.compress:
+        # written out as it goes, possibly into multiple files
+        ((pg, pathout),) = slices
+        merge_stream(pdfs, pg, pathout, chunk_pages=opts.chunk, workers=opts.workers, index=index, append=opts.append,
+            compress=opts.compress, metrics=metrics)
+    else:
+        # single output file, put together in memory
+        ((pg, pathout),) = slices
+        if opts.workers == 1:
+            merger = merge(pdfs, pg, index=index, metrics=metrics)
+        else:
+            merger = merge_parallel(pdfs, pg, workers=opts.workers or None, index=index, metrics=metrics)
+        save(merger, pathout, metrics=metrics)
+        close(merger)
+    if pool is not None:
+        pool.close()
+
+    if index is not None:
+        index.save()
+    metrics.close()
 
 
 def main():
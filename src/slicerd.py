@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+
+"""The slicer as a long-running server, for answering many slice requests quickly
+Parsed PDF's are kept in memory between requests (see 'ReaderCache'), so a request only has to copy pages over.
+Listens for HTTP on a local port or Unix socket:
+    POST /slice  with a JSON body of {"input": directory, "pages": pages, "output": path, "compress": false}
+                 slices the PDF's in the directory like slicer.py, "pages" as for slicer.py. With "output" the PDF is written
+                 to that path and a JSON report is sent back, otherwise the PDF itself is sent back
+    GET /stats   JSON of the cache and requests so far
+At most so many requests are sliced at once, the rest wait their turn or are turned away with 503 if they wait too long.
+Only PDF's and outputs under the root directory are sliced and written, and the body has to be sent as application/json,
+so that a web page cannot have the browser post a request here without asking (a preflight that is never answered)"""
+
+
+import os
+import os.path
+import io
+import re
+import json
+import time
+import argparse
+import threading
+import collections
+import socketserver
+import http.server
+
+import PyPDF2 as pypdf
+
+import slicer
+import pdfindex
+import pdfstream
+import textindex
+
+
+# bytes charged to the cache for each entry, on top of what its reader holds (see 'parsed_size')
+ENTRY_BYTES = 1024
+# bytes each object of a PDF takes in memory once the reader has read it (measured with PyPDF2 1.26)
+OBJECT_BYTES = 2048
+
+
+def parsed_size(reader, data):
+    """Estimate of the memory a PdfFileReader of the PDF 'data' takes once its pages have been copied:
+    the PDF itself, and every object of it read"""
+    objects = sum(len(ids) for ids in reader.xref.values()) + len(reader.xref_objStm)
+    return ENTRY_BYTES + len(data) + objects*OBJECT_BYTES
+
+
+class ReaderCache():
+    """PdfFileReader's of PDF's that have been parsed, kept in memory until they add up to more than 'max_bytes' (see 'parsed_size'),
+    the least recently used going first. Readers are not thread safe, each comes with a lock to hold while using it.
+    PDF's that failed to parse are remembered too, with the exception, and count towards 'max_bytes' all the same.
+    Entries are dropped when the file changes"""
+
+    def __init__(self, max_bytes=512*1024*1024):
+        self.max_bytes = max_bytes
+        self.entries = collections.OrderedDict() # path -> (file key, reader, lock, size, exception)
+        self.lock = threading.Lock()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, path):
+        """Return (reader, lock) for the PDF at 'path', parsing it if it is not in the cache, or raise why it could not be parsed"""
+        key = pdfindex.file_key(path)
+        path = key[0]
+        with self.lock:
+            entry = self.entries.get(path)
+            if entry is not None and entry[0] == key:
+                self.entries.move_to_end(path)
+                self.hits += 1
+                return self._unpack(entry)
+        # parsed without holding the lock, so that other requests are not held up
+        with open(path, 'rb') as f:
+            data = f.read()
+        try:
+            reader = pypdf.PdfFileReader(io.BytesIO(data))
+            entry = (key, reader, threading.Lock(), parsed_size(reader, data), None)
+        except Exception as exc:
+            entry = (key, None, None, ENTRY_BYTES, exc)
+        with self.lock:
+            self.misses += 1
+            old = self.entries.pop(path, None)
+            if old is not None:
+                self.size -= old[3]
+            self.entries[path] = entry
+            self.size += entry[3]
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                (oldest, old) = self.entries.popitem(last=False)
+                self.size -= old[3]
+        return self._unpack(entry)
+
+    def _unpack(self, entry):
+        (key, reader, lock, size, exc) = entry
+        if exc is not None:
+            raise exc
+        return (reader, lock)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'max_bytes': self.max_bytes, 'hits': self.hits, 'misses': self.misses}
+
+
+def slice_request(request, cache, text=None, text_lock=None):
+    """Do a slice request (a dict, see the module's docstring) with the PDF's in a 'ReaderCache',
+    returning (data of the PDF, or None if written to the request's output, report dict).
+    Pages given as a search are looked up in a 'textindex.TextIndex', one made for the request if 'text' is None"""
+    start = time.perf_counter()
+    pdf_paths = slicer.sort_cyear(slicer.load_paths(request['input'], loud=False))
+    slices = [(slicer.slice_repr(str(request['pages'])), request.get('output'))]
+    if isinstance(slices[0][0], str):
+        if text is None:
+            text, text_lock = textindex.TextIndex(), threading.Lock()
+        with text_lock:
+            slices, pdf_paths = slicer.search_pages(slices, pdf_paths, text)
+    ((pg, pathout),) = slices
+    if pathout is not None:
+        slicer.make_parent_dir(pathout)
+    out = open(pathout, 'wb') if pathout is not None else io.BytesIO()
+    try:
+        writer = pdfstream.PdfStreamWriter(out, compress=bool(request.get('compress', False)))
+        skipped = 0
+        for path in pdf_paths:
+            try:
+                (reader, lock) = cache.get(path)
+                with lock:
+                    writer.add_pages(reader, slicer.page_indices(pg, path, reader.getNumPages()))
+            except Exception:
+                skipped += 1
+        writer.close()
+    finally:
+        if pathout is not None:
+            out.close()
+    report = {
+        'pdfs': len(pdf_paths),
+        'skipped': skipped,
+        'pages': writer.page_count,
+        'seconds': time.perf_counter() - start,
+        'paths': [pathout] if pathout is not None else None,
+    }
+    return (None if pathout is not None else out.getvalue(), report)
+
+
+def within(root, path):
+    """Whether 'path' is the directory 'root' or under it, once symbolic links and '..' are resolved"""
+    root = os.path.realpath(root)
+    return os.path.commonpath([root, os.path.realpath(path)]) == root
+
+
+class SliceHandler(http.server.BaseHTTPRequestHandler):
+
+    server_version = 'slicerd'
+
+    def address_string(self):
+        # Unix sockets have no client address
+        return self.client_address[0] if isinstance(self.client_address, tuple) else 'unix'
+
+    def log_message(self, format, *args):
+        if self.server.slicer.loud:
+            super().log_message(format, *args)
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path != '/stats':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        self.send_json(200, self.server.slicer.stats())
+
+    def do_POST(self):
+        state = self.server.slicer
+        if self.path != '/slice':
+            self.send_json(404, {'error': 'unknown path {}'.format(self.path)})
+            return
+        if self.headers.get_content_type() != 'application/json':
+            # what a browser sends without a preflight (text/plain, forms) is never taken
+            self.send_json(415, {'error': 'expected Content-Type: application/json'})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode())
+            request['pages']
+            # relative paths are taken from the root
+            request['input'] = os.path.join(state.root, request['input'])
+            if request.get('output') is not None:
+                request['output'] = os.path.join(state.root, request['output'])
+            outside = [path for path in (request['input'], request.get('output')) if path is not None and not within(state.root, path)]
+        except (ValueError, KeyError, TypeError, AttributeError) as exc:
+            self.send_json(400, {'error': 'expected a JSON object with "input" and "pages": {}'.format(exc)})
+            return
+        if outside:
+            state.count('forbidden')
+            self.send_json(403, {'error': 'not under {}: {}'.format(state.root, ', '.join(outside))})
+            return
+        if not state.slots.acquire(timeout=state.queue_timeout):
+            state.count('busy')
+            self.send_json(503, {'error': 'too many slices going on, try again later'})
+            return
+        try:
+            (data, report) = slice_request(request, state.cache, state.text, state.text_lock)
+        except (OSError, ValueError, re.error, pypdf.utils.PdfReadError) as exc:
+            state.count('failed')
+            self.send_json(404 if isinstance(exc, FileNotFoundError) else 400, {'error': '{}: {}'.format(type(exc).__name__, exc)})
+            return
+        except Exception as exc:
+            state.count('failed')
+            self.send_json(500, {'error': '{}: {}'.format(type(exc).__name__, exc)})
+            return
+        finally:
+            state.slots.release()
+        state.count('sliced')
+        if data is None:
+            self.send_json(200, report)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('X-Pages', str(report['pages']))
+        self.send_header('X-Skipped', str(report['skipped']))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class SlicerState():
+    """What the server keeps between requests: the 'ReaderCache', the text index, and the slots for slicing
+    'max_concurrent' requests at a time, that requests wait up to 'queue_timeout' seconds for.
+    Requests can only slice PDF's and write outputs under 'root' (the working directory if None)"""
+
+    def __init__(self, cache_bytes=512*1024*1024, max_concurrent=4, queue_timeout=30, text=None, loud=True, root=None):
+        self.root = os.path.realpath(root or os.getcwd())
+        self.cache = ReaderCache(cache_bytes)
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self.text = text
+        self.text_lock = threading.Lock()
+        self.loud = loud
+        self.requests = collections.Counter()
+        self.lock = threading.Lock()
+
+    def count(self, outcome):
+        with self.lock:
+            self.requests[outcome] += 1
+
+    def stats(self):
+        with self.lock:
+            requests = dict(self.requests)
+        return {'cache': self.cache.stats(), 'requests': requests, 'max_concurrent': self.max_concurrent}
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(state, port=8765, host='127.0.0.1', socket_path=None):
+    """Return an HTTP server for 'state' ('SlicerState') on 'host':'port', or on the Unix socket at 'socket_path'
+    Call 'serve_forever' on it to start answering requests"""
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path) # left over from a server that did not shut down cleanly
+        server = ThreadingUnixHTTPServer(socket_path, SliceHandler)
+    else:
+        server = http.server.ThreadingHTTPServer((host, port), SliceHandler)
+        server.daemon_threads = True
+    server.slicer = state
+    return server
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on (default: 8765)')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1, this machine only)')
+    parser.add_argument('--socket', metavar='PATH', help='listen on a Unix socket at PATH instead of a port')
+    parser.add_argument('--cache-mb', type=int, default=512,
+        help='megabytes of memory for the parsed PDF\'s, an estimate of what they take once read (default: 512)')
+    parser.add_argument('--max-concurrent', type=int, default=4, help='slices to do at the same time (default: 4)')
+    parser.add_argument('--queue-timeout', type=float, default=30,
+        help='seconds a request waits for its turn before it is turned away (default: 30)')
+    parser.add_argument('--text-index', metavar='FILE', help='text index to search for pages given as text, see slicer.py')
+    parser.add_argument('--root', metavar='DIR', default='.',
+        help='directory that the PDF\'s sliced and the outputs written have to be under (default: the working directory)')
+    parser.add_argument('--quiet', action='store_true', help='do not log requests')
+    return parser
+
+
+def main():
+    opts = cli_parser().parse_args()
+    text = textindex.TextIndex(opts.text_index) if opts.text_index else None
+    state = SlicerState(opts.cache_mb*1024*1024, opts.max_concurrent, opts.queue_timeout, text, loud=not opts.quiet, root=opts.root)
+    server = make_server(state, opts.port, opts.host, opts.socket)
+    print('Listening on {}, slicing under {}...'.format(opts.socket or '{}:{}'.format(opts.host, opts.port), state.root))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if opts.socket:
+            os.remove(opts.socket)
+        if text is not None:
+            text.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+#!/usr/bin/env python3
+
+"""A stand-in for the DCU past exam papers web page and for Google Drive, served locally, to test and benchmark the scraper
+without going online. The papers page has the markup the scraper looks for (see 'webscraper.css_sels'): the cookies pop-up,
+and a papers table that filters, pages and draws itself again like the DataTables one does. The papers are on fake Drive pages,
+and are downloaded from a fake Drive download URL that can be made to answer late and send so many bytes a second"""
+
+
+import os
+import os.path
+import re
+import html
+import gzip
+import time
+import argparse
+import tempfile
+import threading
+import collections
+import http.server
+import urllib.parse
+
+import catalog
+import corpus
+
+
+PAGE_PATH = '/registry/past-exam-papers.shtml'
+DOWNLOAD_PATH = '/uc?export=download&id={}'
+
+CHUNK_SIZE = 16*1024
+
+# draws the papers table like DataTables: reads the rows out of the page, then shows the ones matching the search box,
+# a page of so many at a time, after 'DRAW_TIME' milliseconds (as if asking a server for them)
+TABLE_SCRIPT = """
+(function() {
+    var table = document.getElementById('mySelection'), body = table.tBodies[0];
+    var length = document.querySelector('#mySelection_length select'), search = document.querySelector('#mySelection_filter input');
+    var info = document.getElementById('mySelection_info');
+    var next = document.getElementById('mySelection_next'), previous = document.getElementById('mySelection_previous');
+    var rows = Array.prototype.slice.call(body.rows), start = 0, timer = null;
+    function matching() {
+        var words = search.value.toLowerCase().split(/\\s+/).filter(function(word) { return word; });
+        return rows.filter(function(row) {
+            var text = row.textContent.toLowerCase();
+            return words.every(function(word) { return text.indexOf(word) >= 0; });
+        });
+    }
+    function number(n) {
+        return n.toString().replace(/\\B(?=(\\d{3})+(?!\\d))/g, ',');
+    }
+    function draw() {
+        var shown = matching(), count = parseInt(length.value, 10);
+        start = Math.max(0, Math.min(start, Math.floor((shown.length - 1) / count) * count));
+        var page = shown.slice(start, start + count);
+        while (body.firstChild) {
+            body.removeChild(body.firstChild);
+        }
+        page.forEach(function(row, i) {
+            row.className = i % 2 ? 'even' : 'odd';
+            body.appendChild(row);
+        });
+        if (!page.length) {
+            body.innerHTML = '<tr class="odd"><td valign="top" colspan="3" class="dataTables_empty">No matching records found</td></tr>';
+        }
+        info.textContent = 'Showing ' + (page.length ? start + 1 : 0) + ' to ' + (start + page.length) + ' of ' + number(shown.length) +
+            ' entries' + (shown.length < rows.length ? ' (filtered from ' + number(rows.length) + ' total entries)' : '');
+        previous.className = 'paginate_button previous' + (start ? '' : ' disabled');
+        next.className = 'paginate_button next' + (start + count < shown.length ? '' : ' disabled');
+    }
+    function redraw() {
+        clearTimeout(timer);
+        timer = setTimeout(draw, DRAW_TIME);
+    }
+    search.addEventListener('input', function() { start = 0; redraw(); });
+    length.addEventListener('change', function() { start = 0; redraw(); });
+    next.addEventListener('click', function() {
+        if (next.className.indexOf('disabled') < 0) { start += parseInt(length.value, 10); redraw(); }
+    });
+    previous.addEventListener('click', function() {
+        if (previous.className.indexOf('disabled') < 0) { start -= parseInt(length.value, 10); redraw(); }
+    });
+    document.querySelector('#sliding-popup button').addEventListener('click', function() {
+        var popup = document.getElementById('sliding-popup');
+        popup.addEventListener('transitionend', function() { popup.style.display = 'none'; });
+        popup.style.opacity = '0';
+    });
+    draw();
+})();
+"""
+
+PAGE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>Past Exam Papers | Registry | DCU</title>
+<style>
+#sliding-popup {{ position: fixed; bottom: 0; left: 0; right: 0; transition: opacity {popup_time}s; }}
+.paginate_button {{ cursor: pointer; margin: 0 4px; }}
+</style>
+</head>
+<body>
+<div class="content">
+<h1>Past Exam Papers</h1>
+<div id="mySelection_wrapper" class="dataTables_wrapper no-footer">
+<div class="dataTables_length" id="mySelection_length"><label>Show <select name="mySelection_length" aria-controls="mySelection">
+<option value="10">10</option><option value="25">25</option><option value="50">50</option><option value="100">100</option>
+</select> entries</label></div>
+<div id="mySelection_filter" class="dataTables_filter"><label>Search:<input type="search" aria-controls="mySelection"></label></div>
+<table id="mySelection" class="display dataTable no-footer" role="grid" aria-describedby="mySelection_info">
+<thead>
+<tr role="row"><th class="sorting">Module</th><th class="sorting">Year</th><th class="sorting_asc">Link</th></tr>
+</thead>
+<tbody>
+{rows}
+</tbody>
+</table>
+<div class="dataTables_info" id="mySelection_info" role="status" aria-live="polite"></div>
+<div class="dataTables_paginate paging_simple_numbers" id="mySelection_paginate">
+<a class="paginate_button previous disabled" id="mySelection_previous">Previous</a>
+<a class="paginate_button next disabled" id="mySelection_next">Next</a>
+</div>
+</div>
+</div>
+<div id="sliding-popup"><p>This site uses cookies.</p><button type="button">OK, I agree</button></div>
+<script>
+var DRAW_TIME = {draw_time};
+{script}
+</script>
+</body>
+</html>
+"""
+
+ROW = """<tr role="row"><td>{}</td><td>{}</td><td class="sorting_1"><a href="{}" target="_blank">View paper</a></td></tr>"""
+
+# what Drive answers a download of a file too big to be scanned for viruses with, the link going on to download it anyway
+CONFIRM = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>Google Drive - Virus scan warning</title></head>
+<body><p>Google Drive can't scan this file for viruses.</p><a href="{url}&amp;confirm=t0k-3n">Download anyway</a></body></html>
+"""
+
+# a paper's page on Drive, with the download button the scraper clicks ('webscraper.css_sels' 'dldata' and 'dlbutton')
+VIEWER = """<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{name} - Google Drive</title></head>
+<body><div role="document"><p>{name}</p>
+<div role="button" aria-label="Download" onclick="location.href = '{url}'">Download</div></div></body></html>
+"""
+
+
+def generate_records(module='CA117', papers=12, others=0, years=None):
+    """(module, year, file id) of 'papers' papers of 'module', and of 'others' papers of other modules,
+    one a year going back from 'years' (this year if None), the way the real table lists them"""
+    first = years or time.localtime().tm_year
+    records = [(module.upper(), str(first - i), '{}-{}'.format(module.lower(), i)) for i in range(papers)]
+    for i in range(others):
+        other = 'XX{:03d}'.format(i % 997)
+        records.append((other, str(first - i // 997), '{}-{}'.format(other.lower(), i)))
+    return records
+
+
+def recorded_records(page_html):
+    """(module, year, file id) of the papers in a saved papers web page, the ones with a link to a file on Drive"""
+    import webscraper # only needed for this, and needs selenium
+    return [(module, year, catalog.file_id(link)) for (module, year, link) in webscraper.parse_papers(page_html)
+        if catalog.file_id(link)]
+
+
+def paper_filename(module, year, file_id):
+    """The name a paper is downloaded as, two digit year first like the real ones (see 'slicer.sort_cyear')"""
+    year = catalog.parse_year(year)
+    return '{:02d}-{}.pdf'.format(year % 100, file_id) if year else '{}.pdf'.format(file_id)
+
+
+def drive_files(directory):
+    """{file id: path} of the PDF's in 'directory', to serve with 'StandinServer', each file's name (less .pdf) being its file id"""
+    return {os.path.splitext(filename)[0]: os.path.join(directory, filename) for filename in sorted(os.listdir(directory))
+        if filename.endswith('.pdf')}
+
+
+def paper_template(pages=4, lines=10):
+    """The bytes of a generated paper (see 'corpus') that every paper served is made from"""
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'paper.pdf')
+    try:
+        corpus.write_paper(path, 'Examination', pages, lines=lines)
+        with open(path, 'rb') as f:
+            return f.read()
+    finally:
+        os.remove(path)
+        os.rmdir(directory)
+
+
+class StandinHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the papers page, the papers' Drive pages (/file/d/<id>/view) and their downloads (/uc?id=<id>&confirm=<token>)"""
+
+    protocol_version = 'HTTP/1.1' # connections kept alive, as with the real sites
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        view = re.match(r'/file/d/([\w-]+)/view$', url.path)
+        self.server.hits[url.path if view is None else '/file/d/view'] += 1
+        if url.path == PAGE_PATH:
+            self.send_body(self.server.page().encode(), 'text/html; charset=utf-8')
+        elif view is not None and view.group(1) in self.server.records:
+            file_id = view.group(1)
+            page = VIEWER.format(name=html.escape(paper_filename(*self.server.records[file_id])),
+                url=html.escape(DOWNLOAD_PATH.format(file_id)))
+            self.send_body(page.encode(), 'text/html; charset=utf-8')
+        elif url.path == '/uc':
+            query = urllib.parse.parse_qs(url.query)
+            file_id = query.get('id', [''])[0]
+            if file_id not in self.server.records and file_id not in self.server.files:
+                return self.send_error(404)
+            self.server.downloads[file_id] += 1
+            if file_id in self.server.flaky and self.server.downloads[file_id] == 1:
+                return self.send_error(503)
+            if file_id in self.server.confirm and 'confirm' not in query:
+                page = CONFIRM.format(url=html.escape(DOWNLOAD_PATH.format(file_id)))
+                return self.send_body(page.encode(), 'text/html; charset=utf-8')
+            time.sleep(self.server.latency)
+            (filename, data) = self.server.download(file_id)
+            self.send_body(data, 'application/pdf', filename, gzipped=file_id in self.server.gzipped, cut=file_id in self.server.truncated)
+        else:
+            self.send_error(404)
+
+    def send_body(self, body, content_type, filename=None, gzipped=False, cut=False):
+        """Send 'body', 'gzipped' (with Content-Encoding: gzip), or 'cut' off halfway, the connection closed"""
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        if filename is not None:
+            self.send_header('Content-Disposition', 'attachment; filename="{}"'.format(filename))
+        if gzipped:
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if cut:
+            self.close_connection = True
+            body = body[:len(body)//2]
+        if filename is None or not self.server.bandwidth:
+            self.wfile.write(body)
+            return
+        # no faster than 'bandwidth' bytes a second
+        start = time.perf_counter()
+        for offset in range(0, len(body), CHUNK_SIZE):
+            self.wfile.write(body[offset:offset + CHUNK_SIZE])
+            ahead = (offset + CHUNK_SIZE) / self.server.bandwidth - (time.perf_counter() - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+
+class StandinServer(http.server.ThreadingHTTPServer):
+    """The stand-in site for 'records' ((module, year, file id) of each paper), on 'port' (any free one if 0)
+    Downloads answer after 'latency' seconds and send 'bandwidth' bytes a second at most (no limit if None),
+    the table takes 'draw_time' seconds to draw, and the pop-up 'popup_time' seconds to go.
+    Each paper is a generated one of 'pages' pages, 'size' bytes at least, but for the 'files' ({file id: path}, see 'drive_files'),
+    which are sent as they are, named as they are. The 'flaky' file ids fail with 503 the first time they are downloaded,
+    the 'confirm' ones ask for the download to be confirmed first, the 'truncated' ones are cut off halfway every time,
+    and the 'gzipped' ones are sent compressed. Call 'start', and 'close' when done"""
+
+    daemon_threads = True
+
+    def __init__(self, records, port=0, host='127.0.0.1', latency=0, bandwidth=None, draw_time=0.02, popup_time=0.3,
+        pages=4, size=None, files=None, flaky=(), confirm=(), truncated=(), gzipped=()):
+        super().__init__((host, port), StandinHandler)
+        self.records = collections.OrderedDict((file_id, (module, year, file_id)) for (module, year, file_id) in records)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.draw_time = draw_time
+        self.popup_time = popup_time
+        self.template = paper_template(pages)
+        self.size = size
+        self.files = files or {}
+        self.flaky = set(flaky)
+        self.confirm = set(confirm)
+        self.truncated = set(truncated)
+        self.gzipped = set(gzipped)
+        self.hits = collections.Counter() # requests by path
+        self.downloads = collections.Counter() # downloads asked for by file id
+        self.thread = None
+        self._page = None
+
+    def url(self, path=PAGE_PATH):
+        return 'http://{}:{}{}'.format(self.server_address[0], self.server_address[1], path)
+
+    def link(self, file_id):
+        """The link to a paper in the papers table, to its page on the stand-in Drive"""
+        return self.url('/file/d/{}/view'.format(file_id))
+
+    def listing(self, module=None):
+        """(module, year, link) of the papers of 'module' (all of them if None), as 'webscraper.parse_papers' reads them"""
+        return [(record_module, year, self.link(file_id)) for (record_module, year, file_id) in self.records.values()
+            if module is None or module.lower() in record_module.lower()]
+
+    def page(self):
+        if self._page is None:
+            rows = '\n'.join(ROW.format(html.escape(module), html.escape(year), html.escape(self.link(file_id)))
+                for (module, year, file_id) in self.records.values())
+            self._page = PAGE.format(rows=rows, draw_time=int(self.draw_time * 1000), popup_time=self.popup_time, script=TABLE_SCRIPT)
+        return self._page
+
+    def paper(self, file_id):
+        """The bytes of the paper 'file_id', the same paper for all of them but with the id in it so that each is different
+        The id (and any padding up to 'size') is a comment after the end of the PDF, followed by its end again for readers to find"""
+        tail = self.template[self.template.rindex(b'startxref'):]
+        data = self.template + '%{}\n'.format(file_id).encode()
+        if self.size is not None and len(data) + len(tail) + 2 < self.size:
+            data += b'%' + b'0' * (self.size - len(data) - len(tail) - 2) + b'\n'
+        return data + tail
+
+    def download(self, file_id):
+        """(name, bytes) of the paper 'file_id' as downloaded"""
+        if file_id in self.files:
+            with open(self.files[file_id], 'rb') as f:
+                return (os.path.basename(self.files[file_id]), f.read())
+        return (paper_filename(*self.records[file_id]), self.paper(file_id))
+
+    def start(self):
+        """Serve in a thread of its own"""
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def close(self):
+        if self.thread is not None:
+            self.shutdown()
+            self.thread = None
+        self.server_close()
+
+
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8000, help='port to serve on (default: 8000)')
+    parser.add_argument('--module', default='CA117', help='module to make up papers for (default: CA117)')
+    parser.add_argument('--papers', type=int, default=12, help='papers of the module (default: 12)')
+    parser.add_argument('--others', type=int, default=500, help='papers of other modules (default: 500)')
+    parser.add_argument('--recorded', metavar='FILE', help='serve the papers of a saved papers web page instead of made up ones')
+    parser.add_argument('--latency', type=float, default=0, metavar='SECONDS', help='time each download takes to start (default: 0)')
+    parser.add_argument('--bandwidth', type=float, metavar='BYTES', help='bytes a second each download is sent at (default: no limit)')
+    parser.add_argument('--size', type=int, metavar='BYTES', help='size of each paper (default: as generated)')
+    return parser
+
+
+def main():
+    opts = cli_parser().parse_args()
+    if opts.recorded:
+        with open(opts.recorded, 'r', encoding='utf-8') as f:
+            records = recorded_records(f.read())
+    else:
+        records = generate_records(opts.module, opts.papers, opts.others)
+    server = StandinServer(records, opts.port, latency=opts.latency, bandwidth=opts.bandwidth, size=opts.size)
+    print('Serving {} papers at {}'.format(len(records), server.url()))
+    print('Scrape with webscraper.urls[\'main\'] = \'{}\' and a downloader with url_template=\'{}\''.format(
+        server.url(), server.url(DOWNLOAD_PATH)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
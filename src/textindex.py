@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""A full-text index of the pages of PDF's, for slicing at the pages that mention something instead of at a page number
+The text of each page is extracted once and kept, along with an inverted index of the words in it, so that searching
+thousands of papers does not need any of them to be opened again. Entries are keyed by the PDF's path,
+and only trusted while the file's size and modification time stay the same"""
+
+
+import sys
+import os
+import os.path
+import re
+import json
+
+import PyPDF2 as pypdf
+from PyPDF2.pdf import ContentStream
+from PyPDF2.generic import TextStringObject, NumberObject, FloatObject
+
+import pdfindex
+
+
+# text positioning operators that (most likely) start a new line or a new piece of text
+BREAKS = (b'ET', b'Td', b'TD', b'Tm', b'T*')
+
+word_re = re.compile(r'\w+')
+
+
+def page_text(page):
+    """The text of a PageObject, like 'PageObject.extractText' but with the separate pieces of text kept apart
+    (extractText runs the lines of text on a page together, eg: 'questionmarks' for 'question' and 'marks')"""
+    contents = page.get('/Contents')
+    if contents is None:
+        return ''
+    content = ContentStream(contents.getObject(), page.pdf)
+    text = []
+    for (operands, operator) in content.operations:
+        if operator == b'Tj' or operator == b"'":
+            if operator == b"'":
+                text.append('\n')
+            if isinstance(operands[0], TextStringObject):
+                text.append(operands[0])
+        elif operator == b'"':
+            if isinstance(operands[2], TextStringObject):
+                text.append('\n' + operands[2])
+        elif operator == b'TJ':
+            for item in operands[0]:
+                if isinstance(item, TextStringObject):
+                    text.append(item)
+                elif isinstance(item, (NumberObject, FloatObject)) and item < -200:
+                    text.append(' ') # a gap the width of a space or more
+        elif operator in BREAKS:
+            text.append('\n')
+    return ''.join(text)
+
+
+def words(text):
+    """The words of 'text', lower case, in order"""
+    return word_re.findall(text.lower())
+
+
+class PageSelection():
+    """The pages of each PDF that a search of a 'TextIndex' for 'query' found, to slice at in place of a page range
+    'matches' are lists of page indices by the absolute path of the PDF"""
+
+    def __init__(self, query, matches):
+        self.query = query
+        self.matches = matches
+
+    def __str__(self):
+        return self.query
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.query)
+
+    def __len__(self):
+        return sum(len(pages) for pages in self.matches.values())
+
+    def pages(self, path):
+        """Indices of the pages of the PDF at 'path' that were found, possibly none"""
+        if path is None:
+            return []
+        return self.matches.get(os.path.abspath(path), [])
+
+    def runs(self, path):
+        """The pages of the PDF at 'path' that were found, as (start, stop) pairs of consecutive pages"""
+        runs = []
+        for page in self.pages(path):
+            if runs and runs[-1][1] == page:
+                runs[-1] = (runs[-1][0], page+1)
+            else:
+                runs.append((page, page+1))
+        return runs
+
+
+class TextIndex():
+    """The index, stored as JSON at 'path' (or only kept in memory if None). Changes are kept in memory until 'save' is called"""
+
+    def __init__(self, path=None):
+        self.path = path
+        self.docs = {} # absolute path -> {'size', 'mtime', 'pages': text of each page}
+        self.terms = None # word -> list of (path, page index) it is on, built again when None
+        if path is not None and os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    data = json.load(f)
+                self.docs = data['docs']
+                paths = data['paths']
+                self.terms = {term: [(paths[postings[i]], postings[i+1]) for i in range(0, len(postings), 2)]
+                    for (term, postings) in data['terms'].items()}
+            except (ValueError, KeyError, IndexError):
+                self.docs, self.terms = {}, None # corrupt index, start again
+
+    def __len__(self):
+        return len(self.docs)
+
+    def update(self, pdfs, loud=True):
+        """Extract the text of the PDF's (paths) that are not in the index, or have changed since. Return how many were"""
+        extracted = 0
+        for pdf in pdfs:
+            path, size, mtime = pdfindex.file_key(pdf)
+            doc = self.docs.get(path)
+            if doc is not None and (doc['size'], doc['mtime']) == (size, mtime):
+                continue
+            if loud:
+                print('Indexing {}...'.format(pdf))
+            try:
+                with open(path, 'rb') as f:
+                    reader = pypdf.PdfFileReader(f)
+                    pages = []
+                    for i in range(reader.getNumPages()):
+                        try:
+                            pages.append(page_text(reader.getPage(i)))
+                        except Exception:
+                            pages.append('') # one page not extracting does not make the rest unsearchable
+            except Exception as exc:
+                if loud:
+                    print('Exception: {}'.format(exc))
+                pages = []
+            self.docs[path] = {'size': size, 'mtime': mtime, 'pages': pages}
+            self.terms = None
+            extracted += 1
+        return extracted
+
+    def _build_terms(self):
+        self.terms = {}
+        for (path, doc) in self.docs.items():
+            for (i, text) in enumerate(doc['pages']):
+                for term in set(words(text)):
+                    self.terms.setdefault(term, []).append((path, i))
+
+    def search(self, query, regex=False, pdfs=None):
+        """Return a 'PageSelection' of the pages that have all the words of 'query' in them, in order (eg: 'binary search tree'),
+        or if 'regex' the pages that match the regular expression 'query' (ignoring case).
+        Only the PDF's (paths) 'pdfs' are searched if given, they should have been added with 'update' first"""
+        if self.terms is None:
+            self._build_terms()
+        paths = None if pdfs is None else set(os.path.abspath(pdf) for pdf in pdfs)
+        found = []
+        if regex:
+            pattern = re.compile(query, re.IGNORECASE)
+            for (path, doc) in self.docs.items():
+                if paths is None or path in paths:
+                    found += [(path, i) for (i, text) in enumerate(doc['pages']) if pattern.search(text)]
+        else:
+            terms = words(query)
+            if terms:
+                # pages with all the words, rarest word first, then with the words next to each other
+                postings = sorted((self.terms.get(term, []) for term in set(terms)), key=len)
+                candidates = set(postings[0])
+                for more in postings[1:]:
+                    candidates.intersection_update(more)
+                phrase = ' {} '.format(' '.join(terms))
+                for (path, i) in candidates:
+                    if (paths is None or path in paths) and phrase in ' {} '.format(' '.join(words(self.docs[path]['pages'][i]))):
+                        found.append((path, i))
+        matches = {}
+        for (path, i) in sorted(found):
+            matches.setdefault(path, []).append(i)
+        return PageSelection(query, matches)
+
+    def save(self):
+        """Write the index out, with the inverted index too so that it does not have to be built again when loaded"""
+        if self.terms is None:
+            self._build_terms()
+        paths = sorted(self.docs)
+        numbers = {path: n for (n, path) in enumerate(paths)}
+        terms = {term: [item for (path, i) in postings for item in (numbers[path], i)] for (term, postings) in self.terms.items()}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'docs': self.docs, 'paths': paths, 'terms': terms}, f)
+        os.replace(tmp, self.path)
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) not in (2, 3) or (len(args) == 3 and args[2] != '--regex'):
+        print('usage: textindex.py <index_file> <query> [--regex]')
+        sys.exit(2)
+    index = TextIndex(args[0])
+    selection = index.search(args[1], regex=len(args) == 3)
+    for (path, pages) in sorted(selection.matches.items()):
+        print('{}: {}'.format(path, ', '.join(str(page) for page in pages)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python3
+
+"""Quick pre-flight checks of PDF's, sorting them into ok, repairable and broken without parsing them in full
+Only the header, the end of the file (startxref and the trailer) and the few objects leading to the page count are read.
+Verdicts are kept in a quarantine list, so that slicing can skip known broken papers straight away"""
+
+
+import sys
+import os
+import os.path
+import re
+import json
+import collections
+
+import pdfindex
+
+
+OK = 'ok'
+REPAIRABLE = 'repairable' # readable, but with defects that PyPDF2 has to work around
+BROKEN = 'broken' # will not slice
+
+Verdict = collections.namedtuple('Verdict', ['status', 'reason', 'page_count'])
+
+# PyPDF2 only looks for the %%EOF marker this far from the end
+TAIL_SIZE = 1024
+# how far an object is read looking for the entries that are needed
+OBJECT_SIZE = 4096
+
+startxref_re = re.compile(rb'startxref\s+(\d+)\s+%%EOF')
+obj_header_re = re.compile(rb'\s*(\d+)\s+(\d+)\s+obj')
+root_re = re.compile(rb'/Root\s+(\d+)\s+(\d+)\s+R')
+prev_re = re.compile(rb'/Prev\s+(\d+)')
+pages_re = re.compile(rb'/Pages\s+(\d+)\s+(\d+)\s+R')
+count_re = re.compile(rb'/Count\s+(\d+)')
+
+
+def read_xref_table(f, offset):
+    """Read a standard cross-reference table at 'offset' (after the 'xref' keyword),
+    returning ({object number: offset}, trailer bytes), the trailer being None if there is none"""
+    f.seek(offset)
+    data = b''
+    trailer = -1
+    while trailer == -1:
+        chunk = f.read(65536)
+        if not chunk:
+            return ({}, None)
+        data += chunk
+        trailer = data.find(b'trailer')
+    if len(data) - trailer < OBJECT_SIZE:
+        data += f.read(OBJECT_SIZE)
+    # subsections of 'first_number count' followed by 'offset generation n/f' entries, however the lines end
+    tokens = data[:trailer].split()
+    entries = {}
+    i = 0
+    while i+1 < len(tokens):
+        start, count = int(tokens[i]), int(tokens[i+1])
+        i += 2
+        for num in range(start, start+count):
+            entry_offset, generation, kind = tokens[i:i+3]
+            i += 3
+            if kind == b'n':
+                entries[num] = int(entry_offset)
+    end = data.find(b'startxref', trailer)
+    return (entries, data[trailer:end if end != -1 else None])
+
+
+def read_object(f, offset, idnum):
+    """Return the start of object 'idnum' at 'offset', or None if it is not there"""
+    f.seek(offset)
+    data = f.read(OBJECT_SIZE)
+    match = obj_header_re.match(data)
+    if match is None or int(match.group(1)) != idnum:
+        return None
+    end = data.find(b'endobj')
+    return data[match.end():end if end != -1 else None]
+
+
+def scan(path):
+    """Return the 'Verdict' for the PDF at 'path'"""
+    size = os.path.getsize(path)
+    if size == 0:
+        return Verdict(BROKEN, 'empty file', None)
+    with open(path, 'rb') as f:
+        head = f.read(1024)
+        header = head.find(b'%PDF-')
+        if header == -1:
+            return Verdict(BROKEN, 'no %PDF- header', None)
+        problems = []
+        if header > 0:
+            problems.append('{} bytes before the %PDF- header'.format(header))
+
+        f.seek(max(size-TAIL_SIZE, 0))
+        tail = f.read()
+        if b'%%EOF' not in tail:
+            return Verdict(BROKEN, 'no %%EOF marker near the end, file may be truncated', None)
+        matches = startxref_re.findall(tail)
+        if not matches:
+            return Verdict(BROKEN, 'no startxref before %%EOF', None)
+        startxref = int(matches[-1])
+        if startxref >= size:
+            return Verdict(BROKEN, 'startxref points past the end of the file', None)
+
+        f.seek(startxref)
+        at = f.read(32)
+        if obj_header_re.match(at):
+            # cross-reference stream, would have to be decompressed to go any further
+            return Verdict(REPAIRABLE if problems else OK, '; '.join(problems) or 'cross-reference stream', None)
+        if not at.startswith(b'xref'):
+            f.seek(max(startxref-10, 0))
+            near = f.read(24)
+            if b'xref' not in near:
+                return Verdict(BROKEN, 'no cross-reference table at startxref', None)
+            startxref = max(startxref-10, 0) + near.find(b'xref')
+            problems.append('startxref off by a few bytes')
+
+        xref = {}
+        trailer = None
+        offset = startxref
+        for _ in range(32): # follow /Prev's back through incremental updates, but not forever
+            try:
+                entries, section_trailer = read_xref_table(f, offset+4)
+            except ValueError:
+                return Verdict(BROKEN, 'unreadable cross-reference table', None)
+            for (num, entry) in entries.items():
+                xref.setdefault(num, entry)
+            if section_trailer is None:
+                return Verdict(BROKEN, 'no trailer after the cross-reference table', None)
+            if trailer is None:
+                trailer = section_trailer
+            prev = prev_re.search(section_trailer)
+            if prev is None:
+                break
+            offset = int(prev.group(1))
+        if b'/Encrypt' in trailer:
+            return Verdict(BROKEN, 'encrypted', None)
+        root = root_re.search(trailer)
+        if root is None:
+            return Verdict(BROKEN, 'trailer has no /Root', None)
+        root_num = int(root.group(1))
+        if root_num not in xref:
+            return Verdict(BROKEN, '/Root object is not in the cross-reference table', None)
+        catalog = read_object(f, xref[root_num], root_num)
+        if catalog is None:
+            return Verdict(BROKEN, 'cross-reference table entry of /Root points to the wrong place', None)
+        pages = pages_re.search(catalog)
+        if pages is None:
+            return Verdict(BROKEN, 'document catalog has no /Pages', None)
+        pages_num = int(pages.group(1))
+        page_tree = read_object(f, xref[pages_num], pages_num) if pages_num in xref else None
+        if page_tree is None:
+            return Verdict(BROKEN, 'page tree root can not be found', None)
+        count = count_re.search(page_tree)
+        if count is None:
+            return Verdict(REPAIRABLE, '; '.join(problems + ['page tree root has no /Count']), None)
+    return Verdict(REPAIRABLE if problems else OK, '; '.join(problems) or None, int(count.group(1)))
+
+
+class Quarantine():
+    """Verdicts of scanned PDF's, stored as JSON at 'path', keyed by the PDF's path
+    A verdict is only trusted while the file's size and modification time stay the same"""
+
+    def __init__(self, path):
+        self.path = path
+        self.verdicts = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, 'r') as f:
+                    self.verdicts = json.load(f)
+            except ValueError:
+                self.verdicts = {} # corrupt list, scan again
+
+    def lookup(self, pdf):
+        """Return the 'Verdict' for the file at 'pdf', or None if it has not been scanned since it last changed"""
+        path, size, mtime = pdfindex.file_key(pdf)
+        entry = self.verdicts.get(path)
+        if entry is None or (entry['size'], entry['mtime']) != (size, mtime):
+            return None
+        return Verdict(entry['status'], entry['reason'], entry['page_count'])
+
+    def record(self, pdf, verdict):
+        path, size, mtime = pdfindex.file_key(pdf)
+        self.verdicts[path] = dict(verdict._asdict(), size=size, mtime=mtime)
+
+    def check(self, pdf):
+        """Return the 'Verdict' for the file at 'pdf', scanning it if it has not been yet"""
+        verdict = self.lookup(pdf)
+        if verdict is None:
+            verdict = scan(pdf)
+            self.record(pdf, verdict)
+        return verdict
+
+    def quarantined(self):
+        """Paths of the files known to be broken"""
+        return sorted(path for (path, entry) in self.verdicts.items() if entry['status'] == BROKEN)
+
+    def triage(self, pdfs, page_nrs=None, loud=True):
+        """Return 'pdfs' (paths) without the broken ones, and without those known to have none of the pages 'page_nrs' if given"""
+        kept = []
+        for pdf in pdfs:
+            verdict = self.check(pdf)
+            if verdict.status == BROKEN:
+                if loud:
+                    print('{} is broken ({})... skipping'.format(pdf, verdict.reason))
+                continue
+            if page_nrs is not None and verdict.page_count is not None and not range(*page_nrs.indices(verdict.page_count)):
+                continue
+            kept.append(pdf)
+        return kept
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(self.verdicts, f, indent=1)
+        os.replace(tmp, self.path)
+
+
+def main():
+    args = sys.argv[1:]
+    if len(args) not in (1, 2):
+        print('usage: triage.py <directory_of_pdfs> [<quarantine_file>]')
+        sys.exit(2)
+    directory = os.path.abspath(args[0])
+    quarantine = Quarantine(args[1]) if len(args) == 2 else None
+    for filename in sorted(os.listdir(directory)):
+        if os.path.splitext(filename)[1] != '.pdf':
+            continue
+        path = os.path.join(directory, filename)
+        verdict = quarantine.check(path) if quarantine else scan(path)
+        print('{:<10} {:>5} {} {}'.format(verdict.status, verdict.page_count if verdict.page_count is not None else '?',
+            filename, '({})'.format(verdict.reason) if verdict.reason else ''))
+    if quarantine:
+        quarantine.save()
+
+
+if __name__ == '__main__':
+    main()
@@ -7,8 +7,17 @@
 # standard library
 import os
 import os.path
-import sys
 import time
+import queue
+import collections
+import shutil
+import argparse
+import inspect
+import threading
+import functools
+import contextlib
+import html.parser
+import urllib.parse
 
 # selenium core
 import selenium # selenium.__version__ for version info
@@ -19,6 +28,13 @@ from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import Select
+from selenium.common.exceptions import WebDriverException, TimeoutException
+
+# exam-tk
+import catalog
+import downloader
+import downloadwatch
+import webtrace
 
 
 ## version info
@@ -41,6 +57,7 @@ urls = {
 
 css_sels = {
     'paperdata' :'#mySelection_wrapper',
+    'papertable' :'#mySelection',
     'howmany' :'#mySelection_length select',
     'modfilter' :'#mySelection_filter input',
     'sort_s' :'#mySelection > thead > tr > th', 
@@ -56,6 +73,118 @@ css_sels = {
     'dlbutton' : "div[aria-label='Download']",
 }
 
+# scripts run in the page to wait for something to happen in it, answering as soon as it does (see 'DCU_Website.dcu_wait_script')
+# instead of the browser being asked again and again. The timeout in milliseconds is the last argument before the callback
+scripts = {
+    # the first element (or all the elements if arguments[1]) that 'arguments[0]' selects, once there are any, null if none in time
+    'find': """
+        var selector = arguments[0], all = arguments[1], timeout = arguments[2], done = arguments[arguments.length - 1];
+        function found() {
+            var elements = document.querySelectorAll(selector);
+            return elements.length ? (all ? Array.prototype.slice.call(elements) : elements[0]) : null;
+        }
+        var result = found();
+        if (result) {
+            done(result);
+            return;
+        }
+        var observer = new MutationObserver(function() {
+            var result = found();
+            if (result) {
+                observer.disconnect();
+                clearTimeout(timer);
+                done(result);
+            }
+        });
+        var timer = setTimeout(function() { observer.disconnect(); done(null); }, timeout);
+        observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+    """,
+    # true once the element 'arguments[0]' selects is gone, hidden or out of the window, false if not in time
+    'hidden': """
+        var selector = arguments[0], timeout = arguments[1], done = arguments[arguments.length - 1];
+        function hidden() {
+            var element = document.querySelector(selector);
+            if (!element) {
+                return true;
+            }
+            var style = window.getComputedStyle(element), box = element.getBoundingClientRect();
+            return style.display === 'none' || style.visibility === 'hidden' || style.opacity === '0' ||
+                box.width === 0 || box.height === 0 || box.top >= window.innerHeight || box.bottom <= 0;
+        }
+        if (hidden()) {
+            done(true);
+            return;
+        }
+        function check() {
+            if (hidden()) {
+                finish(true);
+            }
+        }
+        function finish(result) {
+            observer.disconnect();
+            document.removeEventListener('transitionend', check, true);
+            document.removeEventListener('animationend', check, true);
+            clearTimeout(timer);
+            done(result);
+        }
+        var observer = new MutationObserver(check);
+        observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true});
+        document.addEventListener('transitionend', check, true);
+        document.addEventListener('animationend', check, true);
+        var timer = setTimeout(function() { finish(hidden()); }, timeout);
+    """,
+    # start counting the draws of the table 'arguments[0]' selects (DataTables 'draw' events, or changes to its rows
+    # without DataTables), returning how many there have been
+    'draws': """
+        var table = document.querySelector(arguments[0]);
+        var state = window.dcuDraws;
+        if (!state || state.table !== table) {
+            state = window.dcuDraws = {table: table, count: 0, waiters: []};
+            var drawn = function() {
+                state.count++;
+                var waiters = state.waiters;
+                state.waiters = [];
+                waiters.forEach(function(waiter) { waiter(); });
+            };
+            if (window.jQuery && jQuery.fn.dataTable && jQuery.fn.dataTable.isDataTable(table)) {
+                jQuery(table).on('draw.dt', drawn);
+            } else if (table) {
+                new MutationObserver(drawn).observe(table, {childList: true, subtree: true});
+            }
+        }
+        return state.count;
+    """,
+    # true once the table has been drawn since there were 'arguments[0]' draws, and not again for 'arguments[1]' milliseconds
+    # (typing into the filter draws the table for each key), false if not in time
+    'drawn': """
+        var since = arguments[0], settle = arguments[1], timeout = arguments[2], done = arguments[arguments.length - 1];
+        var state = window.dcuDraws, quiet = null, finished = false;
+        function finish(result) {
+            if (!finished) {
+                finished = true;
+                clearTimeout(quiet);
+                clearTimeout(timer);
+                done(result);
+            }
+        }
+        function drawn() {
+            if (!finished) {
+                clearTimeout(quiet);
+                quiet = setTimeout(function() { finish(true); }, settle);
+                state.waiters.push(drawn);
+            }
+        }
+        var timer = setTimeout(function() { finish(false); }, timeout);
+        if (!state) {
+            finish(false);
+        } else if (state.count > since) {
+            drawn();
+        } else {
+            state.waiters.push(drawn);
+        }
+    """,
+}
+
 
 ## decorators
 
@@ -67,6 +196,16 @@ def on_root(root_url):
     """Requires the page the browser is on to have the same 'base' URL as the specified root_url"""
     raise NotImplementedError
 
+def traced(method):
+    """Record the calls of a 'DCU_Website' method in the browser's tracer, if it has one"""
+    @functools.wraps(method)
+    def traced_method(self, *args, **kwargs):
+        if self.dcu_tracer is None:
+            return method(self, *args, **kwargs)
+        with self.dcu_tracer.span(method.__name__, 'call'):
+            return method(self, *args, **kwargs)
+    return traced_method
+
 
 ## exceptions
 
@@ -75,6 +214,69 @@ class NotEnoughArgumentsError(TypeError):
     pass
 
 
+## page parsing
+
+class PaperTableParser(html.parser.HTMLParser):
+    """Parses the (module, year, link) of each paper out of the HTML of the papers table (the element with id 'table_id'),
+    so that the whole table can be read with a single call to the browser instead of a few calls for each paper.
+    Feed it the HTML, the papers are then in 'papers'"""
+
+    def __init__(self, table_id='mySelection', base_url=None):
+        super().__init__()
+        self.table_id = table_id
+        self.base_url = base_url
+        self.papers = []
+        self.depth = 0 # how many tables deep inside the papers table, 0 when outside of it
+        self.in_body = False
+        self.row = None # text and link of each cell of the row being read
+        self.cell = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'table':
+            if self.depth or attrs.get('id') == self.table_id:
+                self.depth += 1
+        elif self.depth != 1:
+            return
+        elif tag == 'tbody':
+            self.in_body = True
+        elif tag == 'tr' and self.in_body:
+            self.row = []
+        elif tag in ('td', 'th') and self.row is not None:
+            self.cell = [[], None]
+            self.row.append(self.cell)
+        elif tag == 'a' and self.cell is not None and self.cell[1] is None and attrs.get('href'):
+            self.cell[1] = urllib.parse.urljoin(self.base_url, attrs['href']) if self.base_url else attrs['href']
+
+    def handle_endtag(self, tag):
+        if tag == 'table' and self.depth:
+            self.depth -= 1
+        elif self.depth != 1:
+            return
+        elif tag == 'tbody':
+            self.in_body = False
+        elif tag in ('td', 'th'):
+            self.cell = None
+        elif tag == 'tr' and self.row is not None:
+            # rows without 3 cells and a link are not papers, eg: 'No matching records found'
+            if len(self.row) == 3 and self.row[2][1]:
+                (module, year, link) = self.row
+                self.papers.append((' '.join(''.join(module[0]).split()), ' '.join(''.join(year[0]).split()), link[1]))
+            self.row = None
+
+    def handle_data(self, data):
+        if self.depth == 1 and self.cell is not None:
+            self.cell[0].append(data)
+
+
+def parse_papers(page_html, base_url=None):
+    """A list of (module, year, link) of each paper in the papers table in 'page_html'"""
+    parser = PaperTableParser(css_sels['papertable'].lstrip('#'), base_url)
+    parser.feed(page_html)
+    parser.close()
+    return parser.papers
+
+
 ## core classes
 
 class DCU_Website(webdriver.Firefox):
@@ -83,18 +285,57 @@ class DCU_Website(webdriver.Firefox):
     Static methods include website related functionalities like returning appropriate profile preferences for a browser"""
 
     def __init__(self, firefox_profile=None, firefox_binary=None, timeout=30, capabilities=None, proxy=None, executable_path='geckodriver', options=None, log_path='geckodriver.log', firefox_options=None, service_args=None, 
-        wait_time=15, sliding_time=20):
+        wait_time=15, sliding_time=20, event_waits=True, settle_time=0.05, tracer=None):
+        self.dcu_tracer = tracer # 'webtrace.Tracer' to record the commands sent to the browser and the 'dcu_*' calls in, if any
         super().__init__(firefox_profile=firefox_profile, firefox_binary=firefox_binary, timeout=timeout, capabilities=capabilities, proxy=proxy, executable_path=executable_path, options=options, log_path=log_path, firefox_options=firefox_options, service_args=service_args)
         self.dcu_wait_time = wait_time # seconds to wait for elements for
         self.dcu_sliding_time = sliding_time # seconds for popup sliding duration
+        self.dcu_event_waits = event_waits # wait with scripts in the page (see 'scripts') instead of asking the browser every half second
+        self.dcu_settle_time = settle_time # seconds the table has to stay as it is to be taken as drawn
+        self.dcu_script_timeout = None
+
+    def execute(self, driver_command, params=None):
+        """Send a command to the browser (every command goes through here, the elements' ones too), tracing it if there is a tracer"""
+        if self.dcu_tracer is None:
+            return super().execute(driver_command, params)
+        with self.dcu_tracer.span(driver_command, 'command', webtrace.command_args(params)):
+            return super().execute(driver_command, params)
+
+    def dcu_wait_script(self, script, seconds, *args):
+        """Run one of the 'scripts', waiting for up to 'seconds' for something to happen in the page. Return what it answers"""
+        if self.dcu_script_timeout != seconds + 5:
+            self.set_script_timeout(seconds + 5) # the script's own timeout goes off first
+            self.dcu_script_timeout = seconds + 5
+        return self.execute_async_script(script, *args, int(seconds * 1000))
 
     def dcu_find(self, css_sel):
         """Find an element on the page, waiting in case it has not loaded yet"""
-        return WebDriverWait(self, self.dcu_wait_time).until(EC.presence_of_element_located((By.CSS_SELECTOR, css_sel)))
+        if not self.dcu_event_waits:
+            return WebDriverWait(self, self.dcu_wait_time).until(EC.presence_of_element_located((By.CSS_SELECTOR, css_sel)))
+        element = self.dcu_wait_script(scripts['find'], self.dcu_wait_time, css_sel, False)
+        if element is None:
+            raise TimeoutException('no {} after {} seconds'.format(css_sel, self.dcu_wait_time))
+        return element
 
     def dcu_finds(self, css_sel):
         """Find multiple elements on the page, waiting until at least one of the elements loads first"""
-        return WebDriverWait(self, self.dcu_wait_time).until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, css_sel)))
+        if not self.dcu_event_waits:
+            return WebDriverWait(self, self.dcu_wait_time).until(EC.presence_of_all_elements_located((By.CSS_SELECTOR, css_sel)))
+        elements = self.dcu_wait_script(scripts['find'], self.dcu_wait_time, css_sel, True)
+        if elements is None:
+            raise TimeoutException('no {} after {} seconds'.format(css_sel, self.dcu_wait_time))
+        return elements
+
+    def dcu_redraw(self, action):
+        """Do 'action()', something that makes the papers table draw itself again (eg: filtering it, going to the next page),
+        and wait until it has been drawn, returning what 'action' did"""
+        if not self.dcu_event_waits:
+            return action()
+        since = self.execute_script(scripts['draws'], css_sels['papertable'])
+        result = action()
+        if not self.dcu_wait_script(scripts['drawn'], self.dcu_wait_time, since, int(self.dcu_settle_time * 1000)):
+            raise TimeoutException('the papers table was not drawn again after {} seconds'.format(self.dcu_wait_time))
+        return result
 
     def dcu_mainpage(self):
         """Wrapper for going to the main page of the DCU exam papers online database"""
@@ -102,7 +343,10 @@ class DCU_Website(webdriver.Firefox):
 
     def dcu_wait_for_data(self, css_selector, time=30):
         """Blocks further execution until the data referenced by 'css_selector' loads, or times out"""
-        WebDriverWait(self, time).until(EC.presence_of_element_located((By.CSS_SELECTOR, css_selector)))
+        if not self.dcu_event_waits:
+            WebDriverWait(self, time).until(EC.presence_of_element_located((By.CSS_SELECTOR, css_selector)))
+        elif self.dcu_wait_script(scripts['find'], time, css_selector, False) is None:
+            raise TimeoutException('no {} after {} seconds'.format(css_selector, time))
 
     #@on(urls['main'])
     def dcu_howmany(self):
@@ -110,10 +354,11 @@ class DCU_Website(webdriver.Firefox):
         return Select(self.dcu_find(css_sels['howmany']))
 
     def dcu_show_max(self):
-        """Show the maximum number of papers on a page"""
+        """Show the maximum number of papers on a page, waiting for the table to be drawn with them"""
         select = self.dcu_howmany()
         largest_value = str(max([int(opt.get_attribute('value')) for opt in select.options]))
-        select.select_by_value(largest_value)
+        if select.first_selected_option.get_attribute('value') != largest_value:
+            self.dcu_redraw(lambda: select.select_by_value(largest_value))
         assert select.first_selected_option.get_attribute('value') == largest_value
         return select.first_selected_option.get_attribute('value')
 
@@ -163,7 +408,10 @@ class DCU_Website(webdriver.Firefox):
         """Agree to the sliding cookies/data notice pop-up and wait until it disappears"""
         popup_button = self.dcu_find(css_sels['popupbutton'])
         popup_button.click()
-        WebDriverWait(self, self.dcu_sliding_time).until(EC.invisibility_of_element_located((By.CSS_SELECTOR, css_sels['popupbutton'])))
+        if not self.dcu_event_waits:
+            WebDriverWait(self, self.dcu_sliding_time).until(EC.invisibility_of_element_located((By.CSS_SELECTOR, css_sels['popupbutton'])))
+        elif not self.dcu_wait_script(scripts['hidden'], self.dcu_sliding_time, css_sels['popupbutton']):
+            raise TimeoutException('the pop-up was still there after {} seconds'.format(self.dcu_sliding_time))
 
     def dcu_infodatum(self):
         """Retrieve a dictionary representing parts of the infodatum that can be found at the bottom of a DCU papers webpage
@@ -216,6 +464,14 @@ class DCU_Website(webdriver.Firefox):
         """A list of links to each of the papers displayed on the current page"""
         return [self.dcu_paper_link(element) for element in self.dcu_all_page_papers()]
 
+    def dcu_harvest_papers(self):
+        """Return a list of (module, year, link) of each of the papers displayed on the current page,
+        like 'dcu_paper_data' for each paper, but reading the whole table in one go and parsing it here"""
+        self.dcu_wait_for_data(css_sels['paper_s'].format('n'), self.dcu_wait_time)
+        table_html = self.execute_script("var table = document.querySelector(arguments[0]); return table ? table.outerHTML : null;",
+            css_sels['papertable'])
+        return parse_papers(table_html or self.page_source, self.current_url)
+
     def dcu_dlpage(self, url):
         """Wrapper for getting the download page of a paper given the paper's URL"""
         self.get(url)
@@ -227,14 +483,14 @@ class DCU_Website(webdriver.Firefox):
         self.dcu_find(css_sels['dlbutton']).click()
 
     @staticmethod
-    def dcu_autosave_profile(profile_class=webdriver.FirefoxProfile):
+    def dcu_autosave_profile(profile_class=webdriver.FirefoxProfile, directory=None):
         """Return a browser profile preferences object with suitable preferences set,
-        so that downloads are done automatically and saved to the desired directory"""
+        so that downloads are done automatically and saved to the desired directory ('paths['save_dir']' if None)"""
         profile = profile_class()
         preferences = {
             'browser.helperApps.neverAsk.saveToDisk':'application/pdf',
             'browser.download.folderList': 2,
-            'browser.download.dir': paths['save_dir'],
+            'browser.download.dir': directory or paths['save_dir'],
             'browser.downloads.useDownloadDir': True,
             'pdfjs.disabled': True,
             'browser.download.manager.useWindow': False,
@@ -249,38 +505,264 @@ class DCU_Website(webdriver.Firefox):
         return profile
 
 
+# every 'dcu_*' method is traced (see 'traced')
+for (name, method) in list(vars(DCU_Website).items()):
+    if name.startswith('dcu_') and inspect.isfunction(method):
+        setattr(DCU_Website, name, traced(method))
+
+
+def headless_browser(directory):
+    """A 'DCU_Website' without a window, that saves downloads into 'directory'"""
+    options = webdriver.FirefoxOptions()
+    options.headless = True
+    return DCU_Website(firefox_profile=DCU_Website.dcu_autosave_profile(directory=directory), executable_path=paths['driver'], options=options)
+
+
+def setup_browser(browser):
+    """Get a browser past the cookies pop-up of the papers web page, once before it is put to use"""
+    browser.dcu_mainpage()
+    browser.dcu_wait_for_data(css_sels['paperdata'])
+    browser.dcu_deactivate_popup()
+
+
+class BrowserPool():
+    """'size' browsers downloading papers side by side, taking them from a queue. Each browser saves into a directory of its own
+    under 'directory' (paths['save_dir'] if None), and its downloads are moved into 'directory' once finished (see 'downloader.unique_path').
+    A browser that crashes or loses its connection to the script (eg: when Firefox updates itself) is replaced by a new one,
+    and its paper tried again up to 'retries' times. Browsers are made with 'make_browser(directory)' and set up with 'setup(browser)'.
+    With a 'webtrace.Tracer' each browser's commands and calls are recorded in it"""
+
+    def __init__(self, size=4, directory=None, make_browser=headless_browser, setup=setup_browser, retries=1,
+        start_time=10, download_time=120, loud=True, tracer=None):
+        self.size = size
+        self.directory = os.path.abspath(directory or paths['save_dir'])
+        self.make_browser = make_browser
+        self.setup = setup
+        self.retries = retries
+        self.start_time = start_time # seconds to wait for a download to start
+        self.download_time = download_time # seconds to wait for a download to finish
+        self.loud = loud
+        self.tracer = tracer # 'webtrace.Tracer' for the browsers to record what they do in, if any
+        self.moving = threading.Lock() # held while a download is moved into 'directory'
+
+    def run(self, links):
+        """Download the papers at 'links', returning a 'downloader.Download' for each, in order"""
+        work = queue.Queue()
+        for item in enumerate(links):
+            work.put(item)
+        results = [None] * len(links)
+        workers = [threading.Thread(target=self.worker, args=(i, work, results)) for i in range(min(self.size, len(links)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return results
+
+    def worker(self, i, work, results):
+        directory = os.path.join(self.directory, '.browser-{}'.format(i))
+        os.makedirs(directory, exist_ok=True)
+        browser = None
+        try:
+            while True:
+                try:
+                    (n, link) = work.get_nowait()
+                except queue.Empty:
+                    return
+                start = time.perf_counter()
+                attempts = 0
+                while True:
+                    attempts += 1
+                    try:
+                        if browser is None:
+                            browser = self.make_browser(directory)
+                            if self.tracer is not None:
+                                browser.dcu_tracer = self.tracer
+                            if self.setup is not None:
+                                self.setup(browser)
+                        path = self.fetch(browser, directory, link)
+                    except WebDriverException as exc:
+                        if self.loud:
+                            print('Browser {} failed, starting a new one ({})'.format(i, str(exc).strip()))
+                        self.discard(browser)
+                        browser = None
+                        if attempts <= self.retries:
+                            continue
+                        path, error = None, '{}: {}'.format(type(exc).__name__, str(exc).strip())
+                    else:
+                        error = None if path is not None else 'timed out'
+                    if self.loud:
+                        print('Downloaded {}'.format(os.path.basename(path)) if path else 'Failed {} ({})'.format(link, error))
+                    results[n] = downloader.Download(link, path, 'ok' if path else 'failed', error, attempts,
+                        os.path.getsize(path) if path else 0, time.perf_counter() - start)
+                    break
+        finally:
+            self.discard(browser)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def fetch(self, browser, directory, link):
+        """Download the paper at 'link' with 'browser' (saving into 'directory'), returning where it was moved to, None if it timed out"""
+        with downloadwatch.DownloadTracker(directory) as tracker:
+            browser.dcu_dlpage(link)
+            browser.dcu_download()
+            tracker.started(link, self.start_time)
+            completion = tracker.wait(self.download_time)
+        if link not in completion.done:
+            return None
+        with self.moving:
+            # not over a paper of the same name, same as 'downloader.Downloader'
+            path = downloader.unique_path(self.directory, os.path.basename(completion.done[link]), catalog.file_id(link), set())
+            os.replace(completion.done[link], path)
+        return path
+
+    def discard(self, browser):
+        if browser is None:
+            return
+        try:
+            browser.quit()
+        except Exception:
+            pass # already gone
+
+
 class DCU_Webscraper():
     """An instance of a web scraping session, 
     with more complex functions to interact with the DCU webpage wrapper"""
 
-    def __init__(self, browser=None, module=''):
-        if browser == None:
-            browser = DCU_Website()
-        self.browser = browser
+    def __init__(self, browser=None, module='', papers=None, downloader=None, harvest=True, pool=None, make_browser=DCU_Website,
+        listing_ttl=None, tracer=None):
+        self._browser = browser
+        self.make_browser = make_browser # makes the browser when it is first needed, if not given one
         if not module:
             print('Warning. It looks like that you might be attempting to scrape the entirety of all the available papers in the database! Are you sure you are up to such a feat???!!!')
         self.module = module
+        self.papers = papers # 'catalog.Catalog' to add the papers listed and downloaded to, if any
+        self.downloader = downloader # 'downloader.Downloader' to download the papers with, the browser being the fallback
+        self.harvest = harvest # read the papers of each page in one go ('dcu_harvest_papers') instead of paper by paper
+        self.pool = pool # 'BrowserPool' to download through the browser with, instead of with 'browser' one paper at a time
+        self.listing_ttl = listing_ttl # seconds a listing of the module's papers kept in the catalog is used for, instead of listing them again
+        self.download_start_time = 10 # seconds to wait for a download through the browser to start
+        self.download_time = 120 # seconds to wait for the downloads through the browser to finish
+        self.tracer = tracer # 'webtrace.Tracer' to record the phases of the scrape, and the browser's commands and calls, in
+        if browser is not None and tracer is not None:
+            browser.dcu_tracer = tracer
+
+    @property
+    def browser(self):
+        if self._browser is None:
+            self._browser = self.make_browser()
+            if self.tracer is not None:
+                self._browser.dcu_tracer = self.tracer
+        return self._browser
+
+    def phase(self, name):
+        """Time what is done in the with block as the phase 'name' of the scrape (see 'webtrace.PHASES'), if tracing"""
+        return self.tracer.phase(name) if self.tracer is not None else contextlib.nullcontext()
+
+    def close(self):
+        """Close the browser, if it was needed"""
+        if self._browser is not None:
+            self._browser.quit()
+            self._browser = None
+
+    def page_papers(self):
+        """(module, year, link) of the papers on the current page, adding the papers to the catalog on the way if there is one"""
+        if self.harvest:
+            records = self.browser.dcu_harvest_papers()
+        elif self.papers is None:
+            return [(None, None, link) for link in self.browser.dcu_all_page_links()]
+        else:
+            records = [self.browser.dcu_paper_data(element) for element in self.browser.dcu_all_page_papers()]
+        if self.papers is not None:
+            for (module, year, link) in records:
+                self.papers.add_listing(module, year, link)
+        return records
+
+    def page_links(self):
+        """Links to the papers on the current page, adding the papers to the catalog on the way if there is one"""
+        return [link for (module, year, link) in self.page_papers()]
 
     def scrape_all(self):
-        self.browser.dcu_mainpage()
-        self.browser.dcu_wait_for_data(css_sels['paperdata'])
-        self.browser.dcu_deactivate_popup()
-        self.browser.dcu_set_module(self.module)
-        self.browser.dcu_show_max()
-
-        papers = self.browser.dcu_all_page_links()
-        nexts = self.browser.dcu_total_pagination()-1 
-        for i in range(nexts):
-            self.browser.dcu_next_button().click()
-            papers += self.browser.dcu_all_page_links()
-
-        for url in papers:
-            self.browser.dcu_dlpage(url)
-            self.browser.dcu_download()
-        time.sleep(8)
-
+        papers = self.list_papers()
+        self.download(papers)
         return papers
 
+    def list_papers(self, refresh=False):
+        """Go through every page of the listing of the module's papers, returning the links to the papers
+        If the catalog has a listing of them from less than 'listing_ttl' seconds ago, that is used instead, unless 'refresh'"""
+        if self.papers is not None and self.listing_ttl and not refresh:
+            records = self.papers.cached_listing(self.module, self.listing_ttl)
+            if records is not None:
+                print('Using the list of papers from {:.0f} minutes ago'.format(self.papers.listing_age(self.module) / 60))
+                return [link for (module, year, link) in records]
+
+        with self.phase('setup'):
+            self.browser.dcu_mainpage()
+            self.browser.dcu_wait_for_data(css_sels['paperdata'])
+            self.browser.dcu_deactivate_popup()
+        if self.module:
+            with self.phase('filter'):
+                self.browser.dcu_redraw(lambda: self.browser.dcu_set_module(self.module))
+        with self.phase('pagination'):
+            self.browser.dcu_show_max()
+
+        with self.phase('harvest'):
+            records = self.page_papers()
+        with self.phase('pagination'):
+            nexts = self.browser.dcu_total_pagination()-1 
+        for i in range(nexts):
+            with self.phase('pagination'):
+                self.browser.dcu_redraw(self.browser.dcu_next_button().click)
+            with self.phase('harvest'):
+                records += self.page_papers()
+        if self.papers is not None:
+            self.papers.cache_listing(self.module, records)
+        return [link for (module, year, link) in records]
+
+    def downloaded(self, link, path, on_download=None):
+        """Add the paper at 'link' just downloaded into 'path' to the catalog, and hand it to 'on_download(link, path)'
+        If it is the same as a paper downloaded before (eg: listed under another module), that one is handed over and the new file removed"""
+        if self.papers is not None:
+            kept = self.papers.add_file(path, module=self.module or None, link=link, downloaded=time.time())
+            if kept != os.path.abspath(path):
+                os.remove(path)
+            path = kept
+        if on_download is not None:
+            on_download(link, path)
+
+    def download(self, links, on_download=None):
+        """Download the papers at 'links' straight over HTTP if there is a downloader,
+        and through the browser the ones that could not be (all of them without a downloader),
+        returning the 'downloadwatch.Completion' of those, None if there were none.
+        With a catalog, the papers it has downloaded already are left out.
+        'on_download(link, path)' is called with each paper as soon as it has been downloaded, if given"""
+        if self.papers is not None:
+            pending = self.papers.pending(links)
+            print('{} papers downloaded already, {} to download'.format(len(links) - len(pending), len(pending)))
+            links = pending
+        with self.phase('download'):
+            fallback = links
+            if self.downloader is not None:
+                downloads = self.downloader.run(links, lambda download: self.downloaded(download.link, download.path, on_download))
+                fallback = [download.link for download in downloads if download.status != 'ok']
+
+            if not fallback:
+                return None
+            if self.pool is not None:
+                downloads = self.pool.run(fallback)
+                completion = downloadwatch.Completion(collections.OrderedDict((download.link, download.path) for download in downloads
+                    if download.status == 'ok'), [download.link for download in downloads if download.status != 'ok'])
+            else:
+                with downloadwatch.DownloadTracker(paths['save_dir']) as tracker:
+                    for url in fallback:
+                        self.browser.dcu_dlpage(url)
+                        self.browser.dcu_download()
+                        tracker.started(url, self.download_start_time)
+                    completion = tracker.wait(self.download_time)
+            for url in completion.timed_out:
+                print('Timed out downloading {}'.format(url))
+            for (url, path) in completion.done.items():
+                self.downloaded(url, path, on_download)
+            return completion
+
     def scrape_some():
         raise NotImplementedError
 
@@ -290,25 +772,67 @@ class DCU_Webscraper():
 
 ## command-line interface
 
+def cli_parser():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('module', help='module code of the papers to download, eg: ca117')
+    parser.add_argument('directory', nargs='?', help='directory to save the papers in (default: the current directory)')
+    parser.add_argument('catalog', nargs='?',
+        help='catalog to add the papers to, see catalog.py. It keeps track of what has been downloaded, so that only new papers '
+        '(and the ones an interrupted run did not get to) are downloaded (default: .papers.db in the directory)')
+    parser.add_argument('--browser', action='store_true',
+        help='download the papers through the browser (see --browsers) instead of straight over HTTP')
+    parser.add_argument('--concurrency', type=int, default=8, help='papers to download at the same time (default: 8)')
+    parser.add_argument('--retries', type=int, default=3, help='times to retry a failed download (default: 3)')
+    parser.add_argument('--browsers', type=int, default=4,
+        help='headless browsers to download the papers that could not be downloaded over HTTP with, side by side (default: 4), '
+        '0 to download them one at a time with the browser that lists the papers')
+    parser.add_argument('--listing-ttl', type=float, default=24, metavar='HOURS',
+        help='use the list of the module\'s papers from an earlier run if it is less than HOURS old, instead of going through '
+        'the web page again (default: 24, 0 to always go through it)')
+    parser.add_argument('--refresh', action='store_true', help='go through the web page for the list of papers, however old it is')
+    parser.add_argument('--per-row', action='store_true',
+        help='read the list of papers paper by paper through the browser, instead of a page at a time')
+    parser.add_argument('--trace', metavar='FILE',
+        help='record every command sent to the browser and every call of the website wrapper, with how long each took, '
+        'write them to FILE, and print the time and round trips to the browser of each phase of the scrape')
+    parser.add_argument('--trace-format', choices=['json', 'chrome'], default='json',
+        help='write the trace as JSON, or in the Chrome trace format for chrome://tracing, Perfetto, speedscope (default: json)')
+    return parser
+
+
 def main():
-    args = sys.argv[1:]
-    if len(args) == 2:
-        module, directory = args
-        directory = os.path.abspath(directory)
+    opts = cli_parser().parse_args()
+    module = opts.module
+    if opts.directory is not None:
+        directory = os.path.abspath(opts.directory)
         if not os.path.isdir(directory):
             os.makedirs(directory, exist_ok=True)
         paths['save_dir'] = directory
-    elif len(args) == 1:
-        module = args
-    else:
-        raise NotEnoughArgumentsError("Need a required 'module' argument and an optional 'directory' argument")
+    papers = catalog.Catalog(opts.catalog or os.path.join(paths['save_dir'], '.papers.db'))
+    direct = None
+    if not opts.browser:
+        direct = downloader.Downloader(paths['save_dir'], concurrency=opts.concurrency, retries=opts.retries)
+
+    tracer = webtrace.Tracer() if opts.trace else None
+    pool = BrowserPool(opts.browsers, tracer=tracer) if opts.browsers else None
 
     print('Setting up...')
-    scraper = DCU_Webscraper(browser=DCU_Website(firefox_profile=DCU_Website.dcu_autosave_profile(), executable_path=paths['driver']), module=module)
+    make_browser = lambda: DCU_Website(firefox_profile=DCU_Website.dcu_autosave_profile(), executable_path=paths['driver'])
+    scraper = DCU_Webscraper(module=module, papers=papers, downloader=direct, harvest=not opts.per_row, pool=pool,
+        make_browser=make_browser, listing_ttl=opts.listing_ttl * 3600, tracer=tracer)
     print('Scraping...')
-    scraper.scrape_all()
-    print('Done')
-    scraper.browser.quit()
+    try:
+        scraper.download(scraper.list_papers(refresh=opts.refresh))
+        print('Done')
+    finally:
+        # the trace of a failed scrape is the one most worth looking at
+        scraper.close()
+        if tracer is not None:
+            tracer.report()
+            tracer.save(opts.trace, opts.trace_format)
+        if direct is not None:
+            direct.close()
+        papers.close()
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
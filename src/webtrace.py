@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+
+"""Traces of a scraping run: every WebDriver command sent to the browser (each is a round trip to it), every 'dcu_*' method
+of 'webscraper.DCU_Website' called, and the phases of the scrape (setting up, filtering, going through the pages, ...),
+each with when it started and how long it took. Added up by phase in 'totals', and written out as JSON, or in the
+Chrome trace format to be looked at as a flame graph (in chrome://tracing, Perfetto or speedscope)"""
+
+
+import sys
+import os
+import time
+import json
+import threading
+import contextlib
+import collections
+
+
+# names of the phases of a scrape, in order (see 'webscraper.DCU_Webscraper')
+PHASES = ('setup', 'filter', 'pagination', 'harvest', 'download')
+
+
+class Tracer():
+    """Records spans of time: 'command's (WebDriver commands), 'call's (of 'dcu_*' methods) and 'phase's.
+    Spans started while another is going on in the same thread are inside it, and each span counts the commands inside it.
+    Spans are put down to the phase going on when they started, whichever thread they are in"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.events = [] # the spans that have ended, as dicts
+        self.lock = threading.Lock()
+        self.local = threading.local() # 'stack' of the spans going on in each thread
+        self.current_phase = None
+
+    @contextlib.contextmanager
+    def span(self, name, category, args=None):
+        """Record what is done in the with block as a span 'name' of 'category' ('command', 'call' or 'phase')"""
+        stack = self.local.__dict__.setdefault('stack', [])
+        event = {
+            'name': name,
+            'category': category,
+            'phase': self.current_phase,
+            'thread': threading.get_ident(),
+            'depth': len(stack),
+            'start': time.perf_counter() - self.started,
+            'seconds': None,
+            'round_trips': 1 if category == 'command' else 0,
+            'error': None,
+            'args': args or {},
+        }
+        if category == 'command':
+            for outer in stack:
+                outer['round_trips'] += 1
+        stack.append(event)
+        try:
+            yield event
+        except Exception as exc:
+            event['error'] = type(exc).__name__
+            raise
+        finally:
+            stack.pop()
+            event['seconds'] = time.perf_counter() - self.started - event['start']
+            with self.lock:
+                self.events.append(event)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """Record what is done in the with block as the phase 'name', eg: with tracer.phase('setup'): ..."""
+        previous = self.current_phase
+        self.current_phase = name
+        try:
+            with self.span(name, 'phase'):
+                yield
+        finally:
+            self.current_phase = previous
+
+    def totals(self):
+        """Per phase ('other' for what was done outside of any), the seconds spent in it, the round trips to the browser,
+        and the count, seconds and round trips of each command and call"""
+        totals = collections.OrderedDict((name, None) for name in PHASES)
+        with self.lock:
+            events = list(self.events)
+        for event in events:
+            phase = event['phase'] or (event['name'] if event['category'] == 'phase' else 'other')
+            if totals.get(phase) is None:
+                totals[phase] = {'seconds': 0, 'round_trips': 0, 'commands': {}, 'calls': {}}
+            total = totals[phase]
+            if event['category'] == 'phase':
+                total['seconds'] += event['seconds']
+                continue
+            if event['category'] == 'command':
+                total['round_trips'] += 1
+            kind = total['commands' if event['category'] == 'command' else 'calls']
+            counts = kind.setdefault(event['name'], {'count': 0, 'seconds': 0, 'round_trips': 0})
+            counts['count'] += 1
+            counts['seconds'] += event['seconds']
+            counts['round_trips'] += event['round_trips']
+        return collections.OrderedDict((phase, total) for (phase, total) in totals.items() if total is not None)
+
+    def to_json(self):
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event['start'])
+        return {'phases': self.totals(), 'events': events}
+
+    def to_chrome_trace(self):
+        """The spans as complete ('X') events of the Chrome trace event format, times in microseconds"""
+        with self.lock:
+            events = sorted(self.events, key=lambda event: event['start'])
+        pid = os.getpid()
+        trace_events = [{
+            'name': event['name'],
+            'cat': event['category'],
+            'ph': 'X',
+            'ts': event['start'] * 1e6,
+            'dur': event['seconds'] * 1e6,
+            'pid': pid,
+            'tid': event['thread'],
+            'args': dict(event['args'], phase=event['phase'], round_trips=event['round_trips'], error=event['error']),
+        } for event in events]
+        return {'traceEvents': trace_events, 'displayTimeUnit': 'ms'}
+
+    def save(self, path, format='json'):
+        """Write the trace to 'path' as 'json' (see 'to_json') or 'chrome' (see 'to_chrome_trace')"""
+        trace = self.to_chrome_trace() if format == 'chrome' else self.to_json()
+        with open(path, 'w') as f:
+            json.dump(trace, f, indent=None if format == 'chrome' else 2)
+
+    def report(self, out=sys.stdout):
+        """Print the time and round trips of each phase, and the commands that took the longest overall"""
+        for (phase, total) in self.totals().items():
+            print('{:>10} {:8.3f}s {:6} round trips'.format(phase, total['seconds'], total['round_trips']), file=out)
+            slowest = sorted(total['commands'].items(), key=lambda item: item[1]['seconds'], reverse=True)[:3]
+            for (name, counts) in slowest:
+                print('{:>10}   {} x{} {:.3f}s'.format('', name, counts['count'], counts['seconds']), file=out)
+
+
+def command_args(params):
+    """What of the 'params' of a WebDriver command is worth keeping in its span: the short values (eg: URL's, selectors)"""
+    return {key: value for (key, value) in (params or {}).items()
+        if key != 'sessionId' and isinstance(value, (str, int, float)) and len(str(value)) <= 200}
@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""Tests for downloading papers over HTTP, against a local stand-in for Google Drive, and for tracking downloads"""
+
+
+import unittest
+import sys
+import os
+import os.path
+import tempfile
+import shutil
+import time
+import threading
+
+sys.path.append('../src')
+import downloader
+import downloadwatch
+import standin
+
+
+PAPER = b'%PDF-1.4\n% a paper\n%%EOF\n'
+
+
+class TestDownloader(unittest.TestCase):
+
+    def setUp(self):
+        # the stand-in Drive's files: 'flaky' ones fail the first time, 'big' ones ask for the download to be confirmed,
+        # 'cut' ones are cut off halfway, 'gz' ones come gzipped, and the 'same' ones are all named 2019.pdf
+        self.drive = tempfile.mkdtemp()
+        files = {}
+        for file_id in ['ok1', 'ok2', 'flaky1', 'flaky2', 'big1', 'cut1', 'gz1', 'same1', 'same2', 'same3']:
+            directory = os.path.join(self.drive, file_id)
+            os.makedirs(directory)
+            files[file_id] = os.path.join(directory, '2019.pdf' if file_id.startswith('same') else '{}.pdf'.format(file_id))
+            with open(files[file_id], 'wb') as f:
+                f.write(PAPER)
+        self.server = standin.StandinServer([], files=files, flaky=['flaky1', 'flaky2'], confirm=['big1'],
+            truncated=['cut1'], gzipped=['gz1']).start()
+        self.url = self.server.url(standin.DOWNLOAD_PATH)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+        shutil.rmtree(self.drive)
+
+    def test_url(self):
+        direct = downloader.Downloader(self.directory)
+        self.assertEqual(direct.url('https://drive.google.com/file/d/1AbC-x_9/view?usp=sharing'), downloader.DRIVE_URL.format('1AbC-x_9'))
+        self.assertIsNone(direct.url('https://www.dcu.ie/registry/past-exam-papers.shtml'))
+
+    def test_run(self):
+        links = ['https://drive.google.com/file/d/{}/view'.format(file_id) for file_id in ['ok1', 'ok2', 'flaky1', 'big1', 'gone1']]
+        direct = downloader.Downloader(self.directory, concurrency=3, retries=2, backoff=0.01, url_template=self.url, loud=False)
+        downloads = direct.run(links)
+        direct.close()
+        self.assertEqual([download.link for download in downloads], links) # in order
+        self.assertEqual([download.status for download in downloads], ['ok', 'ok', 'ok', 'ok', 'failed'])
+        self.assertEqual(downloads[2].attempts, 2) # retried after the 503
+        self.assertEqual(downloads[4].attempts, 1) # not found is not retried
+        self.assertEqual(sorted(os.listdir(self.directory)), ['big1.pdf', 'flaky1.pdf', 'ok1.pdf', 'ok2.pdf']) # no .part files left
+        for download in downloads[:4]:
+            with open(download.path, 'rb') as f:
+                self.assertEqual(f.read(), PAPER)
+
+    def test_retries_run_out(self):
+        direct = downloader.Downloader(self.directory, retries=0, backoff=0.01, url_template=self.url, loud=False)
+        (download,) = direct.run(['https://drive.google.com/file/d/flaky2/view'])
+        direct.close()
+        self.assertEqual((download.status, download.error), ('failed', 'HTTP 503'))
+
+    def test_cut_off(self):
+        direct = downloader.Downloader(self.directory, retries=1, backoff=0.01, url_template=self.url, loud=False)
+        (download,) = direct.run(['https://drive.google.com/file/d/cut1/view'])
+        direct.close()
+        self.assertEqual((download.status, download.attempts), ('failed', 2))
+        self.assertEqual(os.listdir(self.directory), []) # no .part file left behind
+        self.assertEqual(self.server.downloads['cut1'], 2)
+
+    def test_gzipped(self):
+        direct = downloader.Downloader(self.directory, retries=0, url_template=self.url, loud=False)
+        (download,) = direct.run(['https://drive.google.com/file/d/gz1/view'])
+        direct.close()
+        self.assertEqual((download.status, download.bytes), ('ok', len(PAPER))) # not taken for cut short
+        with open(download.path, 'rb') as f:
+            self.assertEqual(f.read(), PAPER)
+
+    def test_same_filename(self):
+        with open(os.path.join(self.directory, '2019.pdf'), 'wb') as f:
+            f.write(b'not to be overwritten')
+        links = ['https://drive.google.com/file/d/{}/view'.format(file_id) for file_id in ['same1', 'same2', 'same3']]
+        direct = downloader.Downloader(self.directory, concurrency=3, url_template=self.url, loud=False)
+        downloads = direct.run(links)
+        direct.close()
+        self.assertEqual([download.status for download in downloads], ['ok', 'ok', 'ok'])
+        self.assertEqual([os.path.basename(download.path) for download in downloads], ['2019-same1.pdf', '2019-same2.pdf', '2019-same3.pdf'])
+        with open(os.path.join(self.directory, '2019.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'not to be overwritten')
+        # once the name with the file id is taken too, a number is added
+        self.assertEqual(downloader.unique_path(self.directory, '2019.pdf', 'same1', set()), os.path.join(self.directory, '2019-same1-1.pdf'))
+        self.assertEqual(downloader.unique_path(self.directory, '2019.pdf', 'same1', {os.path.join(self.directory, '2019-same1-1.pdf')}),
+            os.path.join(self.directory, '2019-same1-2.pdf'))
+
+    def test_unexpected_error(self):
+        class BrokenDownloader(downloader.Downloader):
+            def fetch(self, link):
+                if 'ok1' in link:
+                    raise OSError('No space left on device')
+                return super().fetch(link)
+        links = ['https://drive.google.com/file/d/{}/view'.format(file_id) for file_id in ['ok1', 'ok2']]
+        direct = BrokenDownloader(self.directory, url_template=self.url, loud=False)
+        downloads = direct.run(links)
+        direct.close()
+        self.assertEqual([download.status for download in downloads], ['failed', 'ok']) # the others still downloaded
+        self.assertEqual(downloads[0].error, 'OSError: No space left on device')
+
+
+class TestDownloadTracker(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        with open(os.path.join(self.directory, 'old.pdf'), 'wb') as f:
+            f.write(PAPER)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def browser_download(self, name, seconds):
+        """Download like Firefox: an empty file and a .part file, the .part file renamed over the empty one once done"""
+        path = os.path.join(self.directory, name)
+        open(path, 'wb').close()
+        with open(path + '.part', 'wb') as f:
+            f.write(PAPER)
+        def finish():
+            time.sleep(seconds)
+            os.replace(path + '.part', path)
+        thread = threading.Thread(target=finish)
+        thread.start()
+        return thread
+
+    def track(self, poll_interval=None):
+        tracker = downloadwatch.DownloadTracker(self.directory)
+        if poll_interval is not None:
+            tracker.watcher.close()
+            tracker.watcher = downloadwatch.Poller(poll_interval)
+        with tracker:
+            threads = [self.browser_download('a.pdf', 0.05)]
+            tracker.started('url-a', timeout=1)
+            threads.append(self.browser_download('b.pdf', 0.1))
+            tracker.started('url-b', timeout=1)
+            tracker.started('url-c', timeout=0.05) # never started
+            threads.append(self.browser_download('c.pdf', 0.2)) # too late to be put down to url-c
+            start = time.monotonic()
+            completion = tracker.wait(timeout=1)
+            self.assertLess(time.monotonic() - start, 1.5)
+        for thread in threads:
+            thread.join()
+        return completion
+
+    def test_wait(self):
+        completion = self.track()
+        self.assertEqual(dict(completion.done), {
+            'url-a': os.path.join(self.directory, 'a.pdf'),
+            'url-b': os.path.join(self.directory, 'b.pdf'),
+        })
+        self.assertEqual(completion.timed_out, ['url-c'])
+
+    def test_wait_polling(self):
+        completion = self.track(poll_interval=0.02)
+        self.assertEqual(list(completion.done), ['url-a', 'url-b'])
+
+    def test_inotify(self):
+        if not sys.platform.startswith('linux'):
+            self.skipTest('inotify is Linux only')
+        watcher = downloadwatch.watcher(self.directory)
+        self.assertIsInstance(watcher, downloadwatch.Inotify)
+        self.assertFalse(watcher.wait(0.01))
+        open(os.path.join(self.directory, 'new.pdf'), 'wb').close()
+        self.assertTrue(watcher.wait(1))
+        watcher.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
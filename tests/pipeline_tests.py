@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+"""Tests for slicing papers as they download, against a local stand-in for Google Drive serving generated papers"""
+
+
+import unittest
+import sys
+import os
+import os.path
+import tempfile
+import shutil
+
+sys.path.append('../src')
+import pipeline
+import slicer
+import catalog
+import corpus
+import downloader
+import webscraper
+import standin
+
+import PyPDF2 as pypdf
+
+
+def page_count(path):
+    with open(path, 'rb') as f:
+        return pypdf.PdfFileReader(f).getNumPages()
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.sources = corpus.generate(os.path.join(self.directory, 'drive'), files=5, pages=[4, 3, 4, 1, 2], lines=3)
+        self.server = standin.StandinServer([], files=standin.drive_files(os.path.join(self.directory, 'drive'))).start()
+        self.url = self.server.url(standin.DOWNLOAD_PATH)
+        # listed in no particular order, the slices come out most recent first all the same
+        names = [os.path.splitext(os.path.basename(path))[0] for path in self.sources]
+        self.links = ['https://drive.google.com/file/d/{}/view'.format(name) for name in sorted(names)]
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def scrape_slice(self, papers, workers, queue_size=8):
+        papers_dir = os.path.join(self.directory, 'papers')
+        direct = downloader.Downloader(papers_dir, concurrency=3, url_template=self.url, loud=False)
+        scraper = webscraper.DCU_Webscraper(module='ca117', papers=papers, downloader=direct, make_browser=None)
+        slices = [(slicer.page_repr('1'), os.path.join(self.directory, 'out', 'q2.pdf')),
+                  (slicer.page_repr('0:2'), os.path.join(self.directory, 'out', 'q1-2.pdf'))]
+        paths = pipeline.scrape_slice(scraper, self.links, slices, workers=workers, queue_size=queue_size, loud=False)
+        direct.close()
+        return (papers_dir, paths)
+
+    def expected_pages(self, pages):
+        return sum(len(range(*slicer.page_repr(pages).indices(page_count(path)))) for path in self.sources)
+
+    def test_scrape_slice(self):
+        with catalog.Catalog() as papers:
+            (papers_dir, paths) = self.scrape_slice(papers, workers=1, queue_size=1)
+            self.assertEqual(sorted(os.listdir(papers_dir)), sorted(os.path.basename(path) for path in self.sources))
+            self.assertEqual(paths, [[os.path.join(self.directory, 'out', 'q2.pdf')], [os.path.join(self.directory, 'out', 'q1-2.pdf')]])
+            self.assertEqual(page_count(paths[0][0]), self.expected_pages('1'))
+            self.assertEqual(page_count(paths[1][0]), self.expected_pages('0:2'))
+            # the same pages as slicing the papers once they are all there
+            merger = slicer.merge(slicer.sort_cyear(self.sources), slicer.page_repr('1'), loud=False)
+            with open(paths[0][0], 'rb') as f:
+                texts = [page.extractText() for page in pypdf.PdfFileReader(f).pages]
+            self.assertEqual(texts, [page.pagedata.extractText() for page in merger.pages])
+            merger.close()
+
+    def test_downloaded_already(self):
+        with catalog.Catalog() as papers:
+            self.scrape_slice(papers, workers=1)
+            self.server.files = {} # nothing left to download
+            (papers_dir, paths) = self.scrape_slice(papers, workers=2)
+            self.assertEqual(page_count(paths[0][0]), self.expected_pages('1'))
+
+    def test_slice_stage(self):
+        stage = pipeline.SliceStage([slicer.page_repr('1'), slicer.page_repr('0:2')], workers=1, queue_size=1)
+        for path in self.sources:
+            stage.put(path)
+        results = stage.finish()
+        self.assertEqual(list(results), self.sources)
+        # the slices are in files, not kept in memory, until the stage is closed
+        sliced = sum([paths for (paths, exc, entry, seconds) in results.values()], [])
+        self.assertEqual(len(sliced), 2 * len(self.sources))
+        self.assertTrue(all(os.path.isfile(path) for path in sliced))
+        stage.close()
+        self.assertFalse(os.path.exists(stage.directory))
+
+    def test_slicing_fails(self):
+        # the slicing thread dying with papers still to come, the pipeline fails with its error instead of waiting forever
+        def extract_slices(pdf, slices):
+            raise MemoryError('out of memory')
+        extract = slicer.extract_slices
+        slicer.extract_slices = extract_slices
+        try:
+            with catalog.Catalog() as papers:
+                with self.assertRaises(MemoryError):
+                    self.scrape_slice(papers, workers=1, queue_size=1)
+            stage = pipeline.SliceStage([slicer.page_repr('1')], workers=1, queue_size=1)
+            with self.assertRaises(MemoryError):
+                for path in self.sources:
+                    stage.put(path)
+            with self.assertRaises(MemoryError):
+                stage.finish()
+            stage.close()
+        finally:
+            slicer.extract_slices = extract
+
+    def test_order_papers(self):
+        self.assertEqual(pipeline.order_papers(['17_a.pdf', '19_b.pdf', '18_c.pdf']), ['19_b.pdf', '18_c.pdf', '17_a.pdf'])
+        # without years, the same order whichever downloaded first
+        self.assertEqual(pipeline.order_papers(['ca117b.pdf', 'ca117a.pdf']), ['ca117a.pdf', 'ca117b.pdf'])
+
+
+if __name__ == '__main__':
+    unittest.main()
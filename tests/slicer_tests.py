@@ -7,10 +7,26 @@ import unittest
 import sys
 import os
 import os.path
+import io
+import json
 import datetime
+import tempfile
+import shutil
+import threading
+import contextlib
+import urllib.request
 
 sys.path.append('../src')
 import slicer
+import pdfindex
+import pdfmap
+import triage
+import textindex
+import instrumentation
+import batch
+import slicerd
+import catalog
+import corpus
 
 from _io import BufferedReader
 import PyPDF2 as pypdf
@@ -21,6 +37,24 @@ tests_data = {
     'input': '../../tests_data/input',
     'output': '../../tests_data/output',
 }
+generated_data = None
+
+
+def setUpModule():
+    # without any test data at the paths above, test with generated papers instead (see 'corpus')
+    global generated_data
+    if not os.path.isdir(tests_data['input']):
+        generated_data = tempfile.mkdtemp()
+        tests_data['input'] = os.path.join(generated_data, 'input')
+        tests_data['output'] = os.path.join(generated_data, 'output')
+        # 5 papers with at least 4 pages, 2 with less, like the specific test data
+        corpus.generate(tests_data['input'], files=7, pages=[5, 5, 5, 5, 5, 3, 2], lines=5)
+        os.makedirs(tests_data['output'])
+
+
+def tearDownModule():
+    if generated_data is not None:
+        shutil.rmtree(generated_data)
 
 
 class TestPageSlicer(unittest.TestCase):
@@ -44,6 +78,29 @@ class TestPageSlicer(unittest.TestCase):
         # tear-down
         [f.close() for f in pdfsin]
 
+    def test_map_paths(self):
+        # set-up
+        paths = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pool = pdfmap.MapPool(max_open=2)
+        pdfsin = slicer.map_paths(paths, pool)
+        pg = pypdf.PageRange('1')
+        # test
+        self.assertEqual([pdf.name for pdf in pdfsin], paths) # one per path, in order
+        self.assertEqual(len(pool.mapped), 0) # nothing opened until read from
+        merger = slicer.merge(pdfsin, pg, loud=False)
+        self.assertLessEqual(len(pool.mapped), 2) # capped
+        outs = [io.BytesIO(), io.BytesIO()]
+        merger.write(outs[0]) # reading from unmapped files maps them again
+        expected = slicer.merge(paths, pg, loud=False)
+        expected.write(outs[1])
+        self.assertEqual(outs[0].getvalue(), outs[1].getvalue()) # same as from paths
+        # tear-down
+        merger.close()
+        expected.close()
+        pool.close()
+        self.assertEqual(len(pool.mapped), 0)
+        self.assertTrue(all(pdf.map is None for pdf in pdfsin))
+
     def test_page_repr(self):
         self.assertIsInstance(slicer.page_repr('1'), pypdf.PageRange) # correct return typr
         self.assertEqual(slicer.page_repr('1:-2:2').indices(10), (1, 8, 2)) # underlying PageObject works
@@ -63,6 +120,23 @@ class TestPageSlicer(unittest.TestCase):
         [f.close() for f in pdfsin]
         [merger.close() for merger in mergers]
 
+    def test_merge_parallel(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pg = pypdf.PageRange('1:4')
+        serial = slicer.merge(pdfsin, pg, loud=False)
+        parallel = slicer.merge_parallel(pdfsin, pg, workers=2, loud=False)
+        # test
+        self.assertIsInstance(parallel, pypdf.PdfFileMerger)
+        self.assertEqual(len(parallel.pages), len(serial.pages)) # same pages gotten
+        outs = [io.BytesIO(), io.BytesIO()]
+        serial.write(outs[0])
+        parallel.write(outs[1])
+        self.assertEqual(outs[0].getvalue(), outs[1].getvalue()) # same output as without workers
+        # tear-down
+        serial.close()
+        parallel.close()
+
     def test_save(self):
         # set-up (same as 'test_merge'???)
         pdfsin = [open(os.path.join(self.pathin, filename), 'rb') for filename in os.listdir(self.pathin)]
@@ -79,11 +153,364 @@ class TestPageSlicer(unittest.TestCase):
         [f.close() for f in pdfsin]
         merger.close()
 
+    def test_merge_stream(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pg = pypdf.PageRange('1:4')
+        merger = slicer.merge(pdfsin, pg, loud=False)
+        pages = [page.pagedata.extractText() for page in merger.pages]
+        path = os.path.join(self.pathout, 'test_merge_stream_{}.pdf'.format(datetime.datetime.now().strftime('%Y%m%d%H%M%S')))
+        # test
+        paths = slicer.merge_stream(pdfsin, pg, path, loud=False)
+        self.assertEqual(paths, [path]) # single output file
+        with open(path, 'rb') as f:
+            reader = pypdf.PdfFileReader(f)
+            self.assertEqual([page.extractText() for page in reader.pages], pages) # same pages as 'merge'
+        paths = slicer.merge_stream(pdfsin, pg, path, chunk_pages=4, loud=False)
+        self.assertEqual(paths, [slicer.pathname_append(path, '-'+str(i)) for i in range(len(paths))]) # numbered files
+        chunks = []
+        for chunk in paths:
+            with open(chunk, 'rb') as f:
+                chunks += [page.extractText() for page in pypdf.PdfFileReader(f).pages]
+        self.assertEqual(chunks, pages) # split up, but nothing lost
+        # tear-down
+        merger.close()
+
+    def test_merge_slices(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        slices = [(pypdf.PageRange(pg), os.path.join(self.pathout, 'test_merge_slices_{}_{}.pdf'.format(i, stamp))) for (i, pg) in enumerate(['0', '3', '20'])]
+        # test
+        paths = slicer.merge_slices(pdfsin, slices, loud=False)
+        self.assertEqual(paths, [[pathout] for (pg, pathout) in slices]) # a file per slice
+        for (pg, pathout) in slices:
+            merger = slicer.merge(pdfsin, pg, loud=False)
+            with open(pathout, 'rb') as f:
+                pages = [page.extractText() for page in pypdf.PdfFileReader(f).pages]
+            self.assertEqual(pages, [page.pagedata.extractText() for page in merger.pages]) # same as slicing one at a time
+            merger.close()
+
+    def test_merge_stream_dedup(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pg = pypdf.PageRange('0:2')
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        pathouts = [os.path.join(self.pathout, 'test_merge_stream_dedup_{}_{}.pdf'.format(compress, stamp)) for compress in (False, True)]
+        merger = slicer.merge(pdfsin, pg, loud=False)
+        merged = io.BytesIO()
+        merger.write(merged)
+        # test
+        for (compress, pathout) in zip((False, True), pathouts):
+            slicer.merge_stream(pdfsin, pg, pathout, loud=False, compress=compress)
+            with open(pathout, 'rb') as f:
+                data = f.read()
+            pages = [page.extractText() for page in pypdf.PdfFileReader(io.BytesIO(data)).pages]
+            self.assertEqual(pages, [page.pagedata.extractText() for page in merger.pages]) # same pages
+            self.assertLess(len(data), len(merged.getvalue()) / 2) # (based on specific test data) same fonts and images in every paper
+            if not compress:
+                self.assertLessEqual(data.count(b'/Subtype /Image'), 1) # the header image written once
+        self.assertLess(os.path.getsize(pathouts[1]), os.path.getsize(pathouts[0])) # smaller still
+        # tear-down
+        merger.close()
+
+    def test_merge_append(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pg = pypdf.PageRange('1:3')
+        pathout = os.path.join(self.pathout, 'test_merge_append_{}.pdf'.format(datetime.datetime.now().strftime('%Y%m%d%H%M%S')))
+        old = pdfsin[1::2] # as if every other paper was published later
+        # test
+        slicer.merge_stream(old, pg, pathout, loud=False, append=True)
+        size = os.path.getsize(pathout)
+        slicer.merge_stream(old, pg, pathout, loud=False, append=True)
+        self.assertEqual(os.path.getsize(pathout), size) # nothing new, left alone
+        slicer.merge_stream(pdfsin, pg, pathout, loud=False, append=True)
+        with open(pathout, 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(data[:size])) # earlier objects untouched, appended to
+        self.assertEqual(data.count(b'%%EOF'), 2) # as a single incremental update
+        merger = slicer.merge(pdfsin, pg, loud=False)
+        pages = [page.extractText() for page in pypdf.PdfFileReader(io.BytesIO(data)).pages]
+        self.assertEqual(pages, [page.pagedata.extractText() for page in merger.pages]) # same pages in the same order as from scratch
+        merger.close()
+        os.utime(pdfsin[0])
+        self.assertEqual(len(slicer.StreamOutput(pathout, append=True).resume(pdfsin, pg)), len(pdfsin)) # changed, start again
+
+    def test_merge_append_index(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pg = pypdf.PageRange('3')
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        pathout = os.path.join(self.pathout, 'test_merge_append_index_{}.pdf'.format(stamp))
+        index = pdfindex.PdfIndex(os.path.join(self.pathout, 'test_merge_append_index_{}.json'.format(stamp)))
+        slicer.merge_stream(slicer.filter_paths(pdfsin, [(pg, pathout)], index=index), pg, pathout, loud=False, append=True, index=index)
+        size = os.path.getsize(pathout)
+        # test
+        kept = slicer.filter_paths(pdfsin, [(pg, pathout)], index=index)
+        self.assertLess(len(kept), len(pdfsin)) # (based on specific test data) the papers without the page left out this time
+        self.assertEqual(slicer.StreamOutput(pathout, append=True).resume(kept, pg), set()) # not taken as gone
+        slicer.merge_stream(kept, pg, pathout, loud=False, append=True, index=index)
+        self.assertEqual(os.path.getsize(pathout), size) # nothing new, left alone
+
+    def test_index(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pg = pypdf.PageRange('3')
+        path = os.path.join(self.pathout, 'test_index_{}.json'.format(datetime.datetime.now().strftime('%Y%m%d%H%M%S')))
+        index = pdfindex.PdfIndex(path)
+        self.assertEqual(index.prefilter(pdfsin, pg), pdfsin) # nothing known yet, nothing skipped
+        merger = slicer.merge(pdfsin, pg, loud=False, index=index)
+        index.save()
+        # test
+        index = pdfindex.PdfIndex(path)
+        self.assertEqual(len(index), len(pdfsin)) # all recorded, and saved
+        kept = index.prefilter(pdfsin, pg)
+        self.assertEqual(len(kept), len(merger.pages)) # (based on specific test data) PDF's without the page skipped
+        for (pdf, page) in zip(kept, merger.pages):
+            with open(pdf, 'rb') as f:
+                reader = index.open(pdf, f)
+                self.assertIsInstance(reader, pdfindex.IndexedPdfFileReader) # not parsed again
+                self.assertEqual(reader.getPage(3).extractText(), page.pagedata.extractText()) # same page
+        # tear-down
+        merger.close()
+
+    def test_triage(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        directory = tempfile.mkdtemp()
+        with open(pdfsin[0], 'rb') as f:
+            data = f.read()
+        broken = {
+            'truncated.pdf': data[:len(data)//2],
+            'empty.pdf': b'',
+            'not_a_pdf.pdf': b'<html></html>',
+        }
+        for (filename, contents) in broken.items():
+            with open(os.path.join(directory, filename), 'wb') as f:
+                f.write(contents)
+        broken_paths = [os.path.join(directory, filename) for filename in broken]
+        path = os.path.join(directory, 'quarantine.json')
+        # test
+        for pdf in pdfsin:
+            verdict = triage.scan(pdf)
+            self.assertEqual(verdict.status, triage.OK)
+            with open(pdf, 'rb') as f:
+                self.assertEqual(verdict.page_count, pypdf.PdfFileReader(f).getNumPages()) # without parsing it all
+        for pdf in broken_paths:
+            self.assertEqual(triage.scan(pdf).status, triage.BROKEN)
+        quarantine = triage.Quarantine(path)
+        self.assertEqual(quarantine.triage(broken_paths + pdfsin, loud=False), pdfsin) # broken ones skipped
+        quarantine.save()
+        quarantine = triage.Quarantine(path)
+        self.assertEqual(quarantine.quarantined(), sorted(broken_paths)) # remembered
+        kept = quarantine.triage(pdfsin, pypdf.PageRange('3'), loud=False)
+        self.assertEqual(len(kept), len([pdf for pdf in pdfsin if quarantine.lookup(pdf).page_count > 3])) # too short skipped
+        # tear-down
+        shutil.rmtree(directory)
+
+    def test_text_index(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        path = os.path.join(self.pathout, 'test_text_index_{}.json'.format(stamp))
+        pathout = os.path.join(self.pathout, 'test_text_index_{}.pdf'.format(stamp))
+        index = textindex.TextIndex(path)
+        self.assertEqual(index.update(pdfsin, loud=False), len(pdfsin))
+        index.save()
+        with open(pdfsin[0], 'rb') as f:
+            text = textindex.page_text(pypdf.PdfFileReader(f).getPage(1))
+        query = ' '.join(textindex.words(text)[:3])
+        # test
+        index = textindex.TextIndex(path)
+        self.assertEqual(index.update(pdfsin, loud=False), 0) # nothing extracted again
+        selection = index.search(query)
+        self.assertIn(1, selection.pages(pdfsin[0]))
+        self.assertEqual(index.search(r'\s+'.join(query.split()), regex=True).matches, selection.matches) # same pages either way
+        self.assertEqual(len(index.search('no such words in any paper')), 0)
+        paths = slicer.merge_stream(pdfsin, selection, pathout, loud=False)
+        with open(paths[0], 'rb') as f:
+            self.assertEqual(pypdf.PdfFileReader(f).getNumPages(), len(selection)) # sliced at the pages found
+        merger = slicer.merge(pdfsin, selection, loud=False)
+        self.assertEqual(len(merger.pages), len(selection))
+        # tear-down
+        merger.close()
+
+    def test_metrics(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        pg = pypdf.PageRange('3')
+        stamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S')
+        jsonl = os.path.join(self.pathout, 'test_metrics_{}.jsonl'.format(stamp))
+        pathout = os.path.join(self.pathout, 'test_metrics_{}.pdf'.format(stamp))
+        records = []
+        metrics = instrumentation.Metrics(jsonl, callbacks=[records.append])
+        # test
+        merger = slicer.merge(pdfsin, pg, loud=False, metrics=metrics)
+        slicer.save(merger, pathout, loud=False, metrics=metrics)
+        summary = metrics.close()
+        files = [record for record in records if record['event'] == 'file']
+        self.assertEqual([record['path'] for record in files], pdfsin) # one per PDF, in order
+        self.assertEqual(sum(record['pages'] for record in files), len(merger.pages))
+        self.assertEqual(summary['pages'], len(merger.pages))
+        self.assertEqual(summary['bytes_written'], os.path.getsize(pathout))
+        self.assertEqual(summary['file_size'], sum(os.path.getsize(pdf) for pdf in pdfsin))
+        self.assertEqual(list(summary['phases']), ['merge', 'save'])
+        with open(jsonl, 'r') as f:
+            self.assertEqual([json.loads(line) for line in f], records) # the same as handed to the callbacks
+        metrics.file(os.path.join(self.pathout, 'gone.pdf'), 0, 0) # moved or deleted since, still recorded
+        self.assertIsNone(metrics.files[-1]['file_size'])
+        # tear-down
+        merger.close()
+
+    def test_batch(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        directory = tempfile.mkdtemp()
+        manifest = os.path.join(directory, 'jobs.txt')
+        with open(manifest, 'w') as f:
+            f.write('# input pages output\n')
+            f.write('{} 0 out/q1.pdf\n'.format(self.pathin))
+            f.write('"{}" 3 out/q4.pdf\n'.format(self.pathin))
+            f.write('{} not-a-page out/bad.pdf\n'.format(self.pathin))
+            f.write('{} 0 out/missing.pdf\n'.format(os.path.join(directory, 'missing')))
+        # test
+        jobs = batch.read_manifest(manifest)
+        self.assertEqual(len(batch.group_jobs(jobs)), 2) # the jobs on the same directory run together
+        reports = batch.run(jobs, workers=2, loud=False)
+        self.assertEqual([report['status'] for report in reports], ['ok', 'ok', 'failed', 'failed'])
+        for (report, pg) in zip(reports, ['0', '3']):
+            self.assertEqual(report['paths'], [os.path.join(directory, report['output'])])
+            merger = slicer.merge(pdfsin, pypdf.PageRange(pg), loud=False)
+            self.assertEqual(report['pages_out'], len(merger.pages)) # same as slicing on its own
+            merger.close()
+        # the PDF's and skipped ones are counted for each job's slice
+        pathin = os.path.join(directory, 'broken')
+        os.makedirs(pathin)
+        for pdf in pdfsin:
+            shutil.copy(pdf, pathin)
+        with open(os.path.join(pathin, '99_broken.pdf'), 'wb') as f:
+            f.write(b'<html></html>')
+        jobs = [batch.Job(pathin, '0', os.path.join(directory, 'q1.pdf')), batch.Job(pathin, '3', os.path.join(directory, 'q4.pdf'))]
+        index = pdfindex.PdfIndex(os.path.join(directory, 'index.json'))
+        reports = batch.run(jobs, workers=1, index=index, loud=False)
+        self.assertEqual([report['skipped'] for report in reports], [1, 1]) # too broken to know it is too short
+        long_enough = [pdf for pdf in pdfsin if index.lookup(os.path.join(pathin, os.path.basename(pdf)))['page_count'] > 3]
+        self.assertEqual([report['pdfs'] for report in reports], [len(pdfsin) + 1, len(long_enough) + 1])
+        # tear-down
+        shutil.rmtree(directory)
+
+    def test_slicerd(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        merger = slicer.merge(pdfsin, pypdf.PageRange('0'), loud=False)
+        expected = len(merger.pages)
+        merger.close()
+        root = os.path.dirname(os.path.realpath(self.pathin))
+        state = slicerd.SlicerState(max_concurrent=2, loud=False, root=root)
+        server = slicerd.make_server(state, port=0)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        url = 'http://127.0.0.1:{}'.format(server.server_address[1])
+        def post(body, content_type='application/json'):
+            request = urllib.request.Request(url + '/slice', json.dumps(body).encode(), {'Content-Type': content_type})
+            return urllib.request.urlopen(request)
+        # test
+        for i in range(2):
+            with post({'input': self.pathin, 'pages': '0'}) as response:
+                self.assertEqual(response.headers['Content-Type'], 'application/pdf')
+                reader = pypdf.PdfFileReader(io.BytesIO(response.read()))
+                self.assertEqual(reader.getNumPages(), expected)
+        with urllib.request.urlopen(url + '/stats') as response:
+            stats = json.load(response)
+        self.assertEqual(stats['requests']['sliced'], 2)
+        self.assertGreaterEqual(stats['cache']['hits'], len(pdfsin)) # the second request was answered from the cache
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            post({'input': self.pathin})
+        self.assertEqual(cm.exception.code, 400)
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            post({'input': self.pathin, 'pages': 're:('}) # not a regular expression
+        self.assertEqual(cm.exception.code, 400)
+        directory = tempfile.mkdtemp()
+        # what a web page can post without asking first is turned away, and nothing is written
+        pathout = os.path.join(self.pathout, 'test_slicerd.pdf')
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            post({'input': self.pathin, 'pages': '0', 'output': pathout}, 'text/plain')
+        self.assertEqual(cm.exception.code, 415)
+        self.assertFalse(os.path.exists(pathout))
+        # so are paths outside the root
+        for body in [{'input': self.pathin, 'pages': '0', 'output': os.path.join(directory, 'out.pdf')},
+                {'input': os.path.join(self.pathin, '..', '..'), 'pages': '0'}]:
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                post(body)
+            self.assertEqual(cm.exception.code, 403)
+        self.assertEqual(os.listdir(directory), [])
+        with post({'input': os.path.basename(self.pathin), 'pages': '0', 'output': pathout}) as response:
+            self.assertEqual(json.load(response)['pages'], expected) # relative to the root
+        state.text = object() # unexpected failures are answered too
+        with self.assertRaises(urllib.error.HTTPError) as cm:
+            post({'input': self.pathin, 'pages': 're:question'})
+        self.assertEqual(cm.exception.code, 500)
+        self.assertIn('AttributeError', json.load(cm.exception)['error'])
+        # the least recently used readers go once the cache is full
+        cache = slicerd.ReaderCache(max_bytes=1)
+        for path in pdfsin[:3]:
+            cache.get(path)
+        self.assertEqual(len(cache), 1)
+        self.assertGreater(cache.stats()['bytes'], os.path.getsize(pdfsin[2])) # charged for more than the file once parsed
+        # PDF's that failed to parse take up room too
+        cache = slicerd.ReaderCache(max_bytes=2*slicerd.ENTRY_BYTES)
+        for i in range(3):
+            path = os.path.join(directory, '{}.pdf'.format(i))
+            with open(path, 'wb') as f:
+                f.write(b'<html></html>')
+            with self.assertRaises(Exception):
+                cache.get(path)
+        self.assertEqual(len(cache), 2)
+        # tear-down
+        server.shutdown()
+        server.server_close()
+        shutil.rmtree(directory)
+
+    def test_catalog(self):
+        # set-up
+        pdfsin = slicer.sort_cyear(slicer.load_paths(self.pathin, loud=False))
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, 'papers.db')
+        # test
+        with catalog.Catalog(path) as papers:
+            self.assertEqual(papers.add_directory(self.pathin, 'ca117', loud=False), len(pdfsin))
+            self.assertEqual(papers.add_directory(self.pathin, 'ca117', loud=False), 0) # already there
+            self.assertEqual(papers.paths('CA117'), pdfsin) # newest first, like 'sort_cyear'
+            years = [catalog.filename_year(pdf) for pdf in pdfsin]
+            (first, last) = (min(years), max(years))
+            self.assertEqual(papers.paths('ca117', (first + 1, None)), [pdf for (pdf, year) in zip(pdfsin, years) if year > first])
+            self.assertEqual(papers.paths('ca117', (None, last - 1)), [pdf for (pdf, year) in zip(pdfsin, years) if year < last])
+            self.assertEqual(papers.paths('ca116'), [])
+            # a listed paper, then downloaded
+            link = 'https://drive.google.com/file/d/1AbC-x_9/view'
+            papers.add_listing('ca117', '2003', link)
+            self.assertEqual(papers.paths(years=(2003, 2003)), [])
+            papers.add_file(pdfsin[0], link=link)
+            (row,) = papers.query(years=(2003, 2003))
+            self.assertEqual((row['path'], row['file_id'], row['module']), (pdfsin[0], '1AbC-x_9', 'CA117'))
+            self.assertEqual(len(papers), len(pdfsin))
+        pathout = os.path.join(directory, 'out.pdf')
+        slicer.cli_engine([self.pathin, '0', pathout, '--catalog', path, '--module', 'ca117', '--min-pages', '1'])
+        with catalog.Catalog(path) as papers:
+            pages = sum(1 for row in papers.query('ca117', min_pages=1))
+        with open(pathout, 'rb') as f:
+            self.assertEqual(pypdf.PdfFileReader(f).getNumPages(), pages)
+        # tear-down
+        shutil.rmtree(directory)
+
     def test_cli_engine(self):
         pgs = pypdf.PageRange('1')
         pathout = os.path.join(self.pathout, 'test_cli_engine_{}.pdf'.format(datetime.datetime.now().strftime('%Y%m%d%H%M%S')))
         result = slicer.cli_engine([self.pathin, pgs, pathout])
         self.assertIsInstance(result, type(None))
+        with contextlib.redirect_stderr(io.StringIO()) as err, self.assertRaises(SystemExit):
+            slicer.cli_engine([self.pathin, 're:question (', pathout]) # a usage error, not a traceback
+        self.assertIn('invalid regular expression', err.getvalue())
 
     def test_watermark(self):
         pass
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+
+"""Tests for the exam papers web scraper, on saved pages and with stand-in browsers (no browser needed)"""
+
+
+import unittest
+import sys
+import os
+import os.path
+import tempfile
+import shutil
+import time
+import json
+import threading
+import collections
+import gzip
+import http.client
+import urllib.request
+
+sys.path.append('../src')
+import webscraper
+import catalog
+import downloader
+import standin
+import webtrace
+
+from selenium.common.exceptions import WebDriverException, TimeoutException
+from selenium.webdriver.remote.errorhandler import ErrorHandler
+
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+def fixture(name):
+    with open(os.path.join(fixtures, name), 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+class TestPaperTableParser(unittest.TestCase):
+
+    def test_parse_papers(self):
+        papers = webscraper.parse_papers(fixture('past-exam-papers.html'), 'https://www.dcu.ie/registry/past-exam-papers.shtml')
+        self.assertEqual(papers, [
+            ('CA117', '2018', 'https://drive.google.com/file/d/1xQ7mB-Ca117_2018/view?usp=sharing'),
+            ('CA117', '2017', 'https://drive.google.com/file/d/1Pz0k_Ca117_2017/view'),
+            # the table inside a cell is left out, and the relative link is made absolute
+            ('CA117 (Resit)', '2016/2017', 'https://www.dcu.ie/registry/papers/ca117-2016-resit.pdf'),
+        ])
+
+    def test_parse_no_papers(self):
+        self.assertEqual(webscraper.parse_papers(fixture('past-exam-papers-empty.html')), [])
+        self.assertEqual(webscraper.parse_papers('<html><body><p>Service unavailable</p></body></html>'), [])
+
+    def test_parse_table_only(self):
+        # the table's HTML on its own, as 'dcu_harvest_papers' gets it, parses the same as the whole page
+        page = fixture('past-exam-papers.html')
+        table = page[page.index('<table id="mySelection"'):page.index('<div class="dataTables_info"')]
+        self.assertEqual(webscraper.parse_papers(table), webscraper.parse_papers(page))
+
+
+class FakeBrowser():
+    """Stands in for a 'DCU_Website', downloading like Firefox does into 'directory'. Crashes on the papers in 'crash' once,
+    and the 'same' papers are all named 2019.pdf"""
+
+    def __init__(self, directory, crash, log):
+        self.directory = directory
+        self.crash = crash
+        self.log = log
+        self.url = None
+        self.log['made'] += 1
+
+    def dcu_mainpage(self):
+        self.log['setup'] += 1
+
+    def dcu_wait_for_data(self, css_selector):
+        pass
+
+    def dcu_deactivate_popup(self):
+        pass
+
+    def dcu_dlpage(self, url):
+        if url in self.crash:
+            self.crash.discard(url)
+            raise WebDriverException('Failed to decode response from marionette')
+        self.url = url
+
+    def dcu_download(self):
+        name = '{}.pdf'.format(self.url.rsplit('/', 1)[1])
+        if name.startswith('same'):
+            name = '2019.pdf'
+        if name.startswith('slow'):
+            return # never starts
+        path = os.path.join(self.directory, name)
+        with open(path + '.part', 'wb') as f:
+            f.write(b'%PDF-1.4\n%EOF\n')
+        threading.Timer(0.02, os.replace, (path + '.part', path)).start()
+
+    def quit(self):
+        self.log['quit'] += 1
+
+
+class TestBrowserPool(unittest.TestCase):
+
+    def test_run(self):
+        directory = tempfile.mkdtemp()
+        log = collections.Counter()
+        crash = set(['https://drive.google.com/file/d/p3'])
+        make_browser = lambda browser_directory: FakeBrowser(browser_directory, crash, log)
+        links = ['https://drive.google.com/file/d/{}'.format(name) for name in ['p1', 'p2', 'p3', 'p4', 'p5', 'slow1']]
+        pool = webscraper.BrowserPool(3, directory, make_browser, start_time=0.2, loud=False)
+        downloads = pool.run(links)
+        self.assertEqual([download.link for download in downloads], links)
+        self.assertEqual([download.status for download in downloads], ['ok'] * 5 + ['failed'])
+        self.assertEqual(downloads[2].attempts, 2) # the browser crashed, a new one downloaded it
+        self.assertEqual(sorted(os.listdir(directory)), ['p{}.pdf'.format(n) for n in range(1, 6)]) # the browsers' directories gone
+        self.assertEqual(log['made'], 4)
+        self.assertEqual(log['setup'], 4) # once for each browser
+        self.assertEqual(log['quit'], 4)
+        shutil.rmtree(directory)
+
+    def test_same_filename(self):
+        directory = tempfile.mkdtemp()
+        with open(os.path.join(directory, '2019.pdf'), 'wb') as f:
+            f.write(b'not to be overwritten')
+        make_browser = lambda browser_directory: FakeBrowser(browser_directory, set(), collections.Counter())
+        links = ['https://drive.google.com/file/d/{}'.format(name) for name in ['same1', 'same2']]
+        pool = webscraper.BrowserPool(2, directory, make_browser, start_time=0.2, loud=False)
+        downloads = pool.run(links)
+        self.assertEqual([os.path.basename(download.path) for download in downloads], ['2019-same1.pdf', '2019-same2.pdf'])
+        with open(os.path.join(directory, '2019.pdf'), 'rb') as f:
+            self.assertEqual(f.read(), b'not to be overwritten')
+        shutil.rmtree(directory)
+
+
+class FakeDownloader():
+    """Stands in for a 'downloader.Downloader', 'contents' being what each paper's file has in it by link"""
+
+    def __init__(self, directory, contents):
+        self.directory = directory
+        self.contents = contents
+        self.downloaded = []
+
+    def run(self, links, on_download=None):
+        downloads = []
+        for link in links:
+            path = os.path.join(self.directory, '{}.pdf'.format(catalog.file_id(link)))
+            with open(path, 'wb') as f:
+                f.write(self.contents[link])
+            self.downloaded.append(link)
+            downloads.append(downloader.Download(link, path, 'ok', None, 1, len(self.contents[link]), 0))
+            if on_download is not None:
+                on_download(downloads[-1])
+        return downloads
+
+
+class TestResume(unittest.TestCase):
+
+    def test_download(self):
+        directory = tempfile.mkdtemp()
+        links = ['https://drive.google.com/file/d/{}/view'.format(name) for name in ['ca117a', 'ca117b', 'ca116b']]
+        contents = dict(zip(links, [b'%PDF-1.4 a', b'%PDF-1.4 b', b'%PDF-1.4 b'])) # the last two are the same paper
+        with catalog.Catalog(os.path.join(directory, '.papers.db')) as papers:
+            for (module, link) in zip(['ca117', 'ca117', 'ca116'], links):
+                papers.add_listing(module, '2018', link)
+            direct = FakeDownloader(directory, contents)
+            scraper = webscraper.DCU_Webscraper(module='ca117', papers=papers, downloader=direct, make_browser=None)
+            scraper.download(links[:2]) # interrupted before the last one
+            scraper.download(links)
+            self.assertEqual(direct.downloaded, links) # each once
+            self.assertEqual(sorted(os.listdir(directory)), ['.papers.db', 'ca117a.pdf', 'ca117b.pdf']) # the same paper kept once
+            self.assertEqual(papers.paths('ca116'), [os.path.join(directory, 'ca117b.pdf')])
+            # only the scraper removes what it downloaded, the catalog leaves files be
+            link = 'https://drive.google.com/file/d/ca118b/view'
+            papers.add_listing('ca118', '2018', link)
+            mine = os.path.join(directory, 'mine.pdf')
+            with open(mine, 'wb') as f:
+                f.write(contents[links[1]])
+            self.assertEqual(papers.add_file(mine, link=link), os.path.join(directory, 'ca117b.pdf'))
+            self.assertTrue(os.path.isfile(mine))
+            os.remove(os.path.join(directory, 'ca117a.pdf'))
+            self.assertEqual(papers.pending(links), links[:1])
+            scraper.download(links)
+            self.assertEqual(direct.downloaded, links + links[:1])
+        shutil.rmtree(directory)
+
+
+class FakeListingBrowser():
+    """Stands in for a 'DCU_Website' on the papers web page, listing 'pages' of papers
+    Records a command in 'dcu_tracer' where the website wrapper would send one to the browser"""
+
+    def __init__(self, pages, log):
+        self.pages = pages
+        self.page = 0
+        self.log = log
+        self.dcu_tracer = None
+
+    def command(self, name):
+        if self.dcu_tracer is not None:
+            with self.dcu_tracer.span(name, 'command'):
+                pass
+
+    def dcu_mainpage(self):
+        self.command('get')
+        self.log['listed'] += 1
+        self.page = 0
+
+    def dcu_wait_for_data(self, css_selector):
+        pass
+
+    def dcu_deactivate_popup(self):
+        pass
+
+    def dcu_redraw(self, action):
+        return action()
+
+    def dcu_set_module(self, module_filter):
+        pass
+
+    def dcu_show_max(self):
+        pass
+
+    def dcu_harvest_papers(self):
+        self.command('executeScript')
+        return list(self.pages[self.page])
+
+    def dcu_total_pagination(self):
+        return len(self.pages)
+
+    def dcu_next_button(self):
+        return self
+
+    def click(self):
+        self.command('clickElement')
+        self.page += 1
+
+    def quit(self):
+        pass
+
+
+class TestListingCache(unittest.TestCase):
+
+    def test_list_papers(self):
+        log = collections.Counter()
+        pages = [
+            [('CA117', '2018', 'https://drive.google.com/file/d/a/view'), ('CA117', '2017', 'https://drive.google.com/file/d/b/view')],
+            [('CA117', '2016', 'https://drive.google.com/file/d/c/view')],
+        ]
+        links = [link for page in pages for (module, year, link) in page]
+        with catalog.Catalog() as papers:
+            scraper = webscraper.DCU_Webscraper(module='ca117', papers=papers, listing_ttl=3600,
+                make_browser=lambda: FakeListingBrowser(pages, log))
+            self.assertEqual(scraper.list_papers(), links)
+            self.assertEqual(log['listed'], 1)
+            # listed again from the catalog, without a browser
+            scraper = webscraper.DCU_Webscraper(module='CA117', papers=papers, listing_ttl=3600, make_browser=None)
+            self.assertEqual(scraper.list_papers(), links)
+            scraper.close()
+            # unless asked to, or the listing is too old
+            scraper = webscraper.DCU_Webscraper(module='ca117', papers=papers, listing_ttl=3600,
+                make_browser=lambda: FakeListingBrowser(pages, log))
+            self.assertEqual(scraper.list_papers(refresh=True), links)
+            papers.cache_listing('ca117', pages[0], fetched=time.time() - 7200)
+            self.assertEqual(scraper.list_papers(), links)
+            self.assertEqual(log['listed'], 3)
+            self.assertEqual(papers.cached_listing('ca117', 3600), [record for page in pages for record in page])
+
+
+class TestStandin(unittest.TestCase):
+
+    def setUp(self):
+        records = standin.generate_records('CA117', papers=3, others=5, years=2018)
+        self.server = standin.StandinServer(records, latency=0.05, bandwidth=512*1024, pages=2, size=128*1024).start()
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.server.close()
+        shutil.rmtree(self.directory)
+
+    def get(self, path):
+        with urllib.request.urlopen(self.server.url(path)) as response:
+            return response.read().decode()
+
+    def test_page(self):
+        page = self.get(standin.PAGE_PATH)
+        self.assertEqual(webscraper.parse_papers(page), self.server.listing())
+        for element_id in ['mySelection_wrapper', 'mySelection_length', 'mySelection_filter', 'mySelection_info',
+                'mySelection_next', 'mySelection_previous', 'sliding-popup']:
+            self.assertIn('id="{}"'.format(element_id), page) # as 'webscraper.css_sels' looks for them
+        self.assertEqual(len(self.server.listing('ca117')), 3)
+        viewer = self.get('/file/d/ca117-0/view')
+        self.assertIn('role="document"', viewer)
+        self.assertIn('aria-label="Download"', viewer)
+
+    def test_download(self):
+        links = [link for (module, year, link) in self.server.listing('CA117')]
+        direct = downloader.Downloader(self.directory, url_template=self.server.url(standin.DOWNLOAD_PATH), loud=False)
+        downloads = direct.run(links + [self.server.link('gone')])
+        direct.close()
+        self.assertEqual([download.status for download in downloads], ['ok'] * 3 + ['failed'])
+        self.assertEqual(sorted(os.listdir(self.directory)), ['16-ca117-2.pdf', '17-ca117-1.pdf', '18-ca117-0.pdf'])
+        for download in downloads[:3]:
+            self.assertGreaterEqual(download.seconds, 0.05 + 64/512) # latency, then 128 KiB at 512 KiB a second, give or take
+            self.assertEqual(download.bytes, 128*1024)
+            self.assertEqual(catalog.count_pages(download.path), 2)
+
+    def test_files(self):
+        path = os.path.join(self.directory, '2019.pdf')
+        with open(path, 'wb') as f:
+            f.write(b'%PDF-1.4\n%EOF\n')
+        server = standin.StandinServer([], files={'a': path, 'b': path}, flaky=['a'], confirm=['b']).start()
+        try:
+            url = server.url(standin.DOWNLOAD_PATH)
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                urllib.request.urlopen(url.format('a'))
+            self.assertEqual(cm.exception.code, 503) # the first time only
+            with urllib.request.urlopen(url.format('a')) as response:
+                self.assertEqual(response.read(), b'%PDF-1.4\n%EOF\n')
+                self.assertEqual(response.headers['Content-Disposition'], 'attachment; filename="2019.pdf"')
+            with urllib.request.urlopen(url.format('b')) as response:
+                self.assertIn('confirm=t0k-3n', response.read().decode()) # asks first, like Drive
+            with urllib.request.urlopen(url.format('b') + '&confirm=t0k-3n') as response:
+                self.assertEqual(response.read(), b'%PDF-1.4\n%EOF\n')
+            self.assertEqual(server.downloads, {'a': 2, 'b': 2})
+        finally:
+            server.close()
+        server = standin.StandinServer([], files={'cut': path, 'gz': path}, truncated=['cut'], gzipped=['gz']).start()
+        try:
+            url = server.url(standin.DOWNLOAD_PATH)
+            with self.assertRaises(http.client.IncompleteRead):
+                with urllib.request.urlopen(url.format('cut')) as response:
+                    response.read()
+            with urllib.request.urlopen(url.format('gz')) as response:
+                self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+                self.assertEqual(gzip.decompress(response.read()), b'%PDF-1.4\n%EOF\n')
+        finally:
+            server.close()
+
+
+class FakeExecutor():
+    """Stands in for selenium's connection to the browser, answering every command
+    (with the next of 'answers[command]' while there are any, eg: what a script run in the page answers)"""
+
+    def __init__(self, answers=None):
+        self.commands = []
+        self.answers = answers or {}
+
+    def execute(self, command, params):
+        self.commands.append((command, dict(params)))
+        if self.answers.get(command):
+            return {'status': 0, 'value': self.answers[command].pop(0)}
+        return {'status': 0, 'value': '{} done'.format(command)}
+
+
+def element(element_id):
+    """How the browser answers with an element"""
+    return {'element-6066-11e4-a52e-4f735466cecf': element_id}
+
+
+class TestTrace(unittest.TestCase):
+
+    def test_phases(self):
+        pages = [[('CA117', '2018', 'https://drive.google.com/file/d/a/view')]] * 3
+        tracer = webtrace.Tracer()
+        scraper = webscraper.DCU_Webscraper(module='ca117', make_browser=lambda: FakeListingBrowser(pages, collections.Counter()),
+            tracer=tracer)
+        scraper.list_papers()
+        totals = tracer.totals()
+        self.assertEqual(list(totals), ['setup', 'filter', 'pagination', 'harvest'])
+        self.assertEqual([total['round_trips'] for total in totals.values()], [1, 0, 2, 3]) # 2 clicks to the next page, 3 pages read
+        executes = totals['harvest']['commands']['executeScript']
+        self.assertEqual((executes['count'], executes['round_trips']), (3, 3))
+        trace = tracer.to_chrome_trace()['traceEvents']
+        self.assertEqual(set(event['ph'] for event in trace), set(['X']))
+        self.assertEqual([event['name'] for event in trace if event['cat'] == 'phase'],
+            ['setup', 'filter', 'pagination', 'harvest', 'pagination', 'pagination', 'harvest', 'pagination', 'harvest'])
+        directory = tempfile.mkdtemp()
+        for format in ('json', 'chrome'):
+            path = os.path.join(directory, 'trace.json')
+            tracer.save(path, format)
+            with open(path, 'r') as f:
+                self.assertIn('phases' if format == 'json' else 'traceEvents', json.load(f))
+        shutil.rmtree(directory)
+
+    def test_website(self):
+        # a 'DCU_Website' that never started Firefox, its commands answered by 'FakeExecutor' ('execute' calls up to selenium's)
+        tracer = webtrace.Tracer()
+        browser = webscraper.DCU_Website.__new__(webscraper.DCU_Website)
+        browser.session_id = 'session'
+        browser.command_executor = FakeExecutor()
+        browser.error_handler = ErrorHandler()
+        browser.dcu_tracer = tracer
+        response = webscraper.DCU_Website.execute(browser, 'getTitle')
+        self.assertEqual(response['value'], 'getTitle done')
+        webscraper.DCU_Website.dcu_mainpage(browser)
+        self.assertEqual(browser.command_executor.commands, [('getTitle', {'sessionId': 'session'}),
+            ('get', {'url': webscraper.urls['main'], 'sessionId': 'session'})])
+        events = sorted(tracer.events, key=lambda event: event['start'])
+        self.assertEqual([(event['name'], event['category'], event['depth']) for event in events],
+            [('getTitle', 'command', 0), ('dcu_mainpage', 'call', 0), ('get', 'command', 1)])
+        self.assertEqual(events[1]['round_trips'], 1) # the command sent inside the call
+        self.assertEqual(events[2]['args'], {'url': webscraper.urls['main']}) # without the session id
+        browser.dcu_tracer = None # untraced, the same as without a tracer
+        webscraper.DCU_Website.dcu_mainpage(browser)
+        self.assertEqual(len(tracer.events), 3)
+        self.assertEqual(len(browser.command_executor.commands), 3)
+
+
+class TestEventWaits(unittest.TestCase):
+
+    def website(self, answers, event_waits=True, settle_time=0.05):
+        # a 'DCU_Website' that never started Firefox (see 'TestTrace.test_website'), speaking the W3C protocol
+        browser = webscraper.DCU_Website.__new__(webscraper.DCU_Website)
+        browser.session_id = 'session'
+        browser.command_executor = FakeExecutor(answers)
+        browser.error_handler = ErrorHandler()
+        browser.w3c = True
+        browser.dcu_tracer = None
+        browser.dcu_wait_time = 2
+        browser.dcu_sliding_time = 3
+        browser.dcu_event_waits = event_waits
+        browser.dcu_settle_time = settle_time
+        browser.dcu_script_timeout = None
+        return browser
+
+    def scripts_run(self, browser):
+        """(script name, arguments) of each script run in the page, in order"""
+        names = {script: name for (name, script) in webscraper.scripts.items()}
+        return [(names[params['script']], params['args']) for (command, params) in browser.command_executor.commands
+            if command in ('w3cExecuteScript', 'w3cExecuteScriptAsync')]
+
+    def test_scripts(self):
+        self.assertEqual(set(webscraper.scripts), set(['find', 'hidden', 'draws', 'drawn']))
+        for name in ('find', 'hidden', 'drawn'): # run with 'dcu_wait_script', answering through the callback
+            self.assertIn('done = arguments[arguments.length - 1]', webscraper.scripts[name])
+        self.assertIn('return state.count;', webscraper.scripts['draws'])
+
+    def test_find(self):
+        browser = self.website({'w3cExecuteScriptAsync': [element('a'), [element('b'), element('c')]]})
+        self.assertEqual(browser.dcu_find('#mySelection').id, 'a')
+        self.assertEqual([found.id for found in browser.dcu_finds('#mySelection tr')], ['b', 'c'])
+        self.assertEqual(self.scripts_run(browser), [('find', ['#mySelection', False, 2000]), ('find', ['#mySelection tr', True, 2000])])
+        # the script timeout is set once, a little after the scripts' own
+        self.assertEqual([params for (command, params) in browser.command_executor.commands if command == 'setTimeouts'],
+            [{'script': 7000, 'sessionId': 'session'}])
+
+    def test_timeout(self):
+        # the scripts answer null/false when nothing happened in time
+        browser = self.website({'w3cExecuteScriptAsync': [None, None, None, False, element('popup'), False],
+            'w3cExecuteScript': [0]})
+        with self.assertRaises(TimeoutException):
+            browser.dcu_find('#mySelection')
+        with self.assertRaises(TimeoutException):
+            browser.dcu_finds('#mySelection tr')
+        with self.assertRaises(TimeoutException):
+            browser.dcu_wait_for_data('#mySelection', 1)
+        with self.assertRaises(TimeoutException):
+            browser.dcu_redraw(lambda: None)
+        with self.assertRaises(TimeoutException):
+            browser.dcu_deactivate_popup()
+        self.assertEqual([name for (name, args) in self.scripts_run(browser)], ['find'] * 3 + ['draws', 'drawn', 'find', 'hidden'])
+
+    def test_redraw(self):
+        browser = self.website({'w3cExecuteScript': [3], 'w3cExecuteScriptAsync': [True]})
+        sent = []
+        def action():
+            sent.append(len(browser.command_executor.commands))
+            return 'filtered'
+        self.assertEqual(browser.dcu_redraw(action), 'filtered')
+        # the draws are counted before the action, so a table drawn again before 'drawn' runs (more than 3 draws) is not waited for
+        self.assertEqual(self.scripts_run(browser), [('draws', ['#mySelection']), ('drawn', [3, 50, 2000])])
+        self.assertEqual(sent, [1])
+
+    def test_settle_time(self):
+        for (settle_time, settle) in [(0.25, 250), (0, 0)]:
+            browser = self.website({'w3cExecuteScript': [0], 'w3cExecuteScriptAsync': [True]}, settle_time=settle_time)
+            browser.dcu_redraw(lambda: None)
+            self.assertEqual(self.scripts_run(browser)[-1], ('drawn', [0, settle, 2000]))
+        # without event waits the action is all there is
+        browser = self.website({}, event_waits=False)
+        self.assertEqual(browser.dcu_redraw(lambda: 'filtered'), 'filtered')
+        self.assertEqual(browser.command_executor.commands, [])
+
+    def test_deactivate_popup(self):
+        browser = self.website({'w3cExecuteScriptAsync': [element('popup'), True]})
+        browser.dcu_deactivate_popup()
+        popup = webscraper.css_sels['popupbutton']
+        self.assertEqual(self.scripts_run(browser), [('find', [popup, False, 2000]), ('hidden', [popup, 3000])])
+        self.assertEqual([(command, params.get('id')) for (command, params) in browser.command_executor.commands
+            if command != 'setTimeouts'], [('w3cExecuteScriptAsync', None), ('clickElement', 'popup'), ('w3cExecuteScriptAsync', None)])
+        # set again for the pop-up's longer wait
+        self.assertEqual([params['script'] for (command, params) in browser.command_executor.commands if command == 'setTimeouts'],
+            [7000, 8000])
+
+    @unittest.skipUnless(os.path.exists(webscraper.paths['driver']), 'no geckodriver')
+    def test_standin(self):
+        # the scripts in a real browser, against the stand-in's pop-up and table
+        records = standin.generate_records('CA117', papers=3, others=30, years=2018)
+        server = standin.StandinServer(records).start()
+        directory = tempfile.mkdtemp()
+        browser = webscraper.headless_browser(directory)
+        try:
+            browser.get(server.url(standin.PAGE_PATH))
+            browser.dcu_deactivate_popup()
+            browser.dcu_show_max()
+            browser.dcu_redraw(lambda: browser.dcu_set_module('ca117'))
+            self.assertEqual(browser.dcu_harvest_papers(), server.listing('ca117'))
+        finally:
+            browser.quit()
+            server.close()
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()